@@ -1,27 +1,38 @@
 from __future__ import annotations
 
-from typing import TypedDict, Union
-from langgraph.graph import StateGraph, START, END
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+from typing import TYPE_CHECKING, Callable, Iterator, TypedDict, Union
 from dotenv import load_dotenv
-from playwright.sync_api import sync_playwright, Page
-from openai import OpenAI
 import time
 import base64
+import hashlib
+import io
 import json
 import re
 import os
-from collections import Counter
+import queue
+import random
+import shutil
+import threading
+from collections import Counter, deque
+from dataclasses import asdict, dataclass, field
 import math
 from urllib.parse import urlparse
-load_dotenv()
-
-# Create screenshots directory
 from pathlib import Path
-os.makedirs("screenshots", exist_ok=True)
+try:
+    import fcntl
+except ImportError:  # Windows: LLM gateway limits then apply per process only
+    fcntl = None
+
+# Heavy dependencies (langgraph/langchain_core, playwright, openai) are imported on first
+# use, so `import agent2` stays cheap - see _import_graph_runtime(), ensure_browser() and
+# _openai_client(). `python bench.py startup` checks the import-time budget.
+if TYPE_CHECKING:
+    from playwright.sync_api import Page
+load_dotenv()
 
 # Global variables
 i = 0
+_recursion_limit = 50  # graph recursion limit of the current run (set in stream_task)
 screenshots_dir = Path("screenshots")  # Will be updated per task in set_goal()
 
 # Global playwright resources (will be initialized in main)
@@ -30,16 +41,28 @@ _browser = None
 _context = None
 _page = None
 
+# Progress logging; turn off (AGENT_VERBOSE=0 or verbose=False) to keep prints off the hot path
+VERBOSE = os.getenv("AGENT_VERBOSE", "1") != "0"
+
+def log(*args, **kwargs):
+    if VERBOSE:
+        print(*args, **kwargs)
+
+# Interactive mode: blocking input() prompts for missing task fields and manual login (opt-in)
+INTERACTIVE = False
+_login_handler = None  # LoginHandler used when a login page is detected (see run_task)
+
 class RAGDoc(dict):
     # fields: app, intent, title, text
     pass
 
 class TinyRAG:
-    def __init__(self):
+    def __init__(self, seed: Callable[[TinyRAG], None] | None = None):
         self.docs: list[RAGDoc] = []
         self.vocab: Counter = Counter()
         self.df: Counter = Counter()
         self.N = 0  # number of docs
+        self._seed = seed  # corpus loader, run on the first retrieve()
 
     def _tok(self, s: str) -> list[str]:
         return re.findall(r"[a-z0-9]+", s.lower())
@@ -72,6 +95,9 @@ class TinyRAG:
         return 0.0 if (da==0 or db==0) else num/(da*db)
 
     def retrieve(self, query: str, k: int = 5, app: str|None=None, intent: str|None=None) -> list[RAGDoc]:
+        if self._seed is not None:
+            seed, self._seed = self._seed, None
+            seed(self)
         qv = self._tfidf_vec(query)
         scored = []
         for d in self.docs:
@@ -107,10 +133,10 @@ def parse_intent_min(goal: str) -> str:
         return "filter"
     return "generic"
 
-# Instantiate and seed tiny knowledge
-RAG = TinyRAG()
+# Tiny knowledge base, seeded on first use (the planner's first retrieve)
+def seed_rag(rag: TinyRAG):
 # ===== Generic cross-app navigation heuristics =====
-RAG.add("generic","create","Creation affordances",
+    rag.add("generic","create","Creation affordances",
 """To create things, prefer buttons/links whose labels match: new|add|create|\\+.
 
 CRITICAL SEQUENCE (always follow this order!):
@@ -143,7 +169,7 @@ DO NOT:
 
 Templates: If modal appears, pick blank/empty option before naming.""")
 
-RAG.add("generic","settings","Settings surface discovery",
+    rag.add("generic","settings","Settings surface discovery",
 """When goal mentions settings/theme/appearance/preferences/account, find Settings using spatial patterns:
 
 COMMON UI POSITIONS FOR SETTINGS:
@@ -172,12 +198,12 @@ SPATIAL HINTS:
 
 AVOID: Hovering randomly before checking obvious menu buttons!""")
 
-RAG.add("generic","create","Completion cues for lists/tables",
+    rag.add("generic","create","Completion cues for lists/tables",
 """Consider completion when a toolbar with Filter|Sort|Group or a View tab appears,
 AND the title field (textbox/contenteditable) matches the desired name.
 If title mismatches, focus the nearest visible naming field and type the target name.""")
 
-RAG.add("generic","generic","UI layout patterns",
+    rag.add("generic","generic","UI layout patterns",
 """Modern web apps follow common spatial patterns:
 
 **Top navigation bar (horizontal):**
@@ -197,7 +223,7 @@ RAG.add("generic","generic","UI layout patterns",
 
 When exploring, check corners and edges systematically before random hovering!""")
 
-RAG.add("generic","generic","Exploration policy",
+    rag.add("generic","generic","Exploration policy",
 """When stuck and target element not immediately visible:
 1. First, check if it's hidden in a menu (click menus in corners or with "Menu" in name)
 2. If still not found, SCROLL down to reveal more content
@@ -205,7 +231,7 @@ RAG.add("generic","generic","Exploration policy",
 
 AVOID: Hovering on generic 'more' buttons as first action - exhaust direct navigation first!""")
 
-RAG.add("generic","filter","Filter and search workflows",
+    rag.add("generic","filter","Filter and search workflows",
 """To filter items by criteria:
 1. FIRST ensure you're on the correct page (Projects vs Issues vs Views).
 2. Click 'Add filter' or 'Filter' button to open filter menu.
@@ -215,13 +241,13 @@ RAG.add("generic","filter","Filter and search workflows",
    - Or click the field name (Status), then select the value from dropdown.
 5. Avoid looking for radio buttons that don't exist - use the searchbox!""")
 
-RAG.add("generic","filter","Page navigation before filtering",
+    rag.add("generic","filter","Page navigation before filtering",
 """If goal mentions filtering PROJECTS, ensure you're on the Projects page first.
 If goal mentions filtering ISSUES, ensure you're on the Issues page first.
 Look for navigation links/buttons like [button] Projects, [link] Projects, [button] Issues.
 Click them BEFORE applying filters.""")
 
-RAG.add("generic","generic","Multi-step workflows",
+    rag.add("generic","generic","Multi-step workflows",
 """Many workflows require multiple steps in sequence:
 - Invitation: Click 'Invite' button → Modal opens → Type email → Click 'Send invite'
 - Application: Click job listing → Click 'Apply' → Fill form → Click 'Submit'
@@ -232,7 +258,7 @@ Opening a modal (via 'Invite', 'Add', 'Create') is NOT completion - it's step 1.
 Look for textboxes/forms that appeared after clicking, then fill them.
 Final buttons like 'Send', 'Submit', 'Confirm' indicate completion.""")
 
-RAG.add("generic","generic","Semantic element matching",
+    rag.add("generic","generic","Semantic element matching",
 """Use semantic understanding to match elements - don't be too literal!
 
 CREATION BUTTONS (all mean the same thing):
@@ -250,7 +276,7 @@ INVITATION/MEMBERS (all mean the same thing):
 
 When looking for an element, use BROAD patterns to catch variations!""")
 
-RAG.add("generic","generic","Data extraction from goals",
+    rag.add("generic","generic","Data extraction from goals",
 """Extract specific values from goals and use them in your actions:
 - Email addresses: user@domain.com format → type into email/search fields
 - Names/titles: text after 'name it', 'call it', 'titled', 'write the following' → type into title/name fields
@@ -262,7 +288,7 @@ Example goals and what to type:
 - "create task and write: X" → type "X" into task name field
 - "filter by status being Done" → type "Done" into filter box""")
 
-RAG.add("generic","generic","Action buttons on detail views",
+    rag.add("generic","generic","Action buttons on detail views",
 """Some buttons only appear after selecting an item:
 - LinkedIn: 'Easy Apply' appears after clicking a job listing
 - Email: 'Reply' appears after clicking an email
@@ -274,32 +300,532 @@ If looking for an action button (Apply, Edit, Delete, Reply) but it's not visibl
 3. The action button will appear in the detail panel""")
 
 # Optional: app-hint docs (still generic language)
-RAG.add("notion","create","Hint: contenteditable titles",
+    rag.add("notion","create","Hint: contenteditable titles",
 """Title fields may be contenteditable elements (role textbox or contenteditable='true').
 Click once, Select All, Backspace, then type the desired name. Avoid template search boxes when naming.""")
 
-RAG.add("notion","create","Hint: template dialogs",
+    rag.add("notion","create","Hint: template dialogs",
 """If a creation modal offers multiple templates, pick a blank/empty option before typing names.
 Typing into a search field inside the template picker does not rename the new item.""")
 
-    # ---------- Minimal RAG injection ----------
+RAG = TinyRAG(seed=seed_rag)
+
+
+
 
 
+# ===== Persistent browser sessions =====
+# Each app's storage_state (cookies + localStorage) is saved after a successful login
+# and loaded into new contexts, so later tasks start authenticated.
+AUTH_DIR = Path(os.getenv("AGENT_AUTH_DIR", "auth"))
+SESSION_MAX_AGE_H = float(os.getenv("AGENT_SESSION_MAX_AGE_H", "168"))  # discard saved sessions older than this
+SESSION_REFRESH_H = float(os.getenv("AGENT_SESSION_REFRESH_H", "12"))  # re-save a live session after this long
+
+_session_key = ""        # Session the current task wants (set in set_goal)
+_context_session = None  # Session key the open context was created for
+_session_loaded = False  # True if the open context was seeded from a saved session
+_saw_login_page = False  # A login page was seen since the last save
+
+def session_key(url: str) -> str:
+    """Key sessions by detect_app(); fall back to the hostname for generic apps."""
+    app_name = detect_app(url)
+    if app_name != "generic":
+        return app_name
+    return (urlparse(url).hostname or "default").removeprefix("www.")
+
+def _session_path(key: str) -> Path:
+    safe_key = re.sub(r'[^\w.-]', '_', key)
+    return AUTH_DIR / f"{safe_key}.json"
+
+def _session_expired(path: Path) -> str:
+    """Return why a saved session is unusable, or '' if it looks valid."""
+    age_h = (time.time() - path.stat().st_mtime) / 3600
+    if age_h > SESSION_MAX_AGE_H:
+        return f"saved {age_h:.0f}h ago (max {SESSION_MAX_AGE_H:.0f}h)"
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except Exception as e:
+        return f"unreadable ({e})"
+    # Session cookies have expires == -1; only persistent cookies can expire
+    persistent = [c.get("expires", -1) for c in saved.get("cookies", []) if c.get("expires", -1) > 0]
+    if persistent and max(persistent) < time.time():
+        return "all cookies expired"
+    if not saved.get("cookies") and not saved.get("origins"):
+        return "empty"
+    return ""
+
+def load_session(key: str) -> str | None:
+    """Path to a valid saved storage_state for this key, or None (stale files are removed)."""
+    path = _session_path(key)
+    if not path.exists():
+        return None
+    reason = _session_expired(path)
+    if reason:
+        log(f"🔑 Saved session '{key}' is stale: {reason} - discarding")
+        invalidate_session(key)
+        return None
+    return str(path)
+
+def save_session(key: str | None = None):
+    """Persist the current context's storage_state for the given (or current) session key."""
+    global _saw_login_page
+    key = key or _session_key
+    if _context is None or not key:
+        return
+    try:
+        AUTH_DIR.mkdir(parents=True, exist_ok=True)
+        _context.storage_state(path=str(_session_path(key)))
+        _saw_login_page = False
+        log(f"🔑 Session saved: {_session_path(key)}")
+    except Exception as e:
+        log(f"⚠️  Could not save session '{key}': {e}")
+
+def invalidate_session(key: str | None = None):
+    key = key or _session_key
+    try:
+        _session_path(key).unlink()
+    except FileNotFoundError:
+        pass
+
+def track_session(page: Page, is_logged_in: bool):
+    """Save the session after a login completes, and refresh a live session periodically."""
+    global _session_loaded
+    if LOGIN_URL_PATTERN.search(page.url.split('?')[0]) or not is_logged_in:
+        return
+    path = _session_path(_session_key)
+    if _saw_login_page:
+        save_session()
+        _session_loaded = True
+    elif _session_loaded and path.exists() and (time.time() - path.stat().st_mtime) / 3600 > SESSION_REFRESH_H:
+        log("🔑 Refreshing saved session")
+        save_session()
+
+# ===== Network profiles =====
+# Marketing-heavy landing pages hold "load" open for video, web fonts and analytics beacons
+# the agent never looks at. A route profile blocks those requests by URL and domain inside
+# Chromium (CDP Network.setBlockedURLs), so nothing round-trips through Python and the HTTP
+# cache stays on; only stubbed types (images under 'minimal') go through a narrow Python route.
+# Documents, scripts, styles and XHR always pass, so the app keeps working.
+HEADLESS = os.getenv("AGENT_HEADLESS", "0") == "1"
+# 1x1 transparent PNG served in place of images (keeps <img> load events and layout intact)
+_PIXEL_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII=")
+
+ANALYTICS_DOMAINS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "segment.io", "segment.com", "hotjar.com", "fullstory.com", "amplitude.com", "mixpanel.com",
+    "heapanalytics.com", "clarity.ms", "connect.facebook.net", "px.ads.linkedin.com",
+    "bat.bing.com", "analytics.tiktok.com", "sentry.io", "datadoghq-browser-agent.com",
+)
+# Chromium blocks by URL, not resource type: file extensions standing in for each type
+_TYPE_EXTENSIONS = {
+    "font": ("woff", "woff2", "ttf", "otf", "eot"),
+    "media": ("mp4", "webm", "ogg", "ogv", "mp3", "m4a", "m3u8", "mpd", "mov"),
+    "texttrack": ("vtt", "srt"),
+    "manifest": ("webmanifest",),
+    "image": ("png", "jpg", "jpeg", "gif", "webp", "avif", "svg", "ico"),
+}
+# Rough transfer sizes of what we skip, for the per-run "bytes saved" estimate (bench.py routes measures it)
+_EST_BYTES = {"image": 40_000, "media": 500_000, "font": 35_000, "script": 60_000, "ping": 500}
+
+@dataclass(frozen=True)
+class RouteProfile:
+    name: str
+    block_types: frozenset = frozenset()  # blocked in Chromium by file extension (_TYPE_EXTENSIONS)
+    stub_types: frozenset = frozenset()  # answered from Python with a pixel, matched by file extension
+    block_domains: tuple = ()  # blocked in Chromium by host (the domain and its subdomains)
+
+ROUTE_PROFILES = {
+    "off": RouteProfile("off"),
+    # Screenshot-faithful: keeps images for the vision planner
+    "lean": RouteProfile("lean", block_types=frozenset({"media", "font"}), block_domains=ANALYTICS_DOMAINS),
+    # Benchmarks / non-vision runs: images become a transparent pixel too
+    "minimal": RouteProfile("minimal", block_types=frozenset({"media", "font", "texttrack", "manifest"}),
+                            stub_types=frozenset({"image"}), block_domains=ANALYTICS_DOMAINS),
+}
+ROUTE_PROFILE = os.getenv("AGENT_ROUTE_PROFILE", "")  # '' = 'lean' headless, else 'off'; --route-profile
+
+def route_profile() -> RouteProfile:
+    """Profile from AGENT_ROUTE_PROFILE; defaults to 'lean' for headless runs, 'off' otherwise."""
+    name = ROUTE_PROFILE or ("lean" if HEADLESS else "off")
+    profile = ROUTE_PROFILES.get(name, ROUTE_PROFILES["off"])
+    extra = tuple(d.strip() for d in os.getenv("AGENT_ROUTE_BLOCK_DOMAINS", "").split(",") if d.strip())
+    if extra and profile.name != "off":
+        profile = RouteProfile(profile.name, profile.block_types, profile.stub_types, profile.block_domains + extra)
+    return profile
+
+@dataclass
+class RouteStats:
+    """What the active route profile did during this run."""
+    profile: str = "off"
+    requests: int = 0
+    blocked: int = 0
+    stubbed: int = 0
+    bytes_saved_est: int = 0
+    by_type: Counter = field(default_factory=Counter)  # skipped requests per resource type
+    load_ms: float = 0.0  # first navigation of the run
+
+    def reset(self, profile: str):
+        self.__init__(profile)
+
+    def skipped(self, resource_type: str, stubbed: bool):
+        if stubbed:
+            self.stubbed += 1
+        else:
+            self.blocked += 1
+        self.by_type[resource_type] += 1
+        self.bytes_saved_est += _EST_BYTES.get(resource_type, 5_000)
+
+    def summary(self) -> str:
+        types = ", ".join(f"{t} {n}" for t, n in self.by_type.most_common())
+        return (f"profile '{self.profile}': {self.requests} requests, {self.blocked} blocked, {self.stubbed} stubbed"
+                f" (~{self.bytes_saved_est / 1e6:.1f} MB saved{'; ' + types if types else ''}); "
+                f"first load {self.load_ms:.0f} ms")
+
+ROUTE_STATS = RouteStats()
+
+def _blocked_url_patterns(profile: RouteProfile) -> list[str]:
+    """Network.setBlockedURLs wildcards for the profile's blocked types and domains."""
+    # Chrome matches the whole URL, so an extension is anchored to the end of the path
+    # ("*.mov" / "*.mov?*") - an unanchored "*.mov*" would also block www.movistar.es
+    patterns = [pattern for rtype in sorted(profile.block_types) for ext in _TYPE_EXTENSIONS.get(rtype, ())
+                for pattern in (f"*.{ext}", f"*.{ext}?*")]
+    for domain in profile.block_domains:
+        patterns += [f"*://{domain}/*", f"*://*.{domain}/*"]
+    return patterns
+
+def install_route_profile(context, profile: RouteProfile | None = None, stats: RouteStats | None = None):
+    """Apply the profile to every page of the context (no-op for 'off')."""
+    profile = profile or route_profile()
+    stats = stats or ROUTE_STATS
+    stats.profile = profile.name
+    if profile.name == "off":
+        return
+    patterns = _blocked_url_patterns(profile)
+
+    def _block(page):
+        try:
+            session = context.new_cdp_session(page)
+            session.send("Network.enable")
+            session.send("Network.setBlockedURLs", {"urls": patterns})
+        except Exception:
+            pass  # page closed before it was set up
+
+    def _request(request):
+        stats.requests += 1
+
+    def _failed(request):
+        if "ERR_BLOCKED_BY_CLIENT" in (request.failure or ""):
+            stats.skipped(request.resource_type, stubbed=False)
+
+    for page in context.pages:
+        _block(page)
+    context.on("page", _block)
+    context.on("request", _request)
+    context.on("requestfailed", _failed)
+    if not profile.stub_types:
+        return
+
+    def _stub(route):
+        rtype = route.request.resource_type
+        try:
+            if rtype in profile.stub_types:
+                stats.skipped(rtype, stubbed=True)
+                route.fulfill(status=200, content_type="image/png", body=_PIXEL_PNG)
+            else:
+                route.fallback()  # next handler (HAR replay) or the network
+        except Exception:
+            pass  # page closed / request already handled
+
+    # Only URLs with a stubbed type's extension reach Python; everything else stays in Chromium
+    extensions = [ext for rtype in sorted(profile.stub_types) for ext in _TYPE_EXTENSIONS.get(rtype, ())]
+    context.route(re.compile(r"\.(" + "|".join(extensions) + r")(?:[?#]|$)", re.IGNORECASE), _stub)
+
+# ===== HAR record / replay =====
+# Live-network jitter swamps inspector/executor timings. In record mode the task's context
+# writes all traffic to hars/<task>.har (flushed when the context closes); in replay mode the
+# context is served from that HAR, so the same task can be re-run and benchmarked offline.
+HAR_DIR = Path(os.getenv("AGENT_HAR_DIR", "hars"))
+HAR_MODE = os.getenv("AGENT_HAR", "")  # '', 'record' or 'replay'
+HAR_NOT_FOUND = os.getenv("AGENT_HAR_NOT_FOUND", "abort")  # replay misses: 'abort' (offline) or 'fallback' (network)
+HAR_PATH = os.getenv("AGENT_HAR_PATH", "")  # '' = hars/<task>.har; --har-path
+_har_path: Path | None = None  # HAR for the current task (set in _activate_task)
+_context_har: Path | None = None  # HAR the open context records to / replays from
+
+def har_path(task_name: str) -> Path:
+    return Path(HAR_PATH or HAR_DIR / f"{_task_slug(task_name)}.har")
+
+def har_context_options(path: Path | None) -> dict:
+    """new_context() kwargs for record mode."""
+    if HAR_MODE != "record" or path is None:
+        return {}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return {"record_har_path": str(path), "record_har_content": "embed"}
+
+def attach_har(context, path: Path | None):
+    """Serve the context from the HAR in replay mode."""
+    if HAR_MODE != "replay" or path is None:
+        return
+    if not path.exists():
+        raise FileNotFoundError(f"No HAR to replay at {path} - record one first with AGENT_HAR=record")
+    context.route_from_har(str(path), not_found=HAR_NOT_FOUND)
+    log(f"📼 Replaying traffic from {path} (unmatched requests: {HAR_NOT_FOUND})")
+
+def finish_har():
+    """Close a recording context so Playwright writes the HAR; the next get_page() opens a fresh one."""
+    global _context, _page, _context_session, _context_har
+    if HAR_MODE != "record" or _context is None or _context_har is None:
+        return
+    try:
+        _context.close()
+        log(f"📼 Recorded traffic to {_context_har}")
+    except Exception as e:
+        log(f"⚠️  Could not save HAR {_context_har}: {e}")
+    _context = None
+    _page = None
+    _context_session = None
+    _context_har = None
+
+def ensure_browser():
+    """Start Playwright and launch Chromium if not already running (contexts are created per session)."""
+    global _playwright, _browser
+    if _browser is None:
+        from playwright.sync_api import sync_playwright
+        started = time.perf_counter()
+        _playwright = sync_playwright().start()
+        _browser = _playwright.chromium.launch(headless=HEADLESS)
+        log(f"🚀 Chromium launched in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return _browser
+
+# ===== Screenshot store =====
+# Screenshots are stored once per content hash under screenshots/.store/<ab>/<sha256>.png, with a
+# small JPEG thumbnail next to them (needs Pillow; skipped without it). The task folder keeps its
+# familiar step_N.png / step_current.png names as hard links to the blobs (copies where linking
+# isn't possible) plus manifest.jsonl, one line per capture, so every frame of the audit trail -
+# including each overwritten step_current.png - still resolves to its image.
+# Retention runs at task start: task folders older than SCREENSHOT_MAX_AGE_DAYS go first, then
+# the oldest tasks until the store fits in SCREENSHOT_MAX_MB; blobs no task references are deleted.
+SCREENSHOT_ROOT = Path("screenshots")
+SCREENSHOT_STORE_DIR = SCREENSHOT_ROOT / ".store"  # a dot name can't collide with a task slug
+SCREENSHOT_MAX_AGE_DAYS = float(os.getenv("AGENT_SCREENSHOT_MAX_AGE_DAYS", "14"))  # 0 = keep forever
+SCREENSHOT_MAX_MB = float(os.getenv("AGENT_SCREENSHOT_MAX_MB", "2048"))  # 0 = no size cap
+SCREENSHOT_THUMB_WIDTH = int(os.getenv("AGENT_SCREENSHOT_THUMB_WIDTH", "320"))  # 0 = no thumbnails
+SCREENSHOT_PRUNE_EVERY_S = 600  # batch runs start many tasks; don't rescan the tree for each one
+SCREENSHOT_MANIFEST = "manifest.jsonl"
+
+class ScreenshotStore:
+    """Content-addressed screenshot blobs shared by all tasks, linked into per-task folders."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.stats = {"frames": 0, "deduped": 0, "bytes_saved": 0}
+        self._thumbs = SCREENSHOT_THUMB_WIDTH > 0
+
+    def blob_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / f"{digest}.png"
+
+    def thumb_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / f"{digest}.thumb.jpg"
+
+    def put(self, png: bytes, dest: Path, step: int, url: str = "") -> str:
+        """Store a PNG under its hash, point dest at it and log it in dest's task manifest."""
+        digest = hashlib.sha256(png).hexdigest()
+        blob = self.blob_path(digest)
+        self.stats["frames"] += 1
+        if blob.exists():
+            self.stats["deduped"] += 1
+            self.stats["bytes_saved"] += len(png)
+        else:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            tmp = blob.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_bytes(png)
+            tmp.replace(blob)
+            self._thumbnail(png, digest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(dest.name + ".tmp")
+        tmp.unlink(missing_ok=True)
+        try:
+            os.link(blob, tmp)
+        except OSError:
+            shutil.copyfile(blob, tmp)
+        tmp.replace(dest)
+        with open(dest.parent / SCREENSHOT_MANIFEST, "a") as f:
+            f.write(json.dumps({"ts": round(time.time(), 3), "step": step, "file": dest.name,
+                                "sha256": digest, "url": url}) + "\n")
+        return digest
+
+    def _thumbnail(self, png: bytes, digest: str):
+        if not self._thumbs:
+            return
+        try:
+            from PIL import Image
+        except ImportError:
+            log("ℹ️  Pillow not installed - screenshot thumbnails disabled (pip install pillow)")
+            self._thumbs = False
+            return
+        try:
+            with Image.open(io.BytesIO(png)) as im:
+                im.thumbnail((SCREENSHOT_THUMB_WIDTH, SCREENSHOT_THUMB_WIDTH * 4))
+                im.convert("RGB").save(self.thumb_path(digest), "JPEG", quality=60, optimize=True)
+        except Exception as e:
+            log(f"⚠️  Thumbnail failed: {e}")
 
+    def audit(self, task_dir: Path) -> list[dict]:
+        """The task's manifest, each capture resolved to its blob and thumbnail paths."""
+        try:
+            lines = (task_dir / SCREENSHOT_MANIFEST).read_text().splitlines()
+        except FileNotFoundError:
+            return []
+        frames = []
+        for line in lines:
+            entry = json.loads(line)
+            thumb = self.thumb_path(entry["sha256"])
+            frames.append({**entry, "path": str(self.blob_path(entry["sha256"])),
+                           "thumb": str(thumb) if thumb.exists() else ""})
+        return frames
+
+    @staticmethod
+    def _task_refs(task_dir: Path) -> set[str]:
+        try:
+            return {json.loads(line)["sha256"] for line in (task_dir / SCREENSHOT_MANIFEST).read_text().splitlines()}
+        except (FileNotFoundError, ValueError, KeyError):
+            return set()
+
+    def prune(self, keep: Path | None = None, force: bool = False) -> dict:
+        """Apply retention: drop expired task folders, then oldest ones over the size cap, then orphan blobs."""
+        marker = self.root / ".pruned"
+        now = time.time()
+        if not force and marker.exists() and now - marker.stat().st_mtime < SCREENSHOT_PRUNE_EVERY_S:
+            return {}
+        tasks = []  # (last write, folder, referenced blobs, bytes not shared with the store)
+        for task_dir in SCREENSHOT_ROOT.iterdir() if SCREENSHOT_ROOT.exists() else []:
+            if not task_dir.is_dir() or task_dir == self.root:
+                continue
+            files = [(p, p.stat()) for p in task_dir.iterdir() if p.is_file()]
+            mtime = max([st.st_mtime for _, st in files], default=task_dir.stat().st_mtime)
+            own = sum(st.st_size for _, st in files if st.st_nlink == 1)
+            tasks.append((mtime, task_dir, self._task_refs(task_dir), own))
+        tasks.sort(key=lambda t: t[0])
+        refs = Counter(sha for _, _, shas, _ in tasks for sha in shas)
+        blobs = {p.name.removesuffix(".png"): p for p in self.root.glob("*/*.png")}
+        total = sum(p.stat().st_size for p in blobs.values()) + sum(t[3] for t in tasks)
+        removed = {"tasks": 0, "blobs": 0, "bytes": 0}
+
+        def drop_task(task):
+            nonlocal total
+            _, task_dir, shas, own = task
+            shutil.rmtree(task_dir, ignore_errors=True)
+            removed["tasks"] += 1
+            removed["bytes"] += own
+            total -= own
+            refs.subtract(shas)
+
+        survivors = []
+        for task in tasks:
+            if task[1] != keep and SCREENSHOT_MAX_AGE_DAYS and now - task[0] > SCREENSHOT_MAX_AGE_DAYS * 86400:
+                drop_task(task)
+            else:
+                survivors.append(task)
+        for digest, blob in blobs.items():
+            # Fresh blobs may belong to another worker that hasn't written its manifest line yet
+            if refs[digest] <= 0 and now - blob.stat().st_mtime > SCREENSHOT_PRUNE_EVERY_S:
+                size = blob.stat().st_size
+                blob.unlink(missing_ok=True)
+                self.thumb_path(digest).unlink(missing_ok=True)
+                removed["blobs"] += 1
+                removed["bytes"] += size
+                total -= size
+        while SCREENSHOT_MAX_MB and total > SCREENSHOT_MAX_MB * 1024 * 1024 and survivors:
+            task = survivors.pop(0)
+            if task[1] == keep:
+                continue
+            drop_task(task)
+            for digest in task[2]:
+                if refs[digest] <= 0 and digest in blobs and blobs[digest].exists():
+                    size = blobs[digest].stat().st_size
+                    blobs[digest].unlink()
+                    self.thumb_path(digest).unlink(missing_ok=True)
+                    removed["blobs"] += 1
+                    removed["bytes"] += size
+                    total -= size
+        self.root.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+        if removed["tasks"] or removed["blobs"]:
+            log(f"🧹 Screenshot retention: removed {removed['tasks']} task folder(s), {removed['blobs']} blob(s), "
+                f"{removed['bytes'] / 1e6:.1f} MB; store now {total / 1e6:.1f} MB")
+        return removed
+
+    def summary(self) -> str:
+        return (f"{self.stats['frames']} frames, {self.stats['deduped']} deduplicated "
+                f"({self.stats['bytes_saved'] / 1e6:.1f} MB not written)")
+
+SCREENSHOTS = ScreenshotStore(SCREENSHOT_STORE_DIR)
+
+def save_screenshot(page: Page, dest: Path, step: int) -> str:
+    """Capture the page into the screenshot store as dest; returns the frame's sha256."""
+    return SCREENSHOTS.put(page.screenshot(), dest, step, page.url)
+
+# ===== Browser thread =====
+# Playwright's sync API is bound to the thread that started it. prewarm_browser() launches
+# Chromium on a dedicated thread while the caller is still reading or parsing the goal;
+# stream_task() then runs the graph on that same thread and relays its events.
+BROWSER_THREAD_NAME = "agent-browser"
+_browser_thread = None  # ThreadPoolExecutor(max_workers=1), created by prewarm_browser()
+_prewarm = None  # Future of the background ensure_browser()
+_stop_requested = threading.Event()  # checked by _stream_task between nodes (see stop_task)
+
+def stop_task():
+    """Ask the running task to stop after its current node (safe from any thread)."""
+    _stop_requested.set()
+
+def prewarm_browser():
+    """Start launching Chromium in the background; returns the launch Future."""
+    global _browser_thread, _prewarm
+    from concurrent.futures import ThreadPoolExecutor
+    if _browser_thread is None:
+        _browser_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix=BROWSER_THREAD_NAME)
+    if _prewarm is None:
+        _prewarm = _browser_thread.submit(ensure_browser)
+    return _prewarm
+
+def _on_browser_thread() -> bool:
+    return _browser_thread is None or threading.current_thread().name.startswith(BROWSER_THREAD_NAME)
 
 def get_page() -> Page:
-    """Get or create page instance"""
-    global _playwright, _browser, _context, _page
+    """Get or create page instance (context seeded from the saved session for the current task)"""
+    global _context, _page, _context_session, _session_loaded, _context_har
+    if _page is not None and (_context_session != _session_key or _context_har != _har_path):
+        # Different app (or HAR) than the open context - start a context with that app's session
+        _context.close()
+        _context = None
+        _page = None
+    ensure_browser()
     if _page is None:
-        _playwright = sync_playwright().start()
-        _browser = _playwright.chromium.launch(headless=False)
-        _context = _browser.new_context(viewport={"width": 1280, "height": 800})
+        storage_state = load_session(_session_key) if _session_key else None
+        _context = _browser.new_context(viewport={"width": 1280, "height": 800}, storage_state=storage_state,
+                                        **har_context_options(_har_path))
+        install_route_profile(_context)
+        attach_har(_context, _har_path)  # registered last, so it answers before the route profile
+        _context_session = _session_key
+        _context_har = _har_path
+        _session_loaded = storage_state is not None
+        if storage_state:
+            log(f"🔑 Loaded saved session for '{_session_key}'")
         _page = _context.new_page()
     return _page
 
 def cleanup_browser():
-    """Clean up playwright resources"""
-    global _playwright, _browser, _context, _page
+    """Clean up playwright resources (on the browser thread if the browser was pre-warmed)"""
+    global _prewarm
+    if _on_browser_thread():
+        _cleanup_browser()
+    else:
+        _browser_thread.submit(_cleanup_browser).result()
+    _prewarm = None
+
+def _cleanup_browser():
+    global _playwright, _browser, _context, _page, _context_session
     if _context:
         _context.close()
     if _browser:
@@ -308,17 +834,399 @@ def cleanup_browser():
         _playwright.stop()
     _page = None
     _context = None
+    _context_session = None
     _browser = None
     _playwright = None
 
+# ===== Login handlers =====
+# A login handler receives (page, login_url) and returns True once the session is authenticated.
+LoginHandler = Callable[["Page", str], bool]
+
+LOGIN_URL_PATTERN = re.compile(r'/(login|signin|sign-in|signup|sign-up|auth|authenticate|register)(/|$)', re.IGNORECASE)
+
+def _left_login_page(page: Page, timeout_ms: int = 15000) -> bool:
+    """Wait until the URL no longer looks like a login page."""
+    deadline = time.time() + timeout_ms / 1000
+    while time.time() < deadline:
+        if not LOGIN_URL_PATTERN.search(page.url.split('?')[0]):
+            return True
+        page.wait_for_timeout(500)
+    return False
+
+def interactive_login(page: Page, login_url: str) -> bool:
+    """Pause until the user logs in manually in the browser window (interactive mode only)."""
+    print("\n" + "="*70)
+    print("🔐 AUTHENTICATION REQUIRED")
+    print("="*70)
+    print(f"Current URL: {login_url}")
+    print("\nPlease log in MANUALLY in the browser window.")
+    print("="*70)
+    input("\nPress ENTER after you've logged in: ")
+    return not LOGIN_URL_PATTERN.search(page.url.split('?')[0])
+
+def scripted_login(email: str | None = None, password: str | None = None) -> LoginHandler:
+    """Build a handler that fills a generic email/password form (defaults from AGENT_LOGIN_EMAIL / AGENT_LOGIN_PASSWORD)."""
+    email = email or os.getenv("AGENT_LOGIN_EMAIL", "")
+    password = password or os.getenv("AGENT_LOGIN_PASSWORD", "")
+
+    def _login(page: Page, login_url: str) -> bool:
+        if not email:
+            log("⚠️  Scripted login: no email configured")
+            return False
+        log(f"🔐 Scripted login as {email}...")
+        try:
+            email_box = page.get_by_role("textbox", name=re.compile(r"e-?mail|user\s*name|login", re.IGNORECASE)).first
+            email_box.wait_for(state="visible", timeout=5000)
+            email_box.fill(email)
+            page.keyboard.press("Enter")
+            if password:
+                password_box = page.locator("input[type='password']").first
+                password_box.wait_for(state="visible", timeout=10000)
+                password_box.fill(password)
+                page.keyboard.press("Enter")
+            return _left_login_page(page)
+        except Exception as e:
+            log(f"⚠️  Scripted login failed: {e}")
+            return False
+
+    return _login
+
+def storage_state_login(path: str) -> LoginHandler:
+    """Build a handler that restores cookies/localStorage from a Playwright storage_state file."""
+    def _login(page: Page, login_url: str) -> bool:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except Exception as e:
+            log(f"⚠️  Could not read saved auth '{path}': {e}")
+            return False
+        log(f"🔐 Restoring saved auth from {path}...")
+        page.context.add_cookies(saved.get("cookies", []))
+        for origin in saved.get("origins", []):
+            if page.url.startswith(origin.get("origin", "")):
+                page.evaluate(
+                    "items => items.forEach(({name, value}) => localStorage.setItem(name, value))",
+                    origin.get("localStorage", [])
+                )
+        target = urlparse(login_url)
+        page.goto(f"{target.scheme}://{target.netloc}/", wait_until="load", timeout=60000)
+        return _left_login_page(page, timeout_ms=5000)
+
+    return _login
+
+# ===== Token & cost accounting =====
+# USD per 1M tokens: (prompt, completion)
+MODEL_PRICING = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+class BudgetExceededError(Exception):
+    """Raised instead of making a model call once the task budget is spent."""
+    pass
+
+def _png_size(img_base64: str) -> tuple[int, int]:
+    """Read width/height from the IHDR chunk of a base64 PNG without decoding the whole image."""
+    try:
+        header = base64.b64decode(img_base64[:44])
+        if header[:8] == b"\x89PNG\r\n\x1a\n":
+            return int.from_bytes(header[16:20], "big"), int.from_bytes(header[20:24], "big")
+    except Exception:
+        pass
+    return 1280, 800  # our default viewport
+
+def estimate_image_tokens(width: int, height: int, detail: str = "auto") -> int:
+    """OpenAI vision token estimate: 85 base + 170 per 512px tile after scaling."""
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+def _count_image_tokens(messages: list) -> int:
+    total = 0
+    for msg in messages:
+        content = msg.get("content") if isinstance(msg, dict) else None
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if part.get("type") != "image_url":
+                continue
+            image = part.get("image_url", {})
+            url = image.get("url", "")
+            b64 = url.split(",", 1)[1] if url.startswith("data:") else ""
+            w, h = _png_size(b64) if b64 else (1280, 800)
+            total += estimate_image_tokens(w, h, image.get("detail", "auto"))
+    return total
+
+class UsageLedger:
+    """Per-task record of model usage, broken down by graph node, with optional budgets."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, max_tokens: int = 0, max_cost_usd: float = 0.0):
+        self.by_node: dict[str, dict] = {}
+        self.max_tokens = max_tokens or 0
+        self.max_cost_usd = max_cost_usd or 0.0
+
+    def record(self, node: str, model: str, usage, image_tokens: int = 0):
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        in_price, out_price = MODEL_PRICING.get(model, MODEL_PRICING["gpt-4o"])
+        cost = (prompt * in_price + completion * out_price) / 1_000_000
+        row = self.by_node.setdefault(node, {
+            "calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            "image_tokens": 0, "cost_usd": 0.0
+        })
+        row["calls"] += 1
+        row["prompt_tokens"] += prompt
+        row["completion_tokens"] += completion
+        row["image_tokens"] += image_tokens
+        row["cost_usd"] += cost
+
+    def total(self, key: str):
+        return sum(row[key] for row in self.by_node.values())
+
+    @property
+    def total_tokens(self) -> int:
+        return self.total("prompt_tokens") + self.total("completion_tokens")
+
+    @property
+    def cost_usd(self) -> float:
+        return self.total("cost_usd")
+
+    def exceeded(self) -> str:
+        """Return a human-readable reason if a budget is spent, else ''."""
+        if self.max_tokens and self.total_tokens >= self.max_tokens:
+            return f"token budget exhausted ({self.total_tokens}/{self.max_tokens} tokens)"
+        if self.max_cost_usd and self.cost_usd >= self.max_cost_usd:
+            return f"cost budget exhausted (${self.cost_usd:.4f}/${self.max_cost_usd:.2f})"
+        return ""
+
+    def summary(self) -> str:
+        lines = [f"{'node':<12}{'calls':>6}{'prompt':>10}{'(image)':>10}{'output':>9}{'cost $':>10}"]
+        for node, row in sorted(self.by_node.items()):
+            lines.append(f"{node:<12}{row['calls']:>6}{row['prompt_tokens']:>10}{row['image_tokens']:>10}"
+                         f"{row['completion_tokens']:>9}{row['cost_usd']:>10.4f}")
+        lines.append(f"{'TOTAL':<12}{self.total('calls'):>6}{self.total('prompt_tokens'):>10}{self.total('image_tokens'):>10}"
+                     f"{self.total('completion_tokens'):>9}{self.cost_usd:>10.4f}")
+        return "\n".join(lines)
+
+USAGE = UsageLedger()
+
+# ===== LLM gateway =====
+# Every model call goes through LLMGateway, which is shared by all agent processes on the
+# host (backend workers included) through lock files in LLM_LOCK_DIR:
+# - a token bucket for requests/minute and tokens/minute (prompt estimate + max_tokens,
+#   corrected with the real usage afterwards);
+# - at most LLM_CONCURRENCY calls in flight, one flock'd slot file per call;
+# - retries of 429/5xx/timeouts with jittered exponential backoff, or the server's
+#   retry-after / x-ratelimit-reset-* hint when given. A 429, or a response reporting zero
+#   remaining, pauses the shared bucket so every process backs off, not just the caller.
+# Time spent waiting for the bucket or a slot is the queueing delay in GATEWAY.stats.
+LLM_RPM = float(os.getenv("AGENT_LLM_RPM", "0"))  # 0 = no request-rate limit
+LLM_TPM = float(os.getenv("AGENT_LLM_TPM", "0"))  # 0 = no token-rate limit
+LLM_CONCURRENCY = int(os.getenv("AGENT_LLM_CONCURRENCY", "4"))  # 0 = unlimited
+LLM_MAX_RETRIES = int(os.getenv("AGENT_LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE_S = 1.0
+LLM_BACKOFF_MAX_S = 60.0
+LLM_LOCK_DIR = Path(os.getenv("AGENT_LLM_LOCK_DIR", ".llm_gateway"))
+
+def _parse_reset(value: str) -> float:
+    """Seconds in an x-ratelimit-reset-* value such as '20ms', '1.5s' or '6m0s'."""
+    return sum(float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+               for amount, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value or ""))
+
+def retry_after_s(headers) -> float:
+    """Server's wait hint: retry-after(-ms), else the reset time of an exhausted rate limit."""
+    if not headers:
+        return 0.0
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(headers.get(name)) * scale
+        except (TypeError, ValueError):
+            pass  # absent, or an HTTP date
+    return max([_parse_reset(headers.get(f"x-ratelimit-reset-{kind}", ""))
+                for kind in ("requests", "tokens") if headers.get(f"x-ratelimit-remaining-{kind}") == "0"],
+               default=0.0)
+
+def _estimate_tokens(kwargs: dict, image_tokens: int) -> int:
+    """Rough token cost of a call for the TPM bucket: ~4 chars per token + images + max output."""
+    chars = 0
+    for msg in kwargs.get("messages", []):
+        content = msg.get("content", "") if isinstance(msg, dict) else ""
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content}]
+        chars += sum(len(part.get("text", "")) for part in parts if part.get("type") == "text")
+    return chars // 4 + image_tokens + (kwargs.get("max_tokens") or 500)
+
+class LLMGateway:
+    """Rate limits, shared concurrency slots and retries for model calls (see section comment)."""
+
+    def __init__(self, lock_dir: Path):
+        self.lock_dir = lock_dir
+        self._lock = threading.Lock()
+        self._bucket = {}  # used directly when fcntl is unavailable
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "queue_s": 0.0, "max_queue_s": 0.0, "backoff_s": 0.0}
+
+    def _update_bucket(self, fn):
+        """Apply fn to the bucket state under the cross-process lock and return its result."""
+        with self._lock:
+            if fcntl is None:
+                return fn(self._fill(self._bucket))
+            self.lock_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.lock_dir / "bucket.json", "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        bucket = json.loads(f.read() or "{}")
+                    except ValueError:
+                        bucket = {}
+                    result = fn(self._fill(bucket))
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(bucket))
+                    return result
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _fill(bucket: dict) -> dict:
+        """Refill the bucket for the time since its last update."""
+        now = time.time()
+        elapsed = max(0.0, now - bucket.get("updated", now))
+        bucket["requests"] = min(LLM_RPM, bucket.get("requests", LLM_RPM) + elapsed * LLM_RPM / 60)
+        bucket["tokens"] = min(LLM_TPM, bucket.get("tokens", LLM_TPM) + elapsed * LLM_TPM / 60)
+        bucket["updated"] = now
+        bucket.setdefault("paused_until", 0.0)
+        return bucket
+
+    def _take(self, tokens: int) -> float:
+        """Debit one request and `tokens` if the bucket allows it now; else return seconds to wait."""
+        def take(bucket):
+            wait = bucket["paused_until"] - bucket["updated"]
+            if LLM_RPM and bucket["requests"] < 1:
+                wait = max(wait, (1 - bucket["requests"]) * 60 / LLM_RPM)
+            need = min(tokens, LLM_TPM)  # a call larger than the whole bucket waits for a full one
+            if LLM_TPM and bucket["tokens"] < need:
+                wait = max(wait, (need - bucket["tokens"]) * 60 / LLM_TPM)
+            if wait > 0:
+                return wait
+            bucket["requests"] -= 1 if LLM_RPM else 0
+            bucket["tokens"] -= tokens if LLM_TPM else 0
+            return 0.0
+        return self._update_bucket(take)
+
+    def adjust_tokens(self, delta: int):
+        """Charge (or refund) the difference between the estimated and actual token use."""
+        if LLM_TPM and delta:
+            self._update_bucket(lambda bucket: bucket.update(tokens=bucket["tokens"] - delta))
+
+    def pause(self, seconds: float):
+        """Hold every process's calls for `seconds`."""
+        self._update_bucket(lambda bucket: bucket.update(
+            paused_until=max(bucket["paused_until"], time.time() + seconds)))
+
+    def _acquire_slot(self):
+        """Lock one of LLM_CONCURRENCY slot files; the OS releases it even if this process dies."""
+        if not LLM_CONCURRENCY or fcntl is None:
+            return None
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        while True:
+            for n in range(LLM_CONCURRENCY):
+                f = open(self.lock_dir / f"slot-{n}.lock", "a")
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return f
+                except OSError:
+                    f.close()
+            time.sleep(0.05 + random.random() * 0.05)
+
+    def call(self, create: Callable, est_tokens: int):
+        """Run create() (a with_raw_response call) within the limits, retrying transient errors."""
+        from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+        self.stats["calls"] += 1
+        attempt = 0
+        while True:
+            queued = time.perf_counter()
+            while (wait := self._take(est_tokens)) > 0:
+                time.sleep(min(wait, 5.0))
+            slot = self._acquire_slot()
+            queue_s = time.perf_counter() - queued
+            self.stats["queue_s"] += queue_s
+            self.stats["max_queue_s"] = max(self.stats["max_queue_s"], queue_s)
+            try:
+                raw = create()
+                hint = retry_after_s(raw.headers)
+                if hint:  # this call used up a limit - hold the others until it resets
+                    self.pause(hint)
+                return raw.parse()
+            except (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError) as e:
+                if attempt >= LLM_MAX_RETRIES or getattr(e, "code", None) == "insufficient_quota":
+                    self.stats["failures"] += 1
+                    raise
+                hint = retry_after_s(getattr(getattr(e, "response", None), "headers", None))
+                delay = min(LLM_BACKOFF_MAX_S, hint or LLM_BACKOFF_BASE_S * 2 ** attempt)
+                delay = delay * random.uniform(1.0, 1.2) if hint else random.uniform(delay / 2, delay)
+                if isinstance(e, RateLimitError):
+                    self.pause(delay)
+                attempt += 1
+                self.stats["retries"] += 1
+                self.stats["backoff_s"] += delay
+                log(f"⏳ LLM {type(e).__name__} - retry {attempt}/{LLM_MAX_RETRIES} in {delay:.1f}s")
+            finally:
+                if slot is not None:
+                    fcntl.flock(slot, fcntl.LOCK_UN)
+                    slot.close()
+            time.sleep(delay)
+
+    def summary(self) -> str:
+        calls = max(self.stats["calls"], 1)
+        return (f"{self.stats['calls']} calls, {self.stats['retries']} retries, {self.stats['failures']} failed; "
+                f"queue delay avg {self.stats['queue_s'] / calls:.2f}s / max {self.stats['max_queue_s']:.2f}s; "
+                f"backoff {self.stats['backoff_s']:.1f}s")
+
+GATEWAY = LLMGateway(LLM_LOCK_DIR)
+
+_openai = None
+
+def _openai_client():
+    """Shared OpenAI client, created (and the SDK imported) on the first model call."""
+    global _openai
+    if _openai is None:
+        from openai import OpenAI
+        _openai = OpenAI(max_retries=0)  # LLMGateway owns retries
+    return _openai
+
+def chat_completion(node: str, **kwargs):
+    """Single entry point for chat completions: enforces the task budget, goes through the gateway and records usage."""
+    reason = USAGE.exceeded()
+    if reason:
+        raise BudgetExceededError(reason)
+    image_tokens = _count_image_tokens(kwargs.get("messages", []))
+    estimate = _estimate_tokens(kwargs, image_tokens)
+    client = _openai_client()
+    response = GATEWAY.call(lambda: client.chat.completions.with_raw_response.create(**kwargs), estimate)
+    usage = getattr(response, "usage", None)
+    GATEWAY.adjust_tokens((getattr(usage, "total_tokens", 0) or estimate) - estimate)
+    USAGE.record(node, kwargs.get("model", ""), usage, image_tokens=image_tokens)
+    return response
+
 def ask_gpt_for_better_regex(goal: str, failed_pattern: str, img_base64: str, visible_elements: list) -> str:
     """Ask GPT Vision to suggest a better regex pattern by analyzing the screenshot"""
-    print("🔍 Asking GPT Vision for a better regex pattern...")
+    log("🔍 Asking GPT Vision for a better regex pattern...")
     
     elements_list = "\n".join([f"{i+1}. [{el['role']}] {el['name']}" for i, el in enumerate(visible_elements[:30])])
     
-    client = OpenAI()
-    response = client.chat.completions.create(
+    response = chat_completion(
+        "executor",
         model="gpt-4o",
         messages=[
             {
@@ -364,68 +1272,62 @@ NO inline flags like (?i) - not supported!"""
     # Strip quotes
     suggested_pattern = suggested_pattern.strip('"').strip("'")
     
-    print(f"💡 GPT Vision suggests: '{suggested_pattern}'")
+    log(f"💡 GPT Vision suggests: '{suggested_pattern}'")
     return suggested_pattern
+# Same modal test as a Playwright ':visible' locator: non-empty box and not visibility:hidden
+STATE_SNAPSHOT_JS = """
+() => {
+  const visible = el => {
+    const r = el.getBoundingClientRect();
+    return r.width > 0 && r.height > 0 && getComputedStyle(el).visibility !== 'hidden';
+  };
+  const modals = [...document.querySelectorAll("[role='dialog'],[role='alertdialog'],[class*='modal']")].filter(visible);
+  let modalTitle = '';
+  if (modals.length) {
+    const heading = modals[0].querySelector("h1,h2,h3,h4,h5,h6,[role='heading']");
+    modalTitle = ((heading && heading.innerText) || modals[0].getAttribute('aria-label') || '').trim();
+  }
+  const el = document.activeElement;
+  const focus = el ? {
+    tag: el.tagName || '',
+    role: el.getAttribute('role') || '',
+    aria: el.getAttribute('aria-label') || '',
+    placeholder: el.getAttribute('placeholder') || '',
+    isContentEditable: el.isContentEditable === true,
+    previewText: (el.innerText || '').slice(0, 80),
+  } : null;
+  return {
+    url: location.href,
+    title: document.title,
+    modalCount: modals.length,
+    modalTitle,
+    focus,
+    scroll: {
+      x: Math.round(window.scrollX),
+      y: Math.round(window.scrollY),
+      height: document.documentElement.scrollHeight || 0,
+    },
+  };
+}
+"""
+
 def build_state_snapshot(page: Page, state: AgentState, visible_elements: list[dict]) -> dict:
     """Collect a compact, structured JSON snapshot of runtime UI state for GPT."""
-    # URL & title
-    url = page.url
+    # URL, title, modal, focus and scroll in one round trip (latency lands in state["extraction"])
+    snapshot_started = time.perf_counter()
     try:
-        title = page.title()
-    except Exception:
-        title = ""
-
-    # Modal detection
-    active_modal = None
-    modal_title = ""
-    try:
-        modal = page.locator("[role='dialog']:visible,[role='alertdialog']:visible,[class*='modal']:visible").first
-        if modal and modal.count() > 0 and modal.is_visible():
-            active_modal = True
-            # Try to harvest a heading inside modal
-            try:
-                modal_title = modal.get_by_role("heading").first.inner_text(timeout=300).strip()
-            except Exception:
-                try:
-                    aria_label = modal.get_attribute("aria-label") or ""
-                    modal_title = aria_label.strip()
-                except Exception:
-                    modal_title = ""
-        else:
-            active_modal = False
-    except Exception:
-        active_modal = False
-
-    # Focused element (best effort)
-    try:
-        focus_info = page.evaluate("""
-            () => {
-              const el = document.activeElement;
-              if (!el) return null;
-              const role = el.getAttribute?.('role') || '';
-              const tag = el.tagName || '';
-              const aria = el.getAttribute?.('aria-label') || '';
-              const ph = el.getAttribute?.('placeholder') || '';
-              const ce = (el as any).isContentEditable === true;
-              let txt = '';
-              try { txt = (el as any).innerText?.slice(0,80) || ''; } catch(e){}
-              return { tag, role, aria, placeholder: ph, isContentEditable: ce, previewText: txt };
-            }
-        """)
-    except Exception:
-        focus_info = None
-
-    # Scroll/viewport
-    try:
-        scroll = page.evaluate("""
-            () => ({
-                x: Math.round(window.scrollX),
-                y: Math.round(window.scrollY),
-                height: document.documentElement.scrollHeight || 0
-            })
-        """)
-    except Exception:
-        scroll = {"x": 0, "y": 0, "height": 0}
+        page_state = page.evaluate(STATE_SNAPSHOT_JS)
+    except Exception as e:
+        log(f"⚠️ State snapshot evaluate failed: {e}")
+        page_state = {"url": page.url, "title": "", "modalCount": 0, "modalTitle": "", "focus": None,
+                      "scroll": {"x": 0, "y": 0, "height": 0}}
+    state.setdefault("extraction", {})["snapshot_ms"] = round((time.perf_counter() - snapshot_started) * 1000, 1)
+    url = page_state["url"] or page.url
+    title = page_state["title"]
+    active_modal = page_state["modalCount"] > 0
+    modal_title = page_state["modalTitle"]
+    focus_info = page_state["focus"]
+    scroll = page_state["scroll"]
 
     # Heuristic login state (non-invasive)
     def _has(patterns):
@@ -447,6 +1349,10 @@ def build_state_snapshot(page: Page, state: AgentState, visible_elements: list[d
     added = list(cur_set - last_set)
     removed = list(last_set - cur_set)
 
+    # Goal-relevant elements first so the 40-element cap keeps what matters
+    ranked = rank_elements(visible_elements, state.get("goal", ""), bool(active_modal))
+    regions = Counter(el.get("region") or "unplaced" for el in visible_elements)
+
     snapshot = {
         "url": url,
         "title": title,
@@ -455,14 +1361,16 @@ def build_state_snapshot(page: Page, state: AgentState, visible_elements: list[d
         "active_modal_title": modal_title,
         "focus_element": focus_info or None,
         "scroll": scroll,
+        "viewport": (state.get("extraction") or {}).get("spatial", {}).get("viewport"),
+        "regions": dict(regions),
         "variables": {
             "is_logged_in": is_logged_in,
             "login_cta_visible": login_cta_visible,
             "logout_cta_visible": logout_cta_visible
         },
-        "visible_elements": visible_elements[:40],  # cap to keep prompt lean
-        "recent_actions": state.get("actions_performed", [])[-10:],
-        "failed_actions": state.get("failed_actions", [])[-10:],
+        "visible_elements": ranked[:40],  # cap to keep prompt lean
+        "recent_actions": state["actions_performed"].render(10),
+        "failed_actions": state["failed_actions"].render(10),
         "diff": {
             "added": [{"role": r, "name": n} for (r, n) in added][:15],
             "removed": [{"role": r, "name": n} for (r, n) in removed][:15]
@@ -477,7 +1385,6 @@ def check_toggle_state_from_screenshot(goal: str, element_name: str, img_base64:
     Returns (is_goal_achieved, visual_state_description)
     FULLY GENERAL - uses JSON response, no hardcoded phrase matching!
     """
-    client = OpenAI()
     
     prompt = f"""Look at this screenshot and analyze the element: "{element_name}"
 
@@ -490,7 +1397,8 @@ Return a JSON object:
 }}"""
 
     try:
-        response = client.chat.completions.create(
+        response = chat_completion(
+            "executor",
             model="gpt-4o",
             response_format={"type": "json_object"},
             messages=[
@@ -514,12 +1422,12 @@ Return a JSON object:
         visual_state = result_json.get("current_visual_state", "Unknown")
         is_achieved = result_json.get("goal_satisfied", False)
         
-        print(f"👁️  GPT Vision: {visual_state}")
-        print(f"👁️  GPT Vision: Goal satisfied = {is_achieved}")
+        log(f"👁️  GPT Vision: {visual_state}")
+        log(f"👁️  GPT Vision: Goal satisfied = {is_achieved}")
         
         return is_achieved, visual_state
     except Exception as e:
-        print(f"⚠️  Vision check failed: {e}")
+        log(f"⚠️  Vision check failed: {e}")
         return False, "Unknown (vision check failed)"
 
 def check_goal_achieved_by_state(goal: str, element_name: str, current_state: str) -> bool:
@@ -528,11 +1436,10 @@ def check_goal_achieved_by_state(goal: str, element_name: str, current_state: st
     Returns True if goal is achieved, False otherwise.
     FULLY GENERAL - uses JSON response, no hardcoded phrase matching!
     """
-    client = OpenAI()
     
     # Don't trust this check if state is unclear
     if "unknown" in current_state.lower() or "unclear" in current_state.lower() or "infer" in current_state.lower():
-        print(f"⚠️  State is unclear - skipping text-based check, will use vision")
+        log(f"⚠️  State is unclear - skipping text-based check, will use vision")
         return False
     
     prompt = f"""User's goal: "{goal}"
@@ -576,7 +1483,8 @@ Return JSON:
 }}"""
 
     try:
-        response = client.chat.completions.create(
+        response = chat_completion(
+            "executor",
             model="gpt-4o-mini",
             response_format={"type": "json_object"},
             messages=[{"role": "user", "content": prompt}],
@@ -589,12 +1497,12 @@ Return JSON:
         is_achieved = result_json.get("goal_satisfied", False)
         reasoning = result_json.get("reasoning", "No reasoning provided")
         
-        print(f"🧠 GPT: {reasoning}")
-        print(f"🧠 GPT: Goal satisfied = {is_achieved}")
+        log(f"🧠 GPT: {reasoning}")
+        log(f"🧠 GPT: Goal satisfied = {is_achieved}")
         
         return is_achieved
     except Exception as e:
-        print(f"⚠️  Goal check failed: {e}")
+        log(f"⚠️  Goal check failed: {e}")
         return False
 
 def find_semantic_match(goal: str, visible_elements: list[dict]) -> dict:
@@ -603,7 +1511,6 @@ def find_semantic_match(goal: str, visible_elements: list[dict]) -> dict:
     Returns the best matching element or None.
     FULLY GENERAL - uses JSON response!
     """
-    client = OpenAI()
     
     # Build a simple list of visible elements
     elements_list = []
@@ -628,7 +1535,8 @@ Return JSON:
 If no good match, use element_number: 0"""
 
     try:
-        response = client.chat.completions.create(
+        response = chat_completion(
+            "planner",
             model="gpt-4o-mini",
             response_format={"type": "json_object"},
             messages=[{"role": "user", "content": prompt}],
@@ -642,22 +1550,121 @@ If no good match, use element_number: 0"""
         reasoning = result_json.get("reasoning", "")
         
         if element_num == 0 or element_num > len(visible_elements):
-            print(f"🧠 GPT: No suitable element found - {reasoning}")
+            log(f"🧠 GPT: No suitable element found - {reasoning}")
             return None
         
         idx = element_num - 1  # Convert to 0-based index
         matched_el = visible_elements[idx]
-        print(f"🧠 GPT Semantic Match: [{matched_el['role']}] {matched_el['name']}")
-        print(f"🧠 Reasoning: {reasoning}")
+        log(f"🧠 GPT Semantic Match: [{matched_el['role']}] {matched_el['name']}")
+        log(f"🧠 Reasoning: {reasoning}")
         return matched_el
     except Exception as e:
-        print(f"⚠️  Semantic matching failed: {e}")
+        log(f"⚠️  Semantic matching failed: {e}")
         return None
 
+# ===== Action history =====
+ACTION_HISTORY_SIZE = 50  # ring buffer size; larger than any run allowed by recursion_limit
+
+@dataclass(frozen=True)
+class ActionRecord:
+    """One executed (or failed) action. kind is 'action' or 'recovery'."""
+    action_type: str
+    role: str = ""
+    name_pattern: str = ""
+    text: str = ""
+    kind: str = "action"
+    note: str = ""  # recovery reason ('loop'/'stuck') or outcome flag ('already_complete')
+
+    @property
+    def key(self) -> str:
+        """Unambiguous identity of the action (safe when text/pattern contain colons)."""
+        return json.dumps([self.action_type, self.role, self.name_pattern, self.text])
+
+    def render(self) -> str:
+        """Legacy 'type:role:pattern:text' form used in prompts and logs."""
+        plain = f"{self.action_type}:{self.role}:{self.name_pattern}:{self.text}"
+        if self.kind == "recovery":
+            return f"recovery:escape:from:{plain}" if self.note == "loop" else "recovery:escape:stuck"
+        return plain + (f":{self.note}" if self.note else "")
+
+@dataclass
+class ActionHistory:
+    """Bounded ring buffer of ActionRecords with O(1) indexes for the lookups the nodes make."""
+    maxlen: int = ACTION_HISTORY_SIZE
+    records: deque = field(default_factory=deque)
+    counts: dict = field(default_factory=dict)  # ActionRecord.key -> occurrences in the buffer
+    recoveries: int = 0  # recovery records ever appended (not bounded by the buffer)
+    total: int = 0  # records ever appended
+    goal_complete_seen: bool = False  # an action was flagged 'already_complete'
+
+    def __post_init__(self):
+        # Restored checkpoints hand us a plain sequence - re-wrap it as a bounded deque
+        self.records = deque(self.records, maxlen=self.maxlen)
+
+    def append(self, record: ActionRecord):
+        if len(self.records) == self.maxlen:
+            evicted = self.records[0]
+            if evicted.kind == "action":
+                self.counts[evicted.key] -= 1
+                if self.counts[evicted.key] <= 0:
+                    del self.counts[evicted.key]
+        self.records.append(record)
+        self.total += 1
+        if record.kind == "recovery":
+            self.recoveries += 1
+        else:
+            self.counts[record.key] = self.counts.get(record.key, 0) + 1
+        if record.note == "already_complete":
+            self.goal_complete_seen = True
+
+    def __contains__(self, record: ActionRecord) -> bool:
+        return record.key in self.counts
+
+    def __len__(self) -> int:
+        return self.total
+
+    @property
+    def last(self) -> ActionRecord | None:
+        return self.records[-1] if self.records else None
+
+    def recent(self, n: int) -> list[ActionRecord]:
+        return list(self.records)[-n:] if n > 0 else []
+
+    def recently_recovered(self, n: int = 2) -> bool:
+        return any(r.kind == "recovery" for r in self.recent(n))
+
+    def render(self, n: int = 10) -> list[str]:
+        return [r.render() for r in self.recent(n)]
+
+def state_fingerprint(url: str, visible_elements: list[dict], action: ActionRecord) -> str:
+    """Hash of (URL, visible element set, planned action) - identical fingerprints mean a repeated state."""
+    url = url.split("#")[0]
+    elements = sorted(f"{el.get('role')}\x1f{el.get('name')}" for el in visible_elements)
+    h = hashlib.blake2b(digest_size=12)
+    h.update(url.encode())
+    h.update("\x1e".join(elements).encode())
+    h.update(action.key.encode())
+    return h.hexdigest()
+
+def steps_remaining(step: int) -> int:
+    """Agent iterations left before recursion_limit (each iteration = inspector + planner + executor)."""
+    return max(0, (_recursion_limit - 1 - 3 * step) // 3)
+
+def screenshot_b64(state: AgentState) -> str:
+    """Load the state's screenshot (kept by path, not inline) as base64 for vision calls."""
+    path = state.get("screenshot", "")
+    if not path:
+        return ""
+    try:
+        with open(path, "rb") as f:
+            return base64.b64encode(f.read()).decode("utf-8")
+    except OSError as e:
+        log(f"⚠️  Screenshot unavailable ({path}): {e}")
+        return ""
+
 class AgentState(TypedDict):
     messages: list[Union[HumanMessage, SystemMessage, AIMessage]]
-    screenshot: str
-    img_base64: str
+    screenshot: str  # Path of the latest inspector screenshot (stored by reference, see screenshot_b64)
     goal: str
     website_url: str  # Starting URL (platform-agnostic)
     role: str  # Accessibility role: 'link', 'button', 'textbox', etc.
@@ -666,22 +1673,1143 @@ class AgentState(TypedDict):
     action_text: str  # Text to type (if action_type is 'type') or key to press (if 'keyboard')
     visible_elements: list[dict]  # List of {role, name, description}
     is_first_visit: bool  # Track if this is the first inspection
-    actions_performed: list[str]  # Track all successful actions to avoid loops
-    failed_actions: list[str]  # Track all failed actions
+    actions_performed: ActionHistory  # Successful actions and recoveries (bounded, indexed)
+    failed_actions: ActionHistory  # Failed actions (bounded, indexed)
+    state_fingerprints: dict[str, list[int]]  # state_fingerprint -> [last step seen, times repeated]
     goal_text_entered: bool  # Flag when goal is complete
     last_url: str  # Track URL changes to detect when stuck
     hover_explored: list[str]  # Track which elements we've hovered over for exploration
+    menu_map: dict  # Explore mode: {"url", "menus": [{"trigger", "revealed"}]} for the current page
+    nav_node: str  # Navigation-graph node of the current UI state (see nav_node_id)
+    nav_pending: dict  # {"from", "action", "expect"} for the planned click/hover, resolved by the next inspection
+    nav_routed: str  # target node of the routed step last planned ("" when the model decided)
+    nav_skip_route: bool  # the model took over from a route: don't route on the next planner call
+    plan_queue: list[dict]  # Plan-ahead: follow-up actions still to run without re-inspecting
+    plan_expect: dict  # Plan-ahead: postcondition of the action being executed
+    plan_context: dict  # Plan-ahead: {"url" pattern, "modal"} when that action was planned
+    plan_next: bool  # Plan-ahead: executor loaded the next queued action (executor -> executor edge)
+    token_budget: int  # Max prompt+completion tokens for this task (0 = unlimited)
+    cost_budget_usd: float  # Max model spend in USD for this task (0 = unlimited)
+    stop_reason: str  # Why the run ended early (e.g. budget exhausted)
+    task_name: str  # Used for the screenshot folder
+    last_event: dict  # Structured event from the most recent node (see stream_task)
+    snapshot: dict  # Structured runtime snapshot built by the inspector for the planner
+    last_visible_elements: list[dict]  # {role, name} pairs from the previous inspection (for diffs)
+    usage: dict  # USAGE.by_node, carried in the state so resumed runs keep their totals
+    extraction: dict  # How the last inspection extracted elements (backend, coverage, timing)
+    marks: dict[str, str]  # Set-of-marks: mark number drawn on the screenshot -> element id
+    element_id: str  # Element chosen by mark (set-of-marks mode); "" = resolve role + name_pattern
+    locator: dict  # How the executor resolved its target (mode, hit, resolve_ms)
+    typing: dict  # How the executor entered text this step (see enter_text)
+    step_frame: dict  # {"path", "sha256"} of the screenshot this executor step saved ({} = none)
+
+# ===== Element registry =====
+class Element:
+    """One interactive element. The id is stable across inspections (derived from role + name)."""
+    __slots__ = ("id", "role", "name", "description", "bbox", "region", "frame", "popup", "nth")
+
+    def __init__(self, id: str, role: str, name: str, description: str, frame: str = ""):
+        self.id = id
+        self.role = role
+        self.name = name
+        self.description = description
+        self.bbox: list[int] | None = None  # [x, y, width, height] in viewport CSS pixels
+        self.region = ""  # see screen_region()
+        self.frame = frame  # frame_key() of the owning iframe; "" = main frame
+        self.popup = False  # declares a popup (aria-haspopup / aria-expanded): a menu trigger
+        self.nth = 0  # position among same role + name elements in DOM order (see annotate_spatial)
+
+    def as_dict(self) -> dict:
+        d = {"id": self.id, "role": self.role, "name": self.name, "description": self.description}
+        if self.region:
+            d["region"] = self.region
+            d["bbox"] = self.bbox
+        if self.frame:
+            d["frame"] = self.frame
+        if self.popup:
+            d["popup"] = True
+        if self.nth:
+            d["nth"] = self.nth
+        return d
+
+def element_id(role: str, name: str, frame: str = "") -> str:
+    key = f"{role}\x1f{name}" + (f"\x1f{frame}" if frame else "")
+    return "e" + hashlib.blake2b(key.encode(), digest_size=4).hexdigest()
+
+class ElementRegistry:
+    """Insertion-ordered set of interactive elements with O(1) dedupe.
+
+    Deduplicates on (role, accessible name, frame); also indexes display names so
+    the DOM fallbacks can do their name-only checks without scanning the list.
+    Further on-screen elements with the same role + name are added by annotate_spatial
+    as instances (add_instance) carrying their DOM position.
+    """
+    __slots__ = ("_by_key", "_names", "_names_ci")
 
-def _append_unique(visible_elements, role, name):
-    """Append one element if it's not already present."""
-    if not name:
-        return
-    if not any(el['role'] == role and el['name'] == name for el in visible_elements):
-        visible_elements.append({
+    def __init__(self):
+        self._by_key: dict[tuple[str, str, str], Element] = {}
+        self._names: Counter = Counter()
+        self._names_ci: Counter = Counter()
+
+    def add(self, role: str, name: str, display_name: str | None = None,
+            description: str | None = None, frame: str = "") -> Element | None:
+        """Add an element; returns None if (role, name, frame) is already registered."""
+        key = (role, name, frame)
+        if key in self._by_key:
+            return None
+        display_name = display_name or name
+        el = Element(element_id(role, name, frame), role, display_name,
+                     description or f"{role} '{display_name}'", frame)
+        self._by_key[key] = el
+        self._names[display_name] += 1
+        self._names_ci[display_name.lower()] += 1
+        return el
+
+    def add_instance(self, el: Element, nth: int) -> Element:
+        """Register another element with el's role + name: its nth match in DOM order."""
+        dup = Element(f"{el.id}.{nth}", el.role, el.name, f"{el.description} #{nth + 1}", el.frame)
+        dup.popup = el.popup
+        dup.nth = nth
+        self._by_key[(el.role, f"{el.name}\x1f{nth}", el.frame)] = dup
+        return dup
+
+    def has(self, role: str, name: str, frame: str = "") -> bool:
+        return (role, name, frame) in self._by_key
+
+    def has_name(self, name: str) -> bool:
+        return name in self._names
+
+    def count_name_ci(self, name: str) -> int:
+        return self._names_ci.get(name.lower(), 0)
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def __iter__(self):
+        return iter(self._by_key.values())
+
+    def to_list(self) -> list[dict]:
+        """visible_elements form: list of {id, role, name, description} in insertion order."""
+        return [el.as_dict() for el in self._by_key.values()]
+
+INTERACTIVE_ROLES = frozenset([
+    "link", "button", "textbox", "switch", "tab",
+    "option", "menuitem", "menuitemradio", "menuitemcheckbox",
+    "treeitem", "combobox", "listbox", "row", "cell", "gridcell",
+    "search", "searchbox"
+])
+AX_SKIP_PATTERNS = ("hidden properties", "hidden columns", "drag")
+# Roles whose subtrees never hold further interactive elements worth listing (just their label text).
+# Containers like button/link/tab/menuitem/option/img are not here: apps nest real controls in them
+# (a close button inside a tab, a toggle inside a menu row).
+AX_LEAF_ROLES = frozenset([
+    "textbox", "searchbox", "slider", "checkbox", "radio", "switch",
+    "StaticText", "text", "LineBreak", "separator", "progressbar"
+])
+AX_DIALOG_ROLES = frozenset(["dialog", "alertdialog"])
+AX_DIALOG_PROBE_DEPTH = 4  # modals are portalled near the top of the tree
+AX_MAX_ELEMENTS = int(os.getenv("AGENT_AX_MAX_ELEMENTS", "400"))
+AX_TIME_BUDGET_MS = float(os.getenv("AGENT_AX_TIME_BUDGET_MS", "200"))
+# Per-site overrides for dense apps: "notion.so=1200:500,linear.app=800" (app or host = elements[:ms])
+AX_SITE_LIMITS = {
+    site.strip(): limits.strip()
+    for site, _, limits in (entry.partition("=") for entry in os.getenv("AGENT_AX_SITE_LIMITS", "").split(","))
+    if site.strip() and limits.strip()
+}
+
+def ax_limits(url: str) -> tuple[int, float]:
+    """(max_elements, time_budget_ms) for this page: AGENT_AX_SITE_LIMITS entry for its app or host, else the defaults."""
+    host = (urlparse(url).hostname or "").removeprefix("www.")
+    limits = AX_SITE_LIMITS.get(session_key(url)) or AX_SITE_LIMITS.get(host)
+    if not limits:
+        return AX_MAX_ELEMENTS, AX_TIME_BUDGET_MS
+    elements, _, ms = limits.partition(":")
+    return int(elements), float(ms) if ms else AX_TIME_BUDGET_MS
+
+@dataclass
+class AXWalkStats:
+    """What the accessibility walk covered and what it skipped."""
+    visited: int = 0  # nodes examined
+    pruned: int = 0  # subtrees skipped because their root can't contain interactive children
+    pruned_children: int = 0  # direct children under those pruned roots
+    pending: int = 0  # subtrees left unvisited when a budget stopped the walk
+    dialogs: int = 0  # dialog subtrees walked first
+    stopped_by: str = ""  # '', 'elements' or 'time'
+    offscreen: int = 0  # interactive nodes dropped for being outside the viewport (CDP backend)
+    scope: str = "document"  # 'document' or 'dialog' (CDP partial-tree query)
+
+    def summary(self) -> str:
+        text = (f"visited {self.visited} nodes, pruned {self.pruned} leaf subtrees "
+                f"({self.pruned_children} children skipped)")
+        if self.scope != "document":
+            text += f", scoped to {self.scope}"
+        if self.offscreen:
+            text += f", {self.offscreen} off-screen dropped"
+        if self.dialogs:
+            text += f", {self.dialogs} dialog(s) first"
+        if self.stopped_by:
+            text += f", stopped by {self.stopped_by} budget with {self.pending} subtrees unvisited"
+        return text
+
+def _register_ax_node(node: dict, registry: ElementRegistry, frame: str = "") -> Element | bool:
+    """Register one snapshot node if interactive; returns False if its subtree should be skipped,
+    the new Element if one was added."""
+    role = node.get("role", "")
+    name = node.get("name", "")
+    
+    if node.get("disabled", False):
+        return False
+    
+    if role in INTERACTIVE_ROLES and name and len(name) < 150:
+        lowered = name.lower()
+        if any(skip in lowered for skip in AX_SKIP_PATTERNS):
+            return False
+        
+        if not registry.has(role, name, frame):
+            is_creation_element = (
+                role in ["button", "link"] and 
+                any(keyword in lowered for keyword in ["+ new", "new page", "+ add"])
+            )
+            if is_creation_element and registry.count_name_ci(name) >= 2:
+                return False
+            display_name = name
+            if role == "button" and ("new" in lowered and ("task" in lowered or "to-do" in lowered or "todo" in lowered)):
+                display_name = f"🆕 {name}"
+            if role == "menuitem" and ("'s" in name or "profile" in lowered or "account" in lowered):
+                display_name = f"📋{name}"
+            el = registry.add(role, name, display_name, frame=frame)
+            if el is None:
+                return True
+            el.popup = bool(node.get("haspopup")) or "expanded" in node
+            return el
+    return True
+
+def _find_dialogs(tree: dict, max_depth: int) -> list[dict]:
+    """Breadth-first probe of the top of the tree for open dialogs."""
+    found, level = [], [tree]
+    for _ in range(max_depth):
+        next_level = []
+        for node in level:
+            for child in node.get("children", []):
+                if not isinstance(child, dict):
+                    continue
+                if child.get("role") in AX_DIALOG_ROLES:
+                    found.append(child)
+                else:
+                    next_level.append(child)
+        level = next_level
+    return found
+
+def collect_ax_elements(tree, registry: ElementRegistry, max_elements: int | None = None,
+                        time_budget_ms: float | None = None) -> AXWalkStats:
+    """Iteratively collect interactive nodes from page.accessibility.snapshot() into the registry.
+
+    Dialog subtrees are walked first, leaf-role subtrees are pruned, and the walk stops
+    once max_elements are registered or time_budget_ms has elapsed (0 disables a budget).
+    """
+    stats = AXWalkStats()
+    if not isinstance(tree, dict):
+        return stats
+    max_elements = AX_MAX_ELEMENTS if max_elements is None else max_elements
+    time_budget_ms = AX_TIME_BUDGET_MS if time_budget_ms is None else time_budget_ms
+    deadline = time.perf_counter() + time_budget_ms / 1000 if time_budget_ms else None
+    
+    dialogs = _find_dialogs(tree, AX_DIALOG_PROBE_DEPTH)
+    stats.dialogs = len(dialogs)
+    walked_dialogs = set()
+    stack = [tree] + dialogs[::-1]  # pop() takes dialogs first, then the document in order
+    while stack:
+        if max_elements and len(registry) >= max_elements:
+            stats.stopped_by = "elements"
+            break
+        if deadline and stats.visited % 64 == 0 and time.perf_counter() > deadline:
+            stats.stopped_by = "time"
+            break
+        node = stack.pop()
+        if node.get("role") in AX_DIALOG_ROLES:
+            if id(node) in walked_dialogs:
+                continue  # already walked up front
+            walked_dialogs.add(id(node))
+        stats.visited += 1
+        if not _register_ax_node(node, registry):
+            continue
+        children = node.get("children")
+        if not children:
+            continue
+        if node.get("role") in AX_LEAF_ROLES:
+            stats.pruned += 1
+            stats.pruned_children += len(children)
+            continue
+        stack.extend(child for child in reversed(children) if isinstance(child, dict))
+    stats.pending = len(stack)
+    return stats
+
+# ===== CDP extraction backend =====
+# page.accessibility.snapshot() is deprecated and always serializes the whole tree.
+# The CDP backend asks Chrome directly: a partial AX tree for an open modal (or the full
+# document), joined with layout boxes from one DOMSnapshot so only on-screen nodes are kept.
+EXTRACTOR = os.getenv("AGENT_EXTRACTOR", "snapshot")  # 'snapshot' or 'cdp'
+MODAL_SELECTOR = "[role='dialog'][aria-modal='true'], [role='alertdialog'], dialog[open]"
+
+_cdp_page = None
+_cdp_session = None
+
+def get_cdp_session(page: Page):
+    """One CDP session per page, reused across inspections."""
+    global _cdp_page, _cdp_session
+    if _cdp_session is None or _cdp_page is not page:
+        _cdp_session = page.context.new_cdp_session(page)
+        _cdp_page = page
+    return _cdp_session
+
+def _cdp_layout_boxes(cdp) -> dict[int, list[float]]:
+    """backendNodeId -> [x, y, width, height] (document coordinates) for the main frame, in one call."""
+    snap = cdp.send("DOMSnapshot.captureSnapshot", {"computedStyles": []})
+    doc = snap["documents"][0]
+    backend_ids = doc["nodes"]["backendNodeId"]
+    layout = doc["layout"]
+    return {backend_ids[idx]: bounds for idx, bounds in zip(layout["nodeIndex"], layout["bounds"])}
+
+def _on_screen(box, viewport: dict) -> bool:
+    if not box or box[2] <= 0 or box[3] <= 0:
+        return False
+    x, y, w, h = box
+    left, top = viewport["pageX"], viewport["pageY"]
+    return x < left + viewport["clientWidth"] and x + w > left and y < top + viewport["clientHeight"] and y + h > top
+
+def cdp_collect_elements(page: Page, registry: ElementRegistry, max_elements: int | None = None,
+                         time_budget_ms: float | None = None) -> AXWalkStats:
+    """Collect on-screen interactive nodes via CDP into the registry (same filters as the snapshot walk)."""
+    stats = AXWalkStats()
+    max_elements = AX_MAX_ELEMENTS if max_elements is None else max_elements
+    time_budget_ms = AX_TIME_BUDGET_MS if time_budget_ms is None else time_budget_ms
+    cdp = get_cdp_session(page)
+    viewport = cdp.send("Page.getLayoutMetrics")["cssLayoutViewport"]
+    boxes = _cdp_layout_boxes(cdp)
+    
+    # Partial tree: if a modal is open, only its subtree is interactive
+    nodes = None
+    doc = cdp.send("DOM.getDocument", {"depth": 0})
+    modal_ids = cdp.send("DOM.querySelectorAll", {"nodeId": doc["root"]["nodeId"], "selector": MODAL_SELECTOR})["nodeIds"]
+    for node_id in reversed(modal_ids):  # last in DOM order is topmost
+        backend_id = cdp.send("DOM.describeNode", {"nodeId": node_id})["node"]["backendNodeId"]
+        if _on_screen(boxes.get(backend_id), viewport):
+            nodes = cdp.send("Accessibility.queryAXTree", {"backendNodeId": backend_id})["nodes"]
+            stats.scope = "dialog"
+            stats.dialogs = 1
+            break
+    if nodes is None:
+        nodes = cdp.send("Accessibility.getFullAXTree")["nodes"]
+    
+    deadline = time.perf_counter() + time_budget_ms / 1000 if time_budget_ms else None
+    for ax in nodes:
+        if max_elements and len(registry) >= max_elements:
+            stats.stopped_by = "elements"
+            break
+        if deadline and stats.visited % 64 == 0 and time.perf_counter() > deadline:
+            stats.stopped_by = "time"
+            break
+        stats.visited += 1
+        if ax.get("ignored"):
+            continue
+        role = (ax.get("role") or {}).get("value", "")
+        if role not in INTERACTIVE_ROLES:
+            continue
+        if not _on_screen(boxes.get(ax.get("backendDOMNodeId")), viewport):
+            stats.offscreen += 1
+            continue
+        props = {p["name"]: (p.get("value") or {}).get("value") for p in ax.get("properties", [])}
+        node = {
             "role": role,
-            "name": name,
-            "description": f"{role} '{name}'"
-        })
+            "name": (ax.get("name") or {}).get("value", ""),
+            "disabled": bool(props.get("disabled")),
+            "haspopup": props.get("hasPopup") not in (None, "false"),
+        }
+        if "expanded" in props:
+            node["expanded"] = props["expanded"]
+        _register_ax_node(node, registry)
+    stats.pending = len(nodes) - stats.visited
+    return stats
+
+# ===== Spatial metadata =====
+# Layout hints ("Settings -> sidebar bottom", "top-right profile menu") only help if the model
+# knows where things are. One page.evaluate returns the box of every candidate DOM element;
+# registry entries are matched by (role, name) and tagged with a coarse screen region.
+SCREEN_REGIONS = ("top-left", "top-right", "sidebar", "content", "modal")
+SPATIAL_MAX_NODES = 3000
+SPATIAL_MAX_DUPLICATES = 10  # on-screen same role + name elements listed separately
+
+SPATIAL_JS = """
+(maxNodes) => {
+  const sel = 'button, a[href], input, textarea, select, summary, [role], [aria-label], [contenteditable="true"], [tabindex]';
+  const implicit = (el) => {
+    const tag = el.tagName.toLowerCase();
+    if (tag === 'a') return 'link';
+    if (tag === 'button' || tag === 'summary') return 'button';
+    if (tag === 'select') return 'combobox';
+    if (tag === 'textarea') return 'textbox';
+    if (tag === 'input') {
+      const t = (el.getAttribute('type') || 'text').toLowerCase();
+      if (t === 'checkbox') return el.getAttribute('role') === 'switch' ? 'switch' : 'checkbox';
+      if (t === 'search') return 'searchbox';
+      if (['button', 'submit', 'reset'].includes(t)) return 'button';
+      return 'textbox';
+    }
+    return el.isContentEditable ? 'textbox' : '';
+  };
+  const items = [];
+  for (const el of document.querySelectorAll(sel)) {
+    if (items.length >= maxNodes) break;
+    const r = el.getBoundingClientRect();
+    if (r.width <= 0 || r.height <= 0) continue;
+    let name = el.getAttribute('aria-label') || '';
+    if (!name) { try { name = (el.innerText || '').trim(); } catch (e) {} }
+    name = name || el.getAttribute('title') || el.getAttribute('placeholder') || el.value || '';
+    name = String(name).replace(/\\s+/g, ' ').trim().slice(0, 150);
+    if (!name) continue;
+    items.push([
+      el.getAttribute('role') || implicit(el), name,
+      Math.round(r.x), Math.round(r.y), Math.round(r.width), Math.round(r.height),
+      !!el.closest('[role="dialog"], [role="alertdialog"], dialog[open], [aria-modal="true"]'),
+      !!el.closest('nav, aside, [role="navigation"]'),
+    ]);
+  }
+  return { vw: window.innerWidth, vh: window.innerHeight, items };
+}
+"""
+
+def screen_region(bbox: list[int], vw: int, vh: int, in_modal: bool = False, in_nav: bool = False) -> str:
+    """Coarse region tag for a viewport box: top-left, top-right, sidebar, content or modal."""
+    if in_modal:
+        return "modal"
+    x, y, w, h = bbox
+    cx, cy = x + w / 2, y + h / 2
+    if cy < max(72, vh * 0.1):
+        return "top-left" if cx < vw / 2 else "top-right"
+    if cx < vw * 0.25 or (in_nav and cx < vw / 2):
+        return "sidebar"
+    return "content"
+
+def annotate_spatial(page: Page, registry: ElementRegistry) -> dict:
+    """Attach bbox + region to registry elements in one browser round trip; returns viewport and counts."""
+    data = page.evaluate(SPATIAL_JS, SPATIAL_MAX_NODES)
+    vw, vh = data["vw"], data["vh"]
+    by_key = {}  # (role, lowercased name) -> boxes in DOM order
+    for role, name, x, y, w, h, in_modal, in_nav in data["items"]:
+        on_screen = x < vw and y < vh and x + w > 0 and y + h > 0
+        by_key.setdefault((role, name.lower()), []).append(([x, y, w, h], in_modal, in_nav, on_screen))
+    matched = 0
+    regions = Counter()
+
+    def place(el: Element, entry: tuple):
+        nonlocal matched
+        bbox, in_modal, in_nav, _ = entry
+        el.bbox = bbox
+        el.region = screen_region(bbox, vw, vh, in_modal, in_nav)
+        regions[el.region] += 1
+        matched += 1
+
+    for el in list(registry):
+        if el.frame:
+            continue  # placed by collect_frame_elements
+        name = el.name.removeprefix("🆕 ").lower()
+        # Role-less DOM nodes (aria-label / tabindex divs) can stand in, never another role
+        entries = by_key.get((el.role, name)) or by_key.get(("", name))
+        if not entries:
+            continue
+        # The first on-screen match places the element; the other on-screen ones become their
+        # own entries, so a mark can point at the second "Edit" of a list (nth = DOM position)
+        on_screen = [k for k, entry in enumerate(entries) if entry[3]] or [0]
+        el.nth = on_screen[0]
+        place(el, entries[on_screen[0]])
+        for k in on_screen[1:SPATIAL_MAX_DUPLICATES]:
+            place(registry.add_instance(el, k), entries[k])
+    return {"viewport": [vw, vh], "matched": matched, "regions": dict(regions)}
+
+# Where elements for each goal intent tend to live (see the RAG layout hints)
+INTENT_REGIONS = {
+    "settings": {"sidebar": 3, "top-right": 3, "top-left": 2},
+    "theme": {"sidebar": 3, "top-right": 3, "top-left": 2},
+    "search": {"top-left": 2, "top-right": 2, "sidebar": 1},
+    "create": {"content": 2, "top-right": 1, "sidebar": 1},
+    "content": {"content": 2, "sidebar": 1},
+}
+
+def rank_elements(visible_elements: list[dict], goal: str, modal_open: bool = False) -> list[dict]:
+    """Order elements by relevance to the goal: modal content first, then name overlap and region affinity."""
+    words = {w for w in re.findall(r"[a-z0-9]+", (goal or "").lower()) if len(w) > 2}
+    affinity = Counter()
+    for intent in infer_intent(goal or ""):
+        affinity.update(INTENT_REGIONS.get(intent, {}))
+
+    def score(el: dict) -> int:
+        region = el.get("region", "")
+        s = 100 if modal_open and region == "modal" else 0
+        s += 10 * len(words & set(re.findall(r"[a-z0-9]+", el.get("name", "").lower())))
+        return s + affinity.get(region, 0)
+
+    return sorted(visible_elements, key=score, reverse=True)  # stable: ties keep tree order
+
+# ===== Frames =====
+# Embedded apps (job-apply widgets, OAuth popups, payment forms) live in iframes that
+# page.accessibility.snapshot() and the main-frame DOM never see. Every attached child
+# frame - same- or cross-origin - is read with one evaluate of SPATIAL_JS; its boxes are
+# shifted by the iframe's position so regions and marks work in page coordinates.
+FRAME_MAX_FRAMES = 20
+FRAME_MAX_ELEMENTS = 150  # per frame
+
+def _frame_base(frame) -> str:
+    return frame.name or frame.url.split("#")[0].split("?")[0]
+
+def frame_key(frame) -> str:
+    """Stable handle for a frame across inspections: its name, else its URL without query.
+    Unnamed iframes sharing a src get "#k", their order among the frames with that key."""
+    base = _frame_base(frame)
+    page = frame.page
+    same = [f for f in page.frames if f is not page.main_frame and not f.is_detached() and _frame_base(f) == base]
+    k = same.index(frame) if frame in same else 0
+    return f"{base}#{k}" if k else base
+
+def find_frame(page: Page, key: str):
+    """Frame for a frame_key(); the page itself for the main frame or a frame that has gone away."""
+    if key:
+        for frame in page.frames:
+            if frame is not page.main_frame and not frame.is_detached() and frame_key(frame) == key:
+                return frame
+    return page
+
+def collect_frame_elements(page: Page, registry: ElementRegistry, viewport: list[int] | None = None) -> dict:
+    """Add the interactive elements of every child frame to the registry, tagged with their frame."""
+    frames = [f for f in page.frames if f is not page.main_frame and not f.is_detached()
+              and f.url not in ("", "about:blank", "about:srcdoc")][:FRAME_MAX_FRAMES]
+    if viewport:
+        vw, vh = viewport
+    else:
+        size = page.viewport_size or {}
+        vw, vh = size.get("width", 0), size.get("height", 0)
+    stats = {"frames": len(frames), "read": 0, "elements": 0, "failed": 0, "truncated": 0}
+    for frame in frames:
+        key = frame_key(frame)
+        try:
+            box = frame.frame_element().bounding_box()
+            if not box or box["width"] <= 0 or box["height"] <= 0:
+                continue  # hidden iframe (trackers, prefetch)
+            data = frame.evaluate(SPATIAL_JS, FRAME_MAX_ELEMENTS * 2)
+        except Exception:
+            stats["failed"] += 1
+            continue
+        stats["read"] += 1
+        added = 0
+        for role, name, x, y, w, h, in_modal, _in_nav in data["items"]:
+            el = _register_ax_node({"role": role, "name": name}, registry, frame=key)
+            if isinstance(el, Element):
+                el.bbox = [round(box["x"]) + x, round(box["y"]) + y, w, h]
+                el.region = "modal" if in_modal else screen_region(el.bbox, vw, vh) if vw else ""
+                added += 1
+                if added >= FRAME_MAX_ELEMENTS:
+                    stats["truncated"] += 1
+                    break
+        stats["elements"] += added
+    return stats
+
+# ===== Set-of-marks =====
+# Numbered boxes are drawn over the screenshot; the planner answers with a mark number and
+# the executor resolves the bound element directly (exact role + name) instead of a regex.
+SET_OF_MARKS = os.getenv("AGENT_SET_OF_MARKS", "0") == "1"
+SOM_MAX_MARKS = 80
+SOM_MAX_DUPLICATES = 10  # same role + name candidates checked against a mark's box
+
+SOM_OVERLAY_JS = """
+(marks) => {
+  const layer = document.createElement('div');
+  layer.id = 'som-overlay-temp';
+  layer.style.cssText = 'position:fixed;inset:0;pointer-events:none;z-index:2147483647;';
+  for (const [n, x, y, w, h] of marks) {
+    const box = document.createElement('div');
+    box.style.cssText = `position:fixed;left:${x}px;top:${y}px;width:${w}px;height:${h}px;` +
+      'border:2px solid #ff00aa;box-sizing:border-box;';
+    const tag = document.createElement('span');
+    tag.textContent = n;
+    tag.style.cssText = 'position:absolute;left:-2px;top:-16px;background:#ff00aa;color:#fff;' +
+      'font:bold 11px/14px monospace;padding:0 3px;border-radius:2px;';
+    box.appendChild(tag);
+    layer.appendChild(box);
+  }
+  document.body.appendChild(layer);
+}
+"""
+
+def assign_marks(visible_elements: list[dict], viewport: list[int] | None) -> dict[str, str]:
+    """Number the on-screen elements (adds "mark" to each entry); returns mark -> element id."""
+    vw, vh = viewport or (0, 0)
+    marks = {}
+    for el in visible_elements:
+        bbox = el.get("bbox")
+        if not bbox or len(marks) >= SOM_MAX_MARKS:
+            continue
+        x, y, w, h = bbox
+        if w <= 0 or h <= 0 or x >= vw or y >= vh or x + w <= 0 or y + h <= 0:
+            continue
+        el["mark"] = len(marks) + 1
+        marks[str(el["mark"])] = el["id"]
+    return marks
+
+def draw_marks(page: Page, visible_elements: list[dict]):
+    page.evaluate(SOM_OVERLAY_JS, [[el["mark"], *el["bbox"]] for el in visible_elements if "mark" in el])
+
+def clear_marks(page: Page):
+    page.evaluate("document.getElementById('som-overlay-temp')?.remove()")
+
+def target_locator(page: Page, state: AgentState, role: str, name_pattern: str):
+    """Locator for the planned target: the element bound to the chosen mark, else role + regex."""
+    element_id = state.get("element_id", "")
+    el = next((e for e in state.get("visible_elements", []) if e.get("id") == element_id), None) if element_id else None
+    if el is None:
+        scope = target_scope(page, state, role, name_pattern)
+        state["locator"] = {"mode": "regex"}
+        if scope is not page:
+            state["locator"]["frame"] = frame_key(scope)
+        return scope.get_by_role(role, name=re.compile(name_pattern, re.IGNORECASE)).first
+    scope = find_frame(page, el.get("frame", ""))
+    state["locator"] = {"mode": "marks", "element_id": element_id}
+    if scope is not page:
+        state["locator"]["frame"] = frame_key(scope)
+    name = el["name"].removeprefix("🆕 ")
+    loc = scope.get_by_role(el["role"], name=name, exact=True)
+    if name != el["name"]:
+        # Supplementary "new/add" buttons are often plain divs - fall back to their text
+        loc = loc.or_(scope.get_by_text(name, exact=True))
+    return mark_candidate(loc, el)
+
+def mark_candidate(loc, el: dict):
+    """Pick the marked element among same role + name matches: the one under its box center,
+    else its DOM position recorded by annotate_spatial."""
+    try:
+        count = loc.count()
+    except Exception:
+        return loc.first
+    if count <= 1:
+        return loc.first
+    if el.get("bbox"):
+        x, y, w, h = el["bbox"]
+        cx, cy = x + w / 2, y + h / 2
+        for k in range(min(count, SOM_MAX_DUPLICATES)):
+            try:
+                box = loc.nth(k).bounding_box(timeout=1000)
+            except Exception:
+                continue
+            if box and box["x"] <= cx <= box["x"] + box["width"] and box["y"] <= cy <= box["y"] + box["height"]:
+                return loc.nth(k)
+    return loc.nth(min(el.get("nth", 0), count - 1))
+
+def target_scope(page: Page, state: AgentState, role: str, name_pattern: str):
+    """Frame (or page) to search for a role + regex target: where the inspector saw a match, main frame first."""
+    element_id = state.get("element_id", "")
+    frames = set()
+    for el in state.get("visible_elements", []):
+        if element_id and el.get("id") == element_id:
+            return find_frame(page, el.get("frame", ""))
+        if el.get("role") == role:
+            try:
+                if re.search(name_pattern, el.get("name", ""), re.IGNORECASE):
+                    frames.add(el.get("frame", ""))
+            except re.error:
+                return page
+    if not frames or "" in frames:
+        return page
+    return find_frame(page, min(frames))
+
+@dataclass
+class LocatorStats:
+    """Per-mode locator outcomes: first-try miss rate, resolve latency and executor step time."""
+    by_mode: dict = field(default_factory=dict)
+
+    def reset(self):
+        self.by_mode.clear()
+
+    def record(self, mode: str, hit: bool, resolve_ms: float, step_s: float):
+        row = self.by_mode.setdefault(mode, {"steps": 0, "misses": 0, "resolve_ms": 0.0, "step_s": 0.0})
+        row["steps"] += 1
+        row["misses"] += 0 if hit else 1
+        row["resolve_ms"] += resolve_ms
+        row["step_s"] += step_s
+
+    def summary(self) -> str:
+        lines = [f"{'mode':<8}{'steps':>6}{'miss %':>8}{'resolve ms':>12}{'step s':>8}"]
+        for mode, row in sorted(self.by_mode.items()):
+            n = max(row["steps"], 1)
+            lines.append(f"{mode:<8}{row['steps']:>6}{100 * row['misses'] / n:>8.1f}"
+                         f"{row['resolve_ms'] / n:>12.0f}{row['step_s'] / n:>8.2f}")
+        return "\n".join(lines)
+
+LOCATOR_STATS = LocatorStats()
+
+# ===== Text entry =====
+# keyboard.type(delay=50) costs 50 ms per character (10 s for a 200-char message). Native
+# inputs get fill() and contenteditable editors get a single insertText; only widgets that
+# start editing on a keydown (table cells) - or AGENT_TYPE_MODE=keys - still type key by key.
+# The fast paths read the value back and retype key by key if the text didn't land.
+TYPE_MODE = os.getenv("AGENT_TYPE_MODE", "auto")  # auto | keys
+TYPE_KEY_DELAY_MS = 50  # per-key delay of the keyboard path, and the baseline for time saved
+KEY_EVENT_ROLES = {"cell", "gridcell"}
+
+FIELD_VALUE_JS = "el => el.isContentEditable ? el.innerText : ('value' in el ? String(el.value) : el.textContent || '')"
+
+def _norm_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def _text_landed(loc, text: str) -> bool | None:
+    try:
+        return _norm_text(text) in _norm_text(loc.evaluate(FIELD_VALUE_JS))
+    except Exception:
+        return None  # can't read it back (detached/re-rendered) - don't second-guess the entry
+
+def enter_text(page: Page, loc, text: str, role: str) -> dict:
+    """Put text into the target with the fastest method it accepts; returns method, timing and time saved."""
+    if role in KEY_EVENT_ROLES:
+        log("  (table cell - clicking to activate)")
+        loc.click(timeout=3000)
+        page.wait_for_timeout(300)
+        kind = "cell"
+    elif loc.evaluate("el => el.isContentEditable"):
+        log("  (contenteditable element)")
+        loc.click(timeout=3000, force=True)  # Force click for complex nested DOMs
+        page.wait_for_timeout(500)  # Wait for any animations to complete
+        page.keyboard.press("Meta+A")  # Select all
+        page.keyboard.press("Backspace")  # Clear
+        page.wait_for_timeout(200)  # Let DOM process the clear
+        kind = "contenteditable"
+    else:
+        log("  (regular input field)")
+        loc.click(timeout=3000)
+        kind = "native"
+
+    started = time.perf_counter()
+    if kind == "cell" or TYPE_MODE == "keys":
+        method = "keys"
+        page.keyboard.type(text, delay=TYPE_KEY_DELAY_MS)
+    elif kind == "contenteditable":
+        method = "insert_text"
+        page.keyboard.insert_text(text)  # one beforeinput/input event, no key events
+    else:
+        method = "fill"
+        loc.fill(text)
+    verified = None if method == "keys" else _text_landed(loc, text)
+    if verified is False:
+        log(f"  ⚠️  {method} didn't land the text - retyping key by key")
+        if kind == "native":
+            loc.fill("")
+        else:
+            page.keyboard.press("Meta+A")
+            page.keyboard.press("Backspace")
+        page.keyboard.type(text, delay=TYPE_KEY_DELAY_MS)
+        method += "+keys"
+        verified = _text_landed(loc, text)
+    ms = (time.perf_counter() - started) * 1000
+    # Before this path, contenteditable was typed key by key; fill() on native inputs is unchanged
+    baseline_ms = len(text) * TYPE_KEY_DELAY_MS if kind == "contenteditable" else ms
+    return {"method": method, "kind": kind, "chars": len(text), "ms": round(ms, 1),
+            "saved_ms": round(max(0.0, baseline_ms - ms), 1), "verified": verified}
+
+@dataclass
+class TypingStats:
+    """Per-method text entry: steps, characters, time spent and time saved vs. per-key typing."""
+    by_method: dict = field(default_factory=dict)
+
+    def reset(self):
+        self.by_method.clear()
+
+    def record(self, entry: dict):
+        row = self.by_method.setdefault(entry["method"], {"steps": 0, "chars": 0, "ms": 0.0, "saved_ms": 0.0})
+        row["steps"] += 1
+        row["chars"] += entry["chars"]
+        row["ms"] += entry["ms"]
+        row["saved_ms"] += entry["saved_ms"]
+
+    def summary(self) -> str:
+        lines = [f"{'method':<18}{'steps':>6}{'chars':>7}{'ms/step':>9}{'saved s':>9}"]
+        for method, row in sorted(self.by_method.items()):
+            lines.append(f"{method:<18}{row['steps']:>6}{row['chars']:>7}"
+                         f"{row['ms'] / max(row['steps'], 1):>9.0f}{row['saved_ms'] / 1000:>9.1f}")
+        return "\n".join(lines)
+
+TYPING_STATS = TypingStats()
+
+# ===== Navigation graph =====
+# Per-app map of UI states and the clicks that moved between them, persisted across runs.
+# Nodes are a URL pattern (ids stripped) plus the open modal's signature; edges are the
+# click/hover that led from one to the other. Nodes where a run completed its goal are learned
+# destinations; when a destination's labels (title, URL path, goals finished there, clicks that
+# led in) cover most words of the new goal - however it is worded - the planner follows the
+# shortest known path there without calling the model;
+# an edge that stops leading where it used to is marked failed and dropped from routing, and
+# edges whose click looks consequential (EXPLORE_UNSAFE: create, send, delete, ...) are never replayed.
+NAV_DIR = Path(os.getenv("AGENT_NAV_DIR", "navgraphs"))
+NAV_ROUTING = os.getenv("AGENT_NAV_ROUTING", "1") != "0"
+NAV_MAX_FAILS = 2  # consecutive failures before an edge is ignored
+NAV_MATCH_MIN = 0.5  # share of the goal's words a destination's labels must cover
+_NAV_STOPWORDS = frozenset(
+    "a an the to in on of for and or my me go open click navigate find show page then with into".split())
+
+def url_pattern(url: str) -> str:
+    """host + path with id-like segments replaced by ':id' (query and fragment dropped)."""
+    parsed = urlparse(url)
+    segments = []
+    for seg in parsed.path.split("/"):
+        if re.search(r"[0-9a-f]{16,}|\d{3,}", seg, re.IGNORECASE):
+            seg = ":id"
+        segments.append(seg)
+    return (parsed.hostname or "").removeprefix("www.") + "/".join(segments).rstrip("/")
+
+def nav_node_id(url: str, snapshot: dict, visible_elements: list[dict]) -> str:
+    node = url_pattern(url)
+    if snapshot.get("active_modal"):
+        signature = snapshot.get("active_modal_title") or hashlib.blake2b(
+            "\x1f".join(sorted(el["name"] for el in visible_elements if el.get("region") == "modal")[:10]).encode(),
+            digest_size=4).hexdigest()
+        node += f"#modal:{signature}"
+    return node
+
+def _goal_key(goal: str) -> str:
+    return " ".join((goal or "").lower().split())
+
+def _nav_terms(text: str) -> set[str]:
+    """Content words of a goal or label: lowercased, stopwords and plural "s" dropped."""
+    return {w[:-1] if len(w) > 3 and w.endswith("s") else w
+            for w in re.findall(r"[a-z0-9]+", (text or "").lower()) if len(w) > 1 and w not in _NAV_STOPWORDS}
+
+class NavGraph:
+    """UI states (nodes) and the actions between them (edges) for one app, stored as JSON."""
+
+    def __init__(self, app: str, path: Path, nodes: dict | None = None, edges: dict | None = None):
+        self.app = app
+        self.path = path
+        self.nodes: dict[str, dict] = nodes or {}  # id -> {"title", "goals", "seen"}
+        self.edges: dict[str, dict[str, dict]] = edges or {}  # from -> to -> {"action", "ok", "fail", "last"}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, app: str) -> NavGraph:
+        path = NAV_DIR / (re.sub(r"[^\w.-]", "_", app) + ".json")
+        try:
+            data = json.loads(path.read_text())
+            return cls(app, path, data.get("nodes"), data.get("edges"))
+        except (FileNotFoundError, ValueError):
+            return cls(app, path)
+
+    def save(self):
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"app": self.app, "nodes": self.nodes, "edges": self.edges}))
+        tmp.replace(self.path)
+        self.dirty = False
+
+    def observe(self, node: str, title: str):
+        entry = self.nodes.setdefault(node, {"title": title, "goals": [], "seen": 0})
+        entry["title"] = title or entry["title"]
+        entry["seen"] += 1
+        self.dirty = True
+
+    def add_edge(self, src: str, dst: str, action: dict):
+        edge = self.edges.setdefault(src, {}).setdefault(dst, {"action": action, "ok": 0, "fail": 0})
+        edge.update(action=action, fail=0, last=time.time())
+        edge["ok"] += 1
+        self.dirty = True
+
+    def fail_edge(self, src: str, dst: str):
+        edge = self.edges.get(src, {}).get(dst)
+        if edge is not None:
+            edge["fail"] += 1
+            self.dirty = True
+
+    def mark_goal(self, node: str, goal: str):
+        entry = self.nodes.get(node)
+        key = _goal_key(goal)
+        if entry is not None and key and key not in entry["goals"]:
+            entry["goals"] = (entry["goals"] + [key])[-10:]
+            self.dirty = True
+
+    def shortest_path(self, src: str, dst: str) -> list[tuple[str, dict]]:
+        """BFS over working edges; [(next_node, edge), ...] or [] if unreachable."""
+        parents = {src: None}
+        frontier = deque([src])
+        while frontier:
+            node = frontier.popleft()
+            if node == dst:
+                path = []
+                while parents[node] is not None:
+                    prev, edge = parents[node]
+                    path.append((node, edge))
+                    node = prev
+                return path[::-1]
+            for nxt, edge in self.edges.get(node, {}).items():
+                if nxt not in parents and edge["fail"] < NAV_MAX_FAILS and \
+                        not EXPLORE_UNSAFE.search(edge["action"].get("name_pattern", "")):
+                    parents[nxt] = (node, edge)
+                    frontier.append(nxt)
+        return []
+
+    def labels(self, node: str) -> set[str]:
+        """Words naming a node: URL path (not the host), modal/page title, goals completed there
+        and the names of the clicks that led to it."""
+        entry = self.nodes.get(node, {})
+        text = [node.partition("/")[2].replace("#modal:", " "), entry.get("title", ""), *entry.get("goals", [])]
+        text += [edges[node]["action"].get("name_pattern", "") for edges in self.edges.values() if node in edges]
+        return _nav_terms(" ".join(text))
+
+    def route(self, src: str, goal: str) -> tuple[str, list[tuple[str, dict]]] | None:
+        """Best-matching learned destination for the goal, and the shortest safe path there.
+
+        A destination must cover NAV_MATCH_MIN of the goal's words and match better than the
+        current node, so routing never bounces between equally good destinations."""
+        terms = _nav_terms(goal)
+        if not terms:
+            return None
+
+        def score(node: str) -> float:
+            return len(terms & self.labels(node)) / len(terms)
+
+        floor = max(NAV_MATCH_MIN, score(src) + 1e-9)
+        best = None  # (score, path length, node, path)
+        for node, entry in self.nodes.items():
+            if node == src or not entry.get("goals"):
+                continue
+            match = score(node)
+            if match < floor:
+                continue
+            path = self.shortest_path(src, node)
+            if path and (best is None or (match, -len(path)) > (best[0], -best[1])):
+                best = (match, len(path), node, path)
+        return (best[2], best[3]) if best else None
+
+_nav_graphs: dict[str, NavGraph] = {}
+
+def nav_graph(url: str) -> NavGraph:
+    """The navigation graph for this URL's app (keyed like sessions: detect_app, else hostname)."""
+    app_name = session_key(url)
+    if app_name not in _nav_graphs:
+        _nav_graphs[app_name] = NavGraph.load(app_name)
+    return _nav_graphs[app_name]
+
+def update_nav_graph(state: AgentState, url: str, snapshot: dict, visible_elements: list[dict]):
+    """Record the current node, the edge from the last action, and route breaks (called by the inspector)."""
+    nav = nav_graph(url)
+    node = nav_node_id(url, snapshot, visible_elements)
+    nav.observe(node, snapshot.get("active_modal_title") or snapshot.get("title", ""))
+    pending = state.get("nav_pending") or {}
+    last = state["actions_performed"].last
+    if pending and last is not None and last.kind == "action" and \
+            [last.action_type, last.role, last.name_pattern] == [pending["action"][k] for k in ("action_type", "role", "name_pattern")]:
+        if pending["from"] != node:
+            nav.add_edge(pending["from"], node, pending["action"])
+        if pending.get("expect") and pending["expect"] != node:
+            log(f"🗺️  Known route broke: expected '{pending['expect']}', landed on '{node}'")
+            nav.fail_edge(pending["from"], pending["expect"])
+    elif pending.get("expect"):
+        nav.fail_edge(pending["from"], pending["expect"])
+    if state.get("goal_text_entered"):
+        # The goal was finished by an action taken on the previous node
+        nav.mark_goal(pending.get("from") or state.get("nav_node", ""), state.get("goal", ""))
+    state["nav_node"] = node
+    state["nav_pending"] = {}
+    nav.save()
+
+# ===== Dead locator cache =====
+# failed_actions only lives for one run. This remembers, across runs, role + pattern pairs that
+# never resolved in a given UI state: (app, nav node, role, pattern) -> decayed failure score. The
+# nav node (see nav_node_id) carries the modal signature, so a button that is only missing behind
+# a dialog is not condemned for the page underneath.
+# Each miss adds 1 to the score after halving it every DEAD_LOCATOR_HALF_LIFE_H hours; a hit
+# forgets the entry. At DEAD_LOCATOR_THRESHOLD the executor rejects the pattern without waiting
+# and the planner is shown the page's dead patterns.
+DEAD_LOCATOR_PATH = Path(os.getenv("AGENT_DEAD_LOCATORS", "dead_locators.json"))
+DEAD_LOCATOR_HALF_LIFE_H = float(os.getenv("AGENT_DEAD_LOCATOR_HALF_LIFE_H", "72"))
+DEAD_LOCATOR_THRESHOLD = float(os.getenv("AGENT_DEAD_LOCATOR_THRESHOLD", "1.9"))  # ~two recent misses
+DEAD_LOCATOR_MAX_ENTRIES = 2000
+
+class DeadLocatorCache:
+    """Persistent, time-decayed negative cache of locators that timed out."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: dict[str, dict] | None = None  # key -> {"score", "last"}; loaded on first use
+
+    @staticmethod
+    def key(url: str, node: str, role: str, pattern: str) -> str:
+        return json.dumps([session_key(url), node or url_pattern(url), role, pattern])
+
+    def _load(self) -> dict[str, dict]:
+        if self.entries is None:
+            try:
+                self.entries = json.loads(self.path.read_text())
+            except (FileNotFoundError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def _save(self):
+        entries = self._load()
+        if len(entries) > DEAD_LOCATOR_MAX_ENTRIES:
+            for key in sorted(entries, key=lambda k: self.score_of(entries[k]))[:len(entries) - DEAD_LOCATOR_MAX_ENTRIES]:
+                del entries[key]
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(entries))
+        tmp.replace(self.path)
+
+    @staticmethod
+    def score_of(entry: dict, now: float | None = None) -> float:
+        age_h = ((now or time.time()) - entry["last"]) / 3600
+        return entry["score"] * 0.5 ** (age_h / DEAD_LOCATOR_HALF_LIFE_H)
+
+    def is_dead(self, url: str, node: str, role: str, pattern: str) -> bool:
+        entry = self._load().get(self.key(url, node, role, pattern))
+        return entry is not None and self.score_of(entry) >= DEAD_LOCATOR_THRESHOLD
+
+    def record_failure(self, url: str, node: str, role: str, pattern: str):
+        entries = self._load()
+        key = self.key(url, node, role, pattern)
+        now = time.time()
+        entry = entries.get(key)
+        entries[key] = {"score": (self.score_of(entry, now) if entry else 0.0) + 1, "last": now}
+        self._save()
+
+    def record_success(self, url: str, node: str, role: str, pattern: str):
+        if self._load().pop(self.key(url, node, role, pattern), None) is not None:
+            self._save()
+
+    def dead_on_page(self, url: str, node: str) -> list[tuple[str, str]]:
+        """(role, pattern) pairs currently rejected in this UI state."""
+        prefix = json.dumps([session_key(url), node or url_pattern(url)])[:-1] + ","
+        now = time.time()
+        return [tuple(json.loads(key)[2:]) for key, entry in self._load().items()
+                if key.startswith(prefix) and self.score_of(entry, now) >= DEAD_LOCATOR_THRESHOLD]
+
+DEAD_LOCATORS = DeadLocatorCache(DEAD_LOCATOR_PATH)
+
+# ===== Speculative menu exploration =====
+# A Settings entry hidden behind one of several corner menus used to cost a full
+# inspect -> plan -> execute turn per menu. In explore mode the candidate menus are opened
+# side by side in extra pages of the same context (same cookies/session): all pages navigate
+# at once, each opens one menu, one shared settle wait, then every page is harvested.
+EXPLORE_MODE = os.getenv("AGENT_EXPLORE", "0") == "1"
+EXPLORE_MAX_CANDIDATES = int(os.getenv("AGENT_EXPLORE_MAX", "5"))
+EXPLORE_SETTLE_MS = 700
+EXPLORE_REGIONS = ("top-left", "top-right", "sidebar")
+MENU_HINTS = ("menu", "more", "…", "...", "settings", "account", "profile", "workspace", "options", "user", "avatar")
+# Never touch these in a speculative page - clones share the logged-in context, so actions are real
+EXPLORE_UNSAFE = re.compile(r"delete|remove|log\s*out|sign\s*out|send|submit|pay|buy|archive|leave|invite|"
+                            r"create|new|add|duplicate|import|upgrade|share|move|publish", re.IGNORECASE)
+
+def goal_terms_visible(goal: str, visible_elements: list[dict]) -> bool:
+    """True if any significant goal word already appears in an element name."""
+    words = {w for w in re.findall(r"[a-z]+", (goal or "").lower()) if len(w) > 3}
+    words -= {"click", "open", "change", "switch", "turn", "make", "with", "from", "into", "that", "then", "this"}
+    names = " ".join(el.get("name", "") for el in visible_elements).lower()
+    return any(w in names for w in words)
+
+def menu_candidates(visible_elements: list[dict], explored: list[str], limit: int = EXPLORE_MAX_CANDIDATES) -> list[dict]:
+    """Menu triggers in the page chrome (corners, sidebar): elements that declare a popup, comboboxes
+    and menu-ish names only - a plain button in a clone of the live session would really act."""
+    scored = []
+    for order, el in enumerate(visible_elements):
+        role, name = el.get("role"), el.get("name", "")
+        if role not in ("button", "menuitem", "treeitem", "combobox") or el.get("frame"):
+            continue
+        if el.get("region") not in EXPLORE_REGIONS or f"{role}:{name}" in explored:
+            continue
+        if not name or len(name) > 40 or EXPLORE_UNSAFE.search(name):
+            continue
+        hinted = any(h in name.lower() for h in MENU_HINTS)
+        if not (el.get("popup") or role == "combobox" or hinted):
+            continue
+        score = 2 * hinted + 2 * bool(el.get("popup")) + (el["region"] != "sidebar")
+        scored.append((-score, order, el))
+    return [el for _, _, el in sorted(scored, key=lambda t: t[:2])[:limit]]
+
+def _harvest_menu(clone, known_keys: set) -> list[dict]:
+    """Interactive elements on a clone page that the main page didn't show."""
+    revealed, seen = [], set()
+    for role, name, *_box in clone.evaluate(SPATIAL_JS, SPATIAL_MAX_NODES)["items"]:
+        key = (role, name.lower())
+        if role in INTERACTIVE_ROLES and key not in known_keys and key not in seen and len(name) < 150:
+            seen.add(key)
+            revealed.append({"role": role, "name": name})
+    return revealed[:25]
+
+def explore_menus(page: Page, candidates: list[dict], known: list[dict]) -> list[dict]:
+    """Open each candidate menu in its own page and return what each one reveals.
+
+    Every trigger is hovered first. Only triggers that declare a popup and revealed nothing on
+    hover are then clicked - clicking a popup trigger opens its menu and nothing else."""
+    context = page.context
+    url = page.url
+    known_keys = {(el.get("role"), el.get("name", "").lower()) for el in known}
+    pages = []
+    try:
+        for _ in candidates:
+            clone = context.new_page()
+            clone.goto(url, wait_until="commit", timeout=30000)  # returns early; loads run concurrently
+            pages.append(clone)
+        opened = []
+        for clone, el in zip(pages, candidates):
+            try:
+                clone.wait_for_load_state("load", timeout=30000)
+                trigger = clone.get_by_role(el["role"], name=el["name"].removeprefix("🆕 "), exact=True).first
+                trigger.hover(timeout=3000)
+                opened.append((clone, el, trigger))
+            except Exception as e:
+                log(f"    ⚠️  Could not open '{el['name']}': {str(e).splitlines()[0][:80]}")
+        if opened:
+            page.wait_for_timeout(EXPLORE_SETTLE_MS)  # menus animate in all pages at once
+        menus, to_click = [], []
+        for clone, el, trigger in opened:
+            try:
+                revealed = _harvest_menu(clone, known_keys)
+            except Exception:
+                continue
+            if not revealed and (el.get("popup") or el["role"] == "combobox"):
+                to_click.append((clone, el, trigger))
+                continue
+            menus.append({"trigger": {"id": el.get("id", ""), "role": el["role"], "name": el["name"], "action": "hover"},
+                          "revealed": revealed})
+        clicked = []
+        for clone, el, trigger in to_click:
+            try:
+                trigger.click(timeout=3000)
+                clicked.append((clone, el))
+            except Exception as e:
+                log(f"    ⚠️  Could not open '{el['name']}': {str(e).splitlines()[0][:80]}")
+        if clicked:
+            page.wait_for_timeout(EXPLORE_SETTLE_MS)
+        for clone, el in clicked:
+            try:
+                revealed = _harvest_menu(clone, known_keys)
+            except Exception:
+                continue
+            menus.append({"trigger": {"id": el.get("id", ""), "role": el["role"], "name": el["name"], "action": "click"},
+                          "revealed": revealed})
+        return menus
+    finally:
+        for clone in pages:
+            try:
+                clone.close()
+            except Exception:
+                pass
+
+def menu_map_context(menu_map: dict) -> str:
+    """Planner text for the explored menus."""
+    lines = []
+    for menu in menu_map.get("menus", []):
+        trigger = menu["trigger"]
+        revealed = ", ".join(f"[{r['role']}] {r['name']}" for r in menu["revealed"][:12]) or "(nothing new)"
+        lines.append(f"- {trigger['action']} [{trigger['role']}] {trigger['name']} → {revealed}")
+    return "\n".join(lines)
+
+def _append_unique(registry: ElementRegistry, role, name):
+    """Append one element if it's not already present."""
+    if name:
+        registry.add(role, name)
 
 def inspector(state: AgentState) -> AgentState:
     """Navigate to website and take screenshot (now also builds structured runtime snapshot)."""
@@ -691,109 +2819,81 @@ def inspector(state: AgentState) -> AgentState:
     
     if is_first:
         if not website_url:
-            print("❌ No website URL provided!")
+            log("❌ No website URL provided!")
             return state
         
-        print(f"📸 Inspector: Navigating to {website_url}...")
+        log(f"📸 Inspector: Navigating to {website_url}...")
+        load_started = time.perf_counter()
         page.goto(website_url, wait_until="load", timeout=60000)
+        ROUTE_STATS.load_ms = (time.perf_counter() - load_started) * 1000
+        if ROUTE_STATS.profile != "off":
+            log(f"🚦 Loaded in {ROUTE_STATS.load_ms:.0f} ms - {ROUTE_STATS.summary()}")
         page.wait_for_timeout(2000)  # Let page hydrate
         state["is_first_visit"] = False
-        print(f"✅ Loaded: {page.url}")
+        log(f"✅ Loaded: {page.url}")
     else:
-        print(f"📸 Inspector: Current page - {page.url}")
+        log(f"📸 Inspector: Current page - {page.url}")
         page.wait_for_timeout(1000)  # Wait for animations to settle
         
-    # Check for authentication pages - pause for manual login
+    # Check for authentication pages - hand off to the configured login handler
     current_url = page.url
     url_path = current_url.split('?')[0]  # Remove query params
-    login_pattern = re.compile(r'/(login|signin|sign-in|signup|sign-up|auth|authenticate|register)(/|$)', re.IGNORECASE)
-    if login_pattern.search(url_path):
-        print("\n" + "="*70)
-        print("🔐 AUTHENTICATION REQUIRED")
-        print("="*70)
-        print(f"Current URL: {current_url}")
-        print("\nPlease log in MANUALLY in the browser window.")
-        print("="*70)
-        input("\nPress ENTER after you've logged in: ")
-        page.wait_for_timeout(2000)
-        print(f"\n✅ Continuing from: {page.url}\n")
+    if LOGIN_URL_PATTERN.search(url_path):
+        global _saw_login_page, _session_loaded
+        if _session_loaded:
+            # We started from a saved session but still hit a login page - it has expired server-side
+            log(f"🔑 Saved session for '{_session_key}' no longer authenticates - will refresh after login")
+            invalidate_session()
+            _session_loaded = False
+        _saw_login_page = True
+        handler = _login_handler or (interactive_login if INTERACTIVE else None)
+        if handler is None:
+            log(f"🔐 Login page detected ({current_url}) - no login handler, continuing unattended")
+        else:
+            logged_in = handler(page, current_url)
+            page.wait_for_timeout(2000)
+            log(f"\n{'✅' if logged_in else '⚠️ '} Continuing from: {page.url}\n")
+            if logged_in:
+                save_session()
+                _session_loaded = True
     
     # Extract ALL interactive elements using accessibility tree
-    visible_elements = []
-    print("\nVISIBLE INTERACTIVE ELEMENTS:")
-    
-    # Check for modals/dialogs first (they have priority)
-    modals = page.locator("[role='dialog']:visible, [role='alertdialog']:visible").all()
-    if modals:
-        print(f"  ℹ️  {len(modals)} modal(s) detected - PRIORITIZING MODAL CONTENT")
+    registry = ElementRegistry()
+    walk_stats = AXWalkStats()
+    backend = "ax_snapshot"
+    extract_ms = 0.0
+    max_elements, time_budget_ms = ax_limits(page.url)
+    log("\nVISIBLE INTERACTIVE ELEMENTS:")
     
     try:
-        tree = page.accessibility.snapshot()
-        
-        def extract_elements(node, depth=0):
-            if not isinstance(node, dict):
-                return
-            
-            role = node.get("role", "")
-            name = node.get("name", "")
-            disabled = node.get("disabled", False)
-            
-            interactive_roles = [
-                "link", "button", "textbox", "switch", "tab", 
-                "option", "menuitem", "menuitemradio", "menuitemcheckbox",
-                "treeitem", "combobox", "listbox", "row", "cell", "gridcell",
-                "search", "searchbox"
-            ]
-            
-            if disabled:
-                return
-            
-            if role in interactive_roles and name and len(name) < 150:
-                skip_patterns = ["hidden properties", "hidden columns", "drag"]
-                if any(skip in name.lower() for skip in skip_patterns):
-                    return
-                
-                if not any(el['name'] == name and el['role'] == role for el in visible_elements):
-                    is_creation_element = (
-                        role in ["button", "link"] and 
-                        any(keyword in name.lower() for keyword in ["+ new", "new page", "+ add"])
-                    )
-                    if is_creation_element:
-                        existing_similar = sum(1 for el in visible_elements 
-                                              if el['name'].lower() == name.lower())
-                        if existing_similar >= 2:
-                            return
-                    if role == "button" and ("new" in name.lower() and ("task" in name.lower() or "to-do" in name.lower() or "todo" in name.lower())):
-                        name = f"🆕 {name}"
-                    if role == "menuitem" and ("'s" in name or "profile" in name.lower() or "account" in name.lower()):
-                        name = f"📋{name}"
-                    
-                    visible_elements.append({
-                        "role": role,
-                        "name": name,
-                        "description": f"{role} '{name}'"
-                    })
-            
-            for child in node.get("children", []):
-                if isinstance(child, dict):
-                    extract_elements(child, depth + 1)
-        
-        extract_elements(tree)
+        extract_started = time.perf_counter()
+        if EXTRACTOR == "cdp":
+            try:
+                walk_stats = cdp_collect_elements(page, registry, max_elements, time_budget_ms)
+                backend = "cdp"
+            except Exception as cdp_err:
+                log(f"  ⚠️  CDP extraction failed ({cdp_err}) - falling back to accessibility snapshot")
+                registry = ElementRegistry()
+        if backend == "ax_snapshot":
+            tree = page.accessibility.snapshot()
+            walk_stats = collect_ax_elements(tree, registry, max_elements, time_budget_ms)
+        extract_ms = (time.perf_counter() - extract_started) * 1000
+        log(f"  🌳 {backend} extraction ({extract_ms:.0f} ms): {walk_stats.summary()}")
         
-        if len(visible_elements) == 0:
-            print("⚠️  Accessibility tree empty - using direct DOM inspection (SPA detected)...")
+        if len(registry) == 0:
+            log("⚠️  Accessibility tree empty - using direct DOM inspection (SPA detected)...")
             page.wait_for_timeout(2000)
             tree = page.accessibility.snapshot()
-            extract_elements(tree)
+            walk_stats = collect_ax_elements(tree, registry, max_elements, time_budget_ms)
             
-            if len(visible_elements) == 0:
-                print("⚠️  Accessibility tree still empty - using comprehensive DOM fallback...")
+            if len(registry) == 0:
+                log("⚠️  Accessibility tree still empty - using comprehensive DOM fallback...")
                 page.wait_for_timeout(3000)
                 
                 try:
-                    print("  🔍 Extracting buttons...")
+                    log("  🔍 Extracting buttons...")
                     buttons = page.locator("button").all()
-                    print(f"  → Found {len(buttons)} button elements")
+                    log(f"  → Found {len(buttons)} button elements")
                     
                     buttons_added = 0
                     buttons_skipped = 0
@@ -809,17 +2909,16 @@ def inspector(state: AgentState) -> AgentState:
                             try: title = btn.get_attribute("title", timeout=300) or ""
                             except: pass
                             name = aria_label or text or title
-                            if name and len(name) > 1 and len(name) < 300:
-                                visible_elements.append({"role": "button", "name": name, "description": f"button '{name}'"})
+                            if name and len(name) > 1 and len(name) < 300 and registry.add("button", name):
                                 buttons_added += 1
                             else:
                                 buttons_skipped += 1
                         except Exception:
                             buttons_skipped += 1
                     
-                    print(f"  ✓ Added {buttons_added} buttons to list ({buttons_skipped} skipped)")
+                    log(f"  ✓ Added {buttons_added} buttons to list ({buttons_skipped} skipped)")
                     
-                    print(f"  🔍 Searching for action buttons by common patterns...")
+                    log(f"  🔍 Searching for action buttons by common patterns...")
                     try:
                         action_button_selectors = [
                             "button[id*='apply']", "button[class*='apply']",
@@ -836,17 +2935,17 @@ def inspector(state: AgentState) -> AgentState:
                                     try: btn_text = action_btn.inner_text(timeout=500).strip()
                                     except: pass
                                     btn_name = aria or btn_text
-                                    if btn_name and not any(el.get('name') == btn_name for el in visible_elements):
-                                        print(f"  🎯 FOUND action button via '{selector}': '{btn_name}'")
-                                        visible_elements.append({"role": "button", "name": btn_name, "description": f"button '{btn_name}'"})
+                                    if btn_name and not registry.has_name(btn_name):
+                                        log(f"  🎯 FOUND action button via '{selector}': '{btn_name}'")
+                                        registry.add("button", btn_name)
                                         buttons_added += 1
                             except: pass
                     except Exception as action_err:
-                        print(f"  ⚠️  Action button search failed: {action_err}")
+                        log(f"  ⚠️  Action button search failed: {action_err}")
                     
-                    print(f"  🔍 Extracting links...")
+                    log(f"  🔍 Extracting links...")
                     links = page.locator("a").all()
-                    print(f"  → Found {len(links)} link elements")
+                    log(f"  → Found {len(links)} link elements")
                     links_added = 0
                     for link in links[:100]:
                         try:
@@ -856,15 +2955,15 @@ def inspector(state: AgentState) -> AgentState:
                             except: pass
                             name = aria_label or text
                             if name and len(name) > 1 and len(name) < 300:
-                                if not any(el.get('name') == name for el in visible_elements):
-                                    visible_elements.append({"role": "link", "name": name, "description": f"link '{name}'"})
+                                if not registry.has_name(name):
+                                    registry.add("link", name)
                                     links_added += 1
                         except: pass
-                    print(f"  ✓ Added {links_added} links to list")
+                    log(f"  ✓ Added {links_added} links to list")
                     
-                    print(f"  🔍 Extracting inputs...")
+                    log(f"  🔍 Extracting inputs...")
                     inputs = page.locator("input, textarea").all()
-                    print(f"  → Found {len(inputs)} input elements")
+                    log(f"  → Found {len(inputs)} input elements")
                     inputs_added = 0
                     for inp in inputs[:50]:
                         try:
@@ -872,40 +2971,16 @@ def inspector(state: AgentState) -> AgentState:
                             placeholder = inp.get_attribute("placeholder", timeout=200) or ""
                             name = aria_label or placeholder or "input"
                             if name and len(name) > 0:
-                                if not any(el.get('name') == name for el in visible_elements):
-                                    visible_elements.append({"role": "textbox", "name": name, "description": f"textbox '{name}'"})
+                                if not registry.has_name(name):
+                                    registry.add("textbox", name)
                                     inputs_added += 1
                         except: pass
-                    print(f"  ✓ Added {inputs_added} inputs to list")
+                    log(f"  ✓ Added {inputs_added} inputs to list")
                     
-                    print(f"  🔍 Checking for iframes...")
-                    try:
-                        frames = page.frames
-                        print(f"  → Found {len(frames)} frames")
-                        if len(frames) > 1:
-                            for frame in frames[1:3]:
-                                try:
-                                    frame_buttons = frame.locator("button").all()
-                                    print(f"    → Iframe has {len(frame_buttons)} buttons")
-                                    for btn in frame_buttons[:30]:
-                                        try:
-                                            aria = btn.get_attribute("aria-label", timeout=200) or ""
-                                            txt = ""
-                                            try: txt = btn.inner_text(timeout=200).strip()
-                                            except: pass
-                                            name = aria or txt
-                                            if name and "apply" in name.lower():
-                                                print(f"    🎯 FOUND in iframe: '{name}'")
-                                                visible_elements.append({"role": "button", "name": name, "description": f"button '{name}'"})
-                                                buttons_added += 1
-                                        except: pass
-                                except Exception: pass
-                    except Exception as iframe_err:
-                        print(f"  ⚠️  Iframe check failed: {iframe_err}")
                 except Exception as dom_err:
-                    print(f"  ⚠️  DOM extraction error: {dom_err}")
+                    log(f"  ⚠️  DOM extraction error: {dom_err}")
                 
-                print(f"  📊 Total extracted so far: {len(visible_elements)} elements")
+                log(f"  📊 Total extracted so far: {len(registry)} elements")
         
         try:
             all_buttons = page.locator("button:visible, div[role='button']:visible, a:visible").all()
@@ -923,60 +2998,107 @@ def inspector(state: AgentState) -> AgentState:
                             ("new to-do" in display_name.lower())
                         )
                         is_general_add = "+" in display_name and len(display_name) < 15
-                        if (is_task_button or is_general_add) and not any(el['name'] == display_name or el['name'] == f"🆕 {display_name}" for el in visible_elements):
-                            visible_elements.append({
-                                "role": "button",
-                                "name": f"🆕 {display_name}",
-                                "description": f"button '{display_name}'"
-                            })
-                            print(f"  💡 Found via locator: {display_name}")
+                        if (is_task_button or is_general_add) and not registry.has_name(display_name) and not registry.has_name(f"🆕 {display_name}"):
+                            registry.add("button", f"🆕 {display_name}", description=f"button '{display_name}'")
+                            log(f"  💡 Found via locator: {display_name}")
                 except: pass
         except Exception as e:
-            print(f"⚠️ Supplementary search failed: {e}")
+            log(f"⚠️ Supplementary search failed: {e}")
         
-        for i, el in enumerate(visible_elements[:40]):
-            role = el['role']
-            name = el['name']
+        for n, el in zip(range(40), registry):
+            role = el.role
+            name = el.name
             if role == "switch":
-                print(f"{i+1}. [🔘{role}] {name}")
+                log(f"{n+1}. [🔘{role}] {name}")
             elif role in ["option", "menuitem", "menuitemradio", "combobox"]:
-                print(f"{i+1}. [📋{role}] {name}")
+                log(f"{n+1}. [📋{role}] {name}")
             else:
-                print(f"{i+1}. [{role}] {name}")
+                log(f"{n+1}. [{role}] {name}")
                 
     except Exception as e:
-        print(f"⚠️ Error extracting from accessibility tree: {e}")
+        log(f"⚠️ Error extracting from accessibility tree: {e}")
     
+    spatial = {}
+    try:
+        spatial_started = time.perf_counter()
+        spatial = annotate_spatial(page, registry)
+        spatial["ms"] = round((time.perf_counter() - spatial_started) * 1000, 1)
+        log(f"  📐 Spatial tags: {spatial['matched']}/{len(registry)} elements placed {spatial['regions']} ({spatial['ms']:.0f} ms)")
+    except Exception as e:
+        log(f"⚠️ Spatial annotation failed: {e}")
+    
+    frame_stats = {}
+    try:
+        frames_started = time.perf_counter()
+        frame_stats = collect_frame_elements(page, registry, spatial.get("viewport"))
+        frame_stats["ms"] = round((time.perf_counter() - frames_started) * 1000, 1)
+        if frame_stats["frames"]:
+            log(f"  🪟 Frames: {frame_stats['elements']} elements from {frame_stats['read']}/{frame_stats['frames']} iframes"
+                f" ({frame_stats['failed']} unreadable, {frame_stats['ms']:.0f} ms)")
+    except Exception as e:
+        log(f"⚠️ Frame extraction failed: {e}")
+    
+    visible_elements = registry.to_list()
+    state["marks"] = assign_marks(visible_elements, spatial.get("viewport")) if SET_OF_MARKS else {}
     state["visible_elements"] = visible_elements
+    # Element / time caps hit: the target may be among what was dropped (raise AGENT_AX_SITE_LIMITS for the site)
+    truncated = bool(walk_stats.stopped_by) or frame_stats.get("truncated", 0) > 0
+    state["extraction"] = {"backend": backend, "ms": round(extract_ms, 1), **asdict(walk_stats), "spatial": spatial,
+                           "frames": frame_stats, "truncated": truncated,
+                           "limits": {"max_elements": max_elements, "time_budget_ms": time_budget_ms}}
+    if truncated:
+        log(f"⚠️  Element list truncated (limits {max_elements} elements / {time_budget_ms:.0f} ms"
+            f"{', frame cap hit' if frame_stats.get('truncated') else ''}) - the target may be missing")
     
-    print(f"\n📊 Total elements extracted: {len(visible_elements)}")
-    print(f"   Roles breakdown: {', '.join(set(el['role'] for el in visible_elements))}")
+    log(f"\n📊 Total elements extracted: {len(visible_elements)}")
+    log(f"   Roles breakdown: {', '.join(set(el['role'] for el in visible_elements))}")
     
     column_buttons = [el for el in visible_elements if el['role'] == 'button' and any(col in el['name'].lower() for col in ['task name', 'status', 'assignee', 'due date', 'priority'])]
     if len(column_buttons) >= 3:
-        print(f"\n📋 Table detected with {len(column_buttons)} column headers")
-        print("   💡 Hint: Look for 'New' or 'Add' button to create a row, or find a textbox to type directly")
+        log(f"\n📋 Table detected with {len(column_buttons)} column headers")
+        log("   💡 Hint: Look for 'New' or 'Add' button to create a row, or find a textbox to type directly")
     
     theme_elements = [el for el in visible_elements if "dark" in el['name'].lower() or "light" in el['name'].lower() or "theme" in el['name'].lower()]
     if theme_elements:
-        print(f"\n🎨 Theme-related elements found:")
+        log(f"\n🎨 Theme-related elements found:")
         for el in theme_elements:
-            print(f"   [{el['role']}] {el['name']}")
+            log(f"   [{el['role']}] {el['name']}")
     
     # Screenshot
     global screenshots_dir
     current_screenshot = screenshots_dir / "step_current.png"
-    page.screenshot(path=str(current_screenshot))
-    with open(current_screenshot, "rb") as f:
-        state["img_base64"] = base64.b64encode(f.read()).decode("utf-8")
-    print(f"📸 Screenshot saved: {current_screenshot}\n")
+    if state["marks"]:
+        try:
+            draw_marks(page, visible_elements)
+            log(f"🔢 Set-of-marks: {len(state['marks'])} elements numbered on the screenshot")
+        except Exception as e:
+            log(f"⚠️ Could not draw marks: {e}")
+    frame = save_screenshot(page, current_screenshot, i)  # global step counter: steps executed so far
+    if state["marks"]:
+        try:
+            clear_marks(page)
+        except Exception:
+            pass
+    # Point at the content-addressed blob: stays valid after step_current.png is overwritten
+    state["screenshot"] = str(SCREENSHOTS.blob_path(frame))
+    log(f"📸 Screenshot saved: {current_screenshot}\n")
 
     # 🧠 NEW: build and store structured snapshot for GPT
     snapshot = build_state_snapshot(page, state, visible_elements)
     state["snapshot"] = snapshot
+    log(f"🧾 State snapshot in {state['extraction']['snapshot_ms']:.0f} ms"
+        + (f" - modal open: '{snapshot['active_modal_title']}'" if snapshot["active_modal"] else ""))
+
+    # Persist/refresh the authenticated session once we're past any login page
+    track_session(page, snapshot["variables"]["is_logged_in"])
+
+    try:
+        update_nav_graph(state, page.url, snapshot, visible_elements)
+    except Exception as e:
+        log(f"⚠️ Navigation graph update failed: {e}")
 
-    # Keep last elements for diff in next turn
-    state["last_visible_elements"] = visible_elements[:]
+    # Keep last elements for diff in next turn (role/name only - keeps checkpoints small)
+    state["last_visible_elements"] = [{"role": el["role"], "name": el["name"]} for el in visible_elements]
 
     return state
 
@@ -1003,16 +3125,18 @@ def infer_intent(goal: str) -> set[str]:
        
 def planner(state: AgentState) -> AgentState:
     """Analyze screenshot + structured runtime snapshot with GPT and plan next action (intent-gated)."""
-    print("🤖 Planner: Analyzing screenshot with GPT-4 Vision + state snapshot...")
+    log("🤖 Planner: Analyzing screenshot with GPT-4 Vision + state snapshot...")
     page = get_page()
     
     if state.get("goal_text_entered", False):
-        print("✅ Goal already complete! Terminating.")
+        log("✅ Goal already complete! Terminating.")
         state["role"] = ""
         state["name_pattern"] = ""
         return state
     
     visible_elements = state.get("visible_elements", [])
+    state["element_id"] = ""
+    state["plan_queue"] = []
     
     # PRE-CHECK: Is the goal already achieved based on visible elements?
     # E.g., "invite user@email.com" and user@email.com is already visible in the MEMBER list
@@ -1042,24 +3166,48 @@ def planner(state: AgentState) -> AgentState:
                 
                 for email in emails_in_goal:
                     if email.lower() in member_elements_text:
-                        print(f"🎯 GOAL ALREADY ACHIEVED: '{email}' is already in the member list!")
-                        print(f"   → No action needed, marking complete.")
+                        log(f"🎯 GOAL ALREADY ACHIEVED: '{email}' is already in the member list!")
+                        log(f"   → No action needed, marking complete.")
                         state["goal_text_entered"] = True
                         state["role"] = ""
                         state["name_pattern"] = ""
                         return state
-    img_base64 = state.get("img_base64", "")
+
+    # Known route: follow the navigation graph toward the goal's state without a model call
+    nav_node = state.get("nav_node", "")
+    skip_route = state.get("nav_skip_route", False)
+    state["nav_skip_route"] = False
+    if skip_route:
+        log("🗺️  Model left the known route last step - not re-routing this step")
+    elif NAV_ROUTING and nav_node and goal:
+        known = nav_graph(page.url).route(nav_node, goal)
+        if known:
+            target, path = known
+            next_node, edge = path[0]
+            action = edge["action"]
+            log(f"🗺️  Known route to '{target}' ({len(path)} step(s)) - "
+                f"{action['action_type']} [{action['role']}] /{action['name_pattern']}/ without a model call")
+            state.update(action_type=action["action_type"], role=action["role"],
+                         name_pattern=action["name_pattern"], action_text=action.get("action_text", ""))
+            state["nav_pending"] = {"from": nav_node, "action": action, "expect": next_node}
+            state["nav_routed"] = target
+            return state
+    if state.get("nav_routed") and not skip_route:
+        # The model is deciding although we were on a route (it broke) - let its choice play out
+        state["nav_skip_route"] = True
+    state["nav_routed"] = ""
+    
+    img_base64 = screenshot_b64(state)
     snapshot = state.get("snapshot", {})  # <<— NEW
     
     if not img_base64:
-        print("❌ No screenshot available!")
+        log("❌ No screenshot available!")
         state["role"] = ""
         state["name_pattern"] = ""
         return state
     
-    failed_actions = state.get("failed_actions", [])
-    actions_performed = state.get("actions_performed", [])
-    client = OpenAI()
+    failed_actions = state["failed_actions"]
+    actions_performed = state["actions_performed"]
 
     # ---- RAG: Retrieve relevant knowledge ----
     app_hint = detect_app(page.url or state.get("website_url", ""))
@@ -1086,35 +3234,68 @@ def planner(state: AgentState) -> AgentState:
 
     intent = infer_intent(state.get("goal", ""))
 
+    # Explore mode: target not on screen - open the likely menus in parallel pages once per URL
+    menu_map = state.get("menu_map") or {}
+    if EXPLORE_MODE and menu_map.get("url") != page.url and not goal_terms_visible(goal, visible_elements):
+        explored = state.setdefault("hover_explored", [])
+        candidates = menu_candidates(visible_elements, explored)
+        if candidates:
+            log(f"🧭 Exploring {len(candidates)} menus in parallel: {', '.join(c['name'] for c in candidates)}")
+            explore_started = time.perf_counter()
+            try:
+                menus = explore_menus(page, candidates, visible_elements)
+            except Exception as e:
+                log(f"⚠️ Menu exploration failed: {e}")
+                menus = []
+            explored.extend(f"{c['role']}:{c['name']}" for c in candidates)
+            menu_map = {"url": page.url, "menus": menus,
+                        "ms": round((time.perf_counter() - explore_started) * 1000, 1)}
+            state["menu_map"] = menu_map
+            found = [m["trigger"]["name"] for m in menus if goal_terms_visible(goal, m["revealed"])]
+            log(f"   ✓ Harvested {sum(len(m['revealed']) for m in menus)} hidden elements from {len(menus)} menus"
+                f" in {menu_map['ms']:.0f} ms" + (f" - goal terms behind: {', '.join(found)}" if found else ""))
+    menus_context = ""
+    if menu_map.get("url") == page.url and menu_map.get("menus"):
+        menus_context = ("\n\n🧭 HIDDEN MENUS (explored in parallel; open the trigger first, then pick the item):\n"
+                         + menu_map_context(menu_map))
+
     # Build terser string contexts (still kept for readability alongside snapshot)
-    elements_list = [f"{i+1}. [{el['role']}] {el['name']}" for i, el in enumerate(visible_elements[:25])]
+    ranked_elements = snapshot.get("visible_elements") or visible_elements
+    elements_list = [
+        (f"#{el['mark']} " if "mark" in el else f"{i+1}. ") + f"[{el['role']}] {el['name']}"
+        + (f" @{el['region']}" if el.get("region") else "")
+        + (f" (in frame {el['frame']})" if el.get("frame") else "")
+        for i, el in enumerate(ranked_elements[:25])
+    ]
     elements_context = "\n".join(elements_list) if elements_list else "No elements found."
-    failed_context = "\n⚠️ FAILED:\n" + "\n".join(failed_actions[-10:]) if failed_actions else ""
-    actions_context = "\n✓ DONE:\n" + "\n".join(actions_performed[-10:]) if actions_performed else ""
+    failed_context = "\n⚠️ FAILED:\n" + "\n".join(failed_actions.render(10)) if failed_actions else ""
+    dead = DEAD_LOCATORS.dead_on_page(page.url, state.get("nav_node", ""))
+    if dead:
+        failed_context += "\n☠️ NEVER RESOLVE ON THIS PAGE (past runs) - do not propose:\n" + \
+            "\n".join(f"[{r}] /{p}/" for r, p in dead[:15])
+    actions_context = "\n✓ DONE:\n" + "\n".join(actions_performed.render(10)) if actions_performed else ""
     
     recent_action_summary = ""
-    if actions_performed:
-        last_action = actions_performed[-1]
-        if "type:" in last_action:
-            parts = last_action.split(":")
-            if len(parts) >= 4:
-                typed_text = parts[3]
-                recent_action_summary = (
-                    f"\n\n🎯 JUST COMPLETED: Typed '{typed_text}' into a textbox."
-                    "\n   → Carefully check if this completes the user's goal before taking another action!"
-                )
-        elif "click:" in last_action and any(word in last_action for word in ["new", "add", "create"]):
+    last_action = actions_performed.last
+    if last_action and last_action.kind == "action":
+        if last_action.action_type == "type":
+            recent_action_summary = (
+                f"\n\n🎯 JUST COMPLETED: Typed '{last_action.text}' into a textbox."
+                "\n   → Carefully check if this completes the user's goal before taking another action!"
+            )
+        elif last_action.action_type == "click" and any(word in last_action.render() for word in ["new", "add", "create"]):
             recent_action_summary = (
                 "\n\n🎯 JUST COMPLETED: Clicked a creation button."
                 "\n   → Look for newly available textboxes to type into (don't click creation buttons again!)"
             )
-    just_recovered = any("recovery:escape" in act for act in actions_performed[-2:]) if actions_performed else False
+    just_recovered = actions_performed.recently_recovered(2)
     if just_recovered:
         actions_context += (
             "\n\n⚠️ JUST RECOVERED: Pressed Escape to close wrong modal/menu. "
             "Try HOVER to explore or click a DIFFERENT element!"
         )
     actions_context += recent_action_summary
+    actions_context += menus_context
 
     # 🔑 NEW: include compact JSON snapshot (cap length defensively)
     try:
@@ -1138,6 +3319,8 @@ Decide the *next concrete interaction* using ONLY the provided structured state
 
 **State-grounding rules:**
 - Treat the JSON snapshot as ground truth. Do not assume hidden elements exist.
+- Each element's "region" (top-left, top-right, sidebar, content, modal) and "bbox" [x, y, w, h] give its on-screen position; use them with the layout hints instead of guessing from the image.
+- Elements with a "frame" live inside an embedded iframe (apply widgets, sign-in popups); target them the same way, the executor finds the frame.
 - Prefer actions that operate on currently visible elements in the snapshot.
 - Never open profile/workspace menus or Settings unless the goal explicitly mentions settings/preferences/account/billing/theme/appearance/notifications.
 
@@ -1165,10 +3348,28 @@ You will output ONE JSON object only:
 Avoid inline flags like (?i).
 
 Return ONLY the JSON object.
+"""
+    if PLAN_AHEAD:
+        system_message += f"""
+### PLAN AHEAD
+When the next few steps are already clear from this screen (a short form, a menu path), you may add:
+  "expect": postcondition right after this action,
+  "then": [up to {PLAN_MAX_STEPS - 1} follow-up click/type/hover actions in order, each {{"action_type", "role", "name_pattern", "action_text", "expect"}}]
+An "expect" object may hold "modal": true/false (a dialog/menu is open after the action), "url_contains": "...",
+and "role" + "name_pattern" of an element that must then be visible. Omit anything you aren't sure of.
+Follow-ups run without a new screenshot while their postconditions hold, so only queue steps whose targets you can already predict.
+"""
+    marks = state.get("marks") or {}
+    if marks:
+        system_message += """
+### SET-OF-MARKS
+The screenshot shows numbered magenta boxes; the same number is each element's "mark" in the snapshot.
+For click/type/hover, add "mark": <number of the target box> to your JSON. role/name_pattern are then optional.
 """
 
     try:
-        response = client.chat.completions.create(
+        response = chat_completion(
+            "planner",
             model="gpt-4o",
             response_format={"type": "json_object"},
             messages=[
@@ -1195,14 +3396,16 @@ Visible elements (readable list):
 
 Return JSON only:"""
                         },
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{state['img_base64']}"}}
+                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_base64}"}}
                     ]
                 }
             ],
             max_tokens=1000
         )
     except Exception as api_error:
-        print(f"❌ GPT-4 API Error: {api_error}")
+        log(f"❌ GPT-4 API Error: {api_error}")
+        if isinstance(api_error, BudgetExceededError):
+            state["stop_reason"] = str(api_error)
         state["role"] = ""
         state["name_pattern"] = ""
         return state
@@ -1213,15 +3416,15 @@ Return JSON only:"""
     refusal = getattr(message, 'refusal', None)
     
     if refusal:
-        print(f"⚠️  GPT-4 Vision REFUSED: {refusal}")
-        print("💡 Using smart fallback based on goal and visible elements...")
+        log(f"⚠️  GPT-4 Vision REFUSED: {refusal}")
+        log("💡 Using smart fallback based on goal and visible elements...")
         
         goal_lower = (state.get("goal") or "").lower()
         login_el = next((el for el in visible_elements if "log" in el.get("name", "").lower() and "in" in el.get("name", "").lower()), None)
         if not login_el:
             login_el = next((el for el in visible_elements if "sign" in el.get("name", "").lower() and "in" in el.get("name", "").lower()), None)
         if login_el:
-            print(f"🎯 Fallback: Login available - clicking to access workspace")
+            log(f"🎯 Fallback: Login available - clicking to access workspace")
             state["action_type"] = "click"
             state["role"] = login_el['role']
             state["name_pattern"] = "log.*in|sign.*in"
@@ -1269,20 +3472,20 @@ Return JSON only:"""
             for candidate in hover_candidates:
                 hover_key = f"{candidate['role']}:{candidate['name']}"
                 if hover_key not in hover_explored:
-                    print(f"🔍 Fallback: UI is sparse - hovering to explore")
+                    log(f"🔍 Fallback: UI is sparse - hovering to explore")
                     state["action_type"] = "hover"
                     state["role"] = candidate['role']
                     state["name_pattern"] = re.escape(candidate['name'])
                     state["action_text"] = ""
                     return state
         
-        print("❌ No fallback action available")
+        log("❌ No fallback action available")
         state["role"] = ""
         state["name_pattern"] = ""
         return state
     
     if not raw_content:
-        print("⚠️  GPT-4 Vision returned empty response (no refusal, just empty)")
+        log("⚠️  GPT-4 Vision returned empty response (no refusal, just empty)")
         state["role"] = ""
         state["name_pattern"] = ""
         return state
@@ -1294,6 +3497,20 @@ Return JSON only:"""
         name_pattern = analysis_json.get("name_pattern", "")
         action_text = analysis_json.get("action_text", "")
         
+        # Set-of-marks: bind the answer to the marked element (exact name, no regex guessing)
+        marked = None
+        mark = str(analysis_json.get("mark") or "").lstrip("#")
+        if mark and mark in marks:
+            marked = next((el for el in visible_elements if el.get("id") == marks[mark]), None)
+        if marked is not None:
+            role = marked["role"]
+            name_pattern = "^" + re.escape(marked["name"].removeprefix("🆕 ")) + "$"
+            if action_type not in ["click", "type", "hover"]:
+                action_type = "click"
+        elif mark:
+            log(f"⚠️  Planner picked unknown mark #{mark} - falling back to role/name_pattern")
+        proposed = (action_type, role, name_pattern)
+        
         goal_lower = (state["goal"] or "").lower()
 
         # OVERRIDE 0 (minimal): LOGIN if on marketing and login visible
@@ -1309,7 +3526,7 @@ Return JSON only:"""
             )
             
             if login_el:
-                print("🔑 On marketing page - clicking login to access workspace")
+                log("🔑 On marketing page - clicking login to access workspace")
                 action_type = "click"
                 role = login_el['role']
                 name_pattern = "log.*in|sign.*in"
@@ -1331,8 +3548,8 @@ Return JSON only:"""
                             text_to_type = re.sub(r'^(status|priority|assignee|project)\s+(being|is|equals?|=)\s+', '', text_to_type, flags=re.IGNORECASE)
                             break
                 if text_to_type:
-                    print(f"⚠️  GPT chose 'click' on search/filter box but goal is to type - overriding to TYPE!")
-                    print(f"  → Will type: '{text_to_type}'")
+                    log(f"⚠️  GPT chose 'click' on search/filter box but goal is to type - overriding to TYPE!")
+                    log(f"  → Will type: '{text_to_type}'")
                     action_type = "type"
                     action_text = text_to_type
 
@@ -1345,7 +3562,7 @@ Return JSON only:"""
                 None
             )
             if login_el and is_marketing:
-                print("⚠️  noop on marketing page with login visible → clicking login")
+                log("⚠️  noop on marketing page with login visible → clicking login")
                 action_type = "click"
                 role = login_el['role']
                 name_pattern = "log.*in|sign.*in"
@@ -1364,37 +3581,52 @@ Return JSON only:"""
             if not textbox_found:
                 any_textbox = next((el for el in visible_elements if el.get("role") == "textbox"), None)
                 if any_textbox:
-                    print(f"⚠️  Pattern '{name_pattern}' won't match any textbox → using '.*'")
+                    log(f"⚠️  Pattern '{name_pattern}' won't match any textbox → using '.*'")
                     name_pattern = ".*"
 
         # (Removed complex OVERRIDE logic - let RAG + GPT handle workflows naturally)
         
         # SAFETY CHECK: If GPT returned empty role/pattern for actions that need them, convert to noop
         if action_type in ["click", "type", "hover"] and (not role or not name_pattern):
-            print(f"⚠️  GPT returned {action_type} with empty role/pattern - converting to noop")
+            log(f"⚠️  GPT returned {action_type} with empty role/pattern - converting to noop")
             action_type = "noop"
             role = ""
             name_pattern = ""
             action_text = ""
         
-        print("\n" + "="*70)
-        print("🤖 GPT-4 Vision Decision:")
-        print("="*70)
-        print(f"Action Type: {action_type}")
-        print(f"Role: {role}")
-        print(f"Name Pattern: {name_pattern}")
+        log("\n" + "="*70)
+        log("🤖 GPT-4 Vision Decision:")
+        log("="*70)
+        log(f"Action Type: {action_type}")
+        log(f"Role: {role}")
+        log(f"Name Pattern: {name_pattern}")
+        # Overrides may have retargeted the action; only keep the binding if they didn't
+        if marked is not None and role == marked["role"] and name_pattern == "^" + re.escape(marked["name"].removeprefix("🆕 ")) + "$":
+            state["element_id"] = marked["id"]
+            log(f"Mark: #{mark} → {marked['id']}")
         if action_type == "type":
-            print(f"Text to Type: {action_text}")
-        print("="*70 + "\n")
+            log(f"Text to Type: {action_text}")
+        log("="*70 + "\n")
         
         state["action_type"] = action_type
         state["role"] = role
         state["name_pattern"] = name_pattern
         state["action_text"] = action_text
+        if action_type in ("click", "hover"):
+            state["nav_pending"] = {"from": state.get("nav_node", ""), "expect": "", "action": {
+                "action_type": action_type, "role": role, "name_pattern": name_pattern, "action_text": action_text}}
+        # Plan-ahead: queue the follow-ups unless an override replaced the model's first action
+        if PLAN_AHEAD and (action_type, role, name_pattern) == proposed:
+            state["plan_queue"] = parse_plan(analysis_json.get("then"))
+            expect = analysis_json.get("expect")
+            state["plan_expect"] = expect if isinstance(expect, dict) else {}
+            state["plan_context"] = {"url": url_pattern(page.url), "modal": bool(snapshot.get("active_modal"))}
+            if state["plan_queue"]:
+                log(f"📋 Plan-ahead: {len(state['plan_queue'])} follow-up step(s) queued")
         
     except json.JSONDecodeError as e:
-        print(f"⚠️  Failed to parse JSON: {e}")
-        print(f"Raw response: {raw_content}")
+        log(f"⚠️  Failed to parse JSON: {e}")
+        log(f"Raw response: {raw_content}")
         state["action_type"] = "noop"
         state["role"] = ""
         state["name_pattern"] = ""
@@ -1403,10 +3635,10 @@ Return JSON only:"""
     return state
 
 
-def executor(state: AgentState) -> AgentState:
+def _execute_action(state: AgentState) -> AgentState:
     """Execute the action using role-based locators"""
     global i
-    print("🤖 Executor: Executing the action...")
+    log("🤖 Executor: Executing the action...")
     page = get_page()
     i+=1
     global screenshots_dir
@@ -1419,85 +3651,129 @@ def executor(state: AgentState) -> AgentState:
     name_pattern = state.get("name_pattern", "").strip()
     action_type = state.get("action_type", "click").lower()
     action_text = state.get("action_text", "")
+    state["locator"] = {}
+    state["typing"] = {}
+    state["step_frame"] = {}
     
     # Keyboard and noop actions don't need role/pattern
     if action_type not in ["keyboard", "noop"] and (not role or not name_pattern):
-        print("⚠️  No role/pattern provided, skipping action")
+        log("⚠️  No role/pattern provided, skipping action")
         return state
     
     # OPTIMIZATION 1: Check if this exact action was already done
-    action_key = f"{action_type}:{role}:{name_pattern}:{action_text}"
-    actions_performed = state.get("actions_performed", [])
-    failed_actions = state.get("failed_actions", [])
+    action_record = ActionRecord(action_type, role, name_pattern, action_text)
+    action_key = action_record.render()
+    actions_performed = state["actions_performed"]
+    failed_actions = state["failed_actions"]
     current_url = page.url
     last_url = state.get("last_url", "")
     
+    # Cycle detection: O(1) lookup of (URL, visible elements, planned action) in the fingerprint table.
+    # Catches A→B→A→B cycles of any length, even across URLs. Skipped right after a recovery so the
+    # "retry after recovery" path below still gets its one attempt; the repeat count is kept.
+    fingerprint = state_fingerprint(current_url, state.get("visible_elements", []), action_record)
+    fingerprints = state.setdefault("state_fingerprints", {})
+    if fingerprint in fingerprints and not actions_performed.recently_recovered(2):
+        seen_at, repeats = fingerprints[fingerprint]
+        cycle = i - seen_at
+        fingerprints[fingerprint] = [i, repeats + 1]
+        log(f"🔁 REPEATED STATE: same page, elements and action as step {seen_at} (cycle of {cycle} step(s))")
+        if state.get("goal_text_entered", False) or repeats >= 1 or actions_performed.recoveries >= 3:
+            saved = steps_remaining(i)
+            state["stop_reason"] = f"loop detected (cycle of {cycle} step(s)); stopped early, saving ~{saved} step(s)"
+            log(f"   ⏹️  Escape didn't break the cycle - TERMINATING, saved ~{saved} step(s)")
+            state["role"] = ""
+            state["name_pattern"] = ""
+            return state
+        log("   🔄 Breaking the cycle - pressing Escape to close modal/menu...")
+        try:
+            page.keyboard.press("Escape")
+            page.wait_for_timeout(800)
+            actions_performed.append(ActionRecord(action_type, role, name_pattern, action_text, kind="recovery", note="loop"))
+            return state
+        except Exception as e:
+            log(f"   ⚠️  Escape failed: {e}")
+            state["role"] = ""
+            state["name_pattern"] = ""
+            return state
+    fingerprints[fingerprint] = [i, fingerprints.get(fingerprint, [i, 0])[1]]
+    
     # Loop detection: same action already performed
-    if action_key in actions_performed:
-        print(f"⚠️  LOOP DETECTED: Already performed {action_key}")
+    if action_record in actions_performed:
+        log(f"⚠️  LOOP DETECTED: Already performed {action_key}")
         
         # Check if goal was already achieved (e.g., toggle already in desired state)
-        already_complete = any(":already_complete" in act for act in actions_performed)
+        already_complete = actions_performed.goal_complete_seen
         goal_achieved = state.get("goal_text_entered", False)
         
         if already_complete or goal_achieved:
-            print("   ✅ Goal already achieved - TERMINATING (not pressing Escape)")
+            log("   ✅ Goal already achieved - TERMINATING (not pressing Escape)")
             state["role"] = ""
             state["name_pattern"] = ""
             return state
         
         # Count how many recovery attempts we've done
-        recovery_count = sum(1 for act in actions_performed if act.startswith("recovery:escape"))
+        recovery_count = actions_performed.recoveries
         
         if recovery_count >= 3:
-            print(f"   ⚠️  Too many recovery attempts ({recovery_count}) - TERMINATING")
-            print("   Agent may be stuck or goal already achieved without detection")
+            log(f"   ⚠️  Too many recovery attempts ({recovery_count}) - TERMINATING")
+            log("   Agent may be stuck or goal already achieved without detection")
+            state["stop_reason"] = f"stuck after {recovery_count} recoveries; stopped early, saving ~{steps_remaining(i)} step(s)"
             state["role"] = ""
             state["name_pattern"] = ""
             return state
         
         # Recovery strategy: Close wrong modal/menu and let GPT try again
-        print(f"   🔄 Recovery attempt {recovery_count + 1}/3 - pressing Escape to close modal/menu...")
+        log(f"   🔄 Recovery attempt {recovery_count + 1}/3 - pressing Escape to close modal/menu...")
         try:
             page.keyboard.press("Escape")
             page.wait_for_timeout(800)
-            print("   ✓ Pressed Escape - modal/menu closed, will explore elsewhere")
+            log("   ✓ Pressed Escape - modal/menu closed, will explore elsewhere")
             
             # Mark this as a recovery attempt, don't stop execution
             # Let the next cycle explore with hover or try a different element
-            state.setdefault("actions_performed", []).append(f"recovery:escape:from:{action_key}")
+            actions_performed.append(ActionRecord(action_type, role, name_pattern, action_text, kind="recovery", note="loop"))
             return state
         except Exception as e:
-            print(f"   ⚠️  Escape failed: {e}")
+            log(f"   ⚠️  Escape failed: {e}")
             state["role"] = ""
             state["name_pattern"] = ""
             return state
     
     # Skip known failed actions (but allow retries after recovery)
-    if action_key in failed_actions:
+    if action_record in failed_actions:
         # Check if we just did a recovery - if so, allow retry
-        recent_recovery = any("recovery:escape" in act for act in actions_performed[-2:])
+        recent_recovery = actions_performed.recently_recovered(2)
         if not recent_recovery:
-            print(f"❌ SKIP: Action already failed {action_key}")
+            log(f"❌ SKIP: Action already failed {action_key}")
             state["role"] = ""
             state["name_pattern"] = ""
             return state
         else:
-            print(f"🔄 Retrying after recovery: {action_key}")
+            log(f"🔄 Retrying after recovery: {action_key}")
+    
+    # Known-dead locator on this page (from earlier runs): reject without the 5 s wait, let the planner re-plan
+    if action_type in ("click", "type", "hover") and not state.get("element_id") and \
+            DEAD_LOCATORS.is_dead(current_url, state.get("nav_node", ""), role, name_pattern):
+        # Not added to failed_actions: the planner already sees the dead list, and a repeated
+        # proposal of a failed action would end the run instead of re-planning
+        log(f"☠️  SKIP: [{role}] /{name_pattern}/ never resolved in this UI state in earlier runs")
+        state["locator"] = {"mode": "dead", "hit": False, "resolve_ms": 0.0}  # own row in the locator summary
+        return state
     
     # OPTIMIZATION 2: Detect when stuck (URL not changing after multiple actions)
     if len(actions_performed) >= 3 and current_url == last_url:
-        recent_actions = actions_performed[-3:]
+        recent_actions = actions_performed.recent(3)
         # Ignore recovery actions in this check
-        non_recovery_actions = [a for a in recent_actions if not a.startswith("recovery:")]
+        non_recovery_actions = [a.key for a in recent_actions if a.kind != "recovery"]
         if len(non_recovery_actions) >= 2 and len(set(non_recovery_actions)) == 1:
-            print(f"⚠️  STUCK: Same action repeated without progress")
-            print(f"   🔄 Recovering: Pressing Escape and trying hover exploration...")
+            log(f"⚠️  STUCK: Same action repeated without progress")
+            log(f"   🔄 Recovering: Pressing Escape and trying hover exploration...")
             try:
                 page.keyboard.press("Escape")
                 page.wait_for_timeout(800)
-                print("   ✓ Escape pressed - will explore with hover next")
-                state.setdefault("actions_performed", []).append("recovery:escape:stuck")
+                log("   ✓ Escape pressed - will explore with hover next")
+                actions_performed.append(ActionRecord("keyboard", text="Escape", kind="recovery", note="stuck"))
                 return state
             except:
                 state["role"] = ""
@@ -1510,18 +3786,18 @@ def executor(state: AgentState) -> AgentState:
         # Handle keyboard actions first (don't need to locate element)
         if action_type == "keyboard":
             # Keyboard action: press a key
-            print(f"⌨️  Pressing key: {action_text}")
+            log(f"⌨️  Pressing key: {action_text}")
             page.keyboard.press(action_text)
             page.wait_for_timeout(1000)
-            print(f"✓ Key pressed successfully")
+            log(f"✓ Key pressed successfully")
             
             # Track successful action
-            state.setdefault("actions_performed", []).append(action_key)
+            actions_performed.append(action_record)
         
         elif action_type == "scroll":
             # Scroll action: scroll the page to reveal more content
             direction = action_text.lower() if action_text else "down"
-            print(f"📜 Scrolling {direction} to reveal more content...")
+            log(f"📜 Scrolling {direction} to reveal more content...")
             
             if direction == "down":
                 # Scroll down one page
@@ -1534,20 +3810,24 @@ def executor(state: AgentState) -> AgentState:
                 page.keyboard.press("PageDown")
             
             page.wait_for_timeout(800)  # Wait for content to load
-            print(f"✓ Scrolled {direction} successfully")
+            log(f"✓ Scrolled {direction} successfully")
             
             # Track successful action
-            state.setdefault("actions_performed", []).append(action_key)
+            actions_performed.append(action_record)
         
         elif action_type == "hover":
             # Hover action: hover over element to reveal hidden UI
-            print(f"👆 Hovering over [{role}] matching pattern: {name_pattern}")
+            log(f"👆 Hovering over [{role}] matching pattern: {name_pattern}")
             
             # Locate element
-            loc = page.get_by_role(role, name=re.compile(name_pattern, re.IGNORECASE)).first
+            loc = target_locator(page, state, role, name_pattern)
             
             try:
+                locate_started = time.perf_counter()
                 loc.wait_for(state="visible", timeout=5000)
+                state["locator"].update(hit=True, resolve_ms=(time.perf_counter() - locate_started) * 1000)
+                if state["locator"]["mode"] == "regex":
+                    DEAD_LOCATORS.record_success(current_url, state.get("nav_node", ""), role, name_pattern)
                 
                 # Position cursor and add visual marker before hovering
                 try:
@@ -1582,47 +3862,57 @@ def executor(state: AgentState) -> AgentState:
                         
                         page.mouse.move(center_x, center_y)
                         page.wait_for_timeout(400)
-                        print(f"🎯 Hover cursor at ({int(center_x)}, {int(center_y)})")
+                        log(f"🎯 Hover cursor at ({int(center_x)}, {int(center_y)})")
                         
                         # Take screenshot with cursor marker
-                        page.screenshot(path=str(step_screenshot))
-                        print(f"📸 Step {i} screenshot (hover marker): {step_screenshot}")
+                        state["step_frame"] = {"path": str(step_screenshot),
+                                               "sha256": save_screenshot(page, step_screenshot, i)}
+                        log(f"📸 Step {i} screenshot (hover marker): {step_screenshot}")
                         
                         # Remove marker
                         page.evaluate("document.getElementById('cursor-marker-temp')?.remove()")
                 except:
                     pass
                 
-                print(f"⏳ Hovering to reveal hidden elements...")
+                log(f"⏳ Hovering to reveal hidden elements...")
                 loc.hover(timeout=3000)
                 page.wait_for_timeout(1500)  # Wait for any animations or dropdowns to appear
-                print(f"✓ Hover successful - checking for new elements...")
+                log(f"✓ Hover successful - checking for new elements...")
                 
                 # Track that we hovered over this element
                 hover_key = f"{role}:{name_pattern}"
                 state.setdefault("hover_explored", []).append(hover_key)
-                state.setdefault("actions_performed", []).append(action_key)
+                actions_performed.append(action_record)
                 
                 # Note: inspector will re-scan after this and report any new elements
                 
             except Exception as hover_err:
-                print(f"❌ Hover failed: {hover_err}")
-                state.setdefault("failed_actions", []).append(action_key)
+                if "hit" not in state["locator"] and state["locator"]["mode"] == "regex":
+                    DEAD_LOCATORS.record_failure(current_url, state.get("nav_node", ""), role, name_pattern)
+                state["locator"].setdefault("hit", False)
+                state["locator"].setdefault("resolve_ms", (time.perf_counter() - locate_started) * 1000)
+                log(f"❌ Hover failed: {hover_err}")
+                failed_actions.append(action_record)
         
         else:
             # For click/type actions, we need to locate the element first
             # Wait a bit for any modals/animations to settle
             page.wait_for_timeout(800)
             
-            print(f"🔍 Looking for [{role}] matching pattern: {name_pattern}")
+            log(f"🔍 Looking for [{role}] matching pattern: {name_pattern}")
             
-            # Use Playwright's role-based locator with regex (case-insensitive)
-            loc = page.get_by_role(role, name=re.compile(name_pattern, re.IGNORECASE)).first
+            # Bound set-of-marks element if the planner chose one, else role-based locator with regex
+            loc = target_locator(page, state, role, name_pattern)
+            scope = target_scope(page, state, role, name_pattern)  # page or the iframe holding the target
             
             # Wait for element to be visible
-            print(f"⏳ Waiting for element to be visible...")
+            log(f"⏳ Waiting for element to be visible...")
+            locate_started = time.perf_counter()
             try:
                 loc.wait_for(state="visible", timeout=5000)
+                state["locator"].update(hit=True, resolve_ms=(time.perf_counter() - locate_started) * 1000)
+                if state["locator"]["mode"] == "regex":
+                    DEAD_LOCATORS.record_success(current_url, state.get("nav_node", ""), role, name_pattern)
                 
                 # Get element position and add visual cursor marker
                 try:
@@ -1659,13 +3949,14 @@ def executor(state: AgentState) -> AgentState:
                         # Move actual cursor too
                         page.mouse.move(center_x, center_y)
                         page.wait_for_timeout(400)  # Let animation show
-                        print(f"🎯 Cursor marker at ({int(center_x)}, {int(center_y)})")
+                        log(f"🎯 Cursor marker at ({int(center_x)}, {int(center_y)})")
                 except:
                     pass
                 
                 # NOW take screenshot with visual cursor marker
-                page.screenshot(path=str(step_screenshot))
-                print(f"📸 Step {i} screenshot (with cursor marker): {step_screenshot}")
+                state["step_frame"] = {"path": str(step_screenshot),
+                                       "sha256": save_screenshot(page, step_screenshot, i)}
+                log(f"📸 Step {i} screenshot (with cursor marker): {step_screenshot}")
                 
                 # Remove cursor marker before clicking
                 try:
@@ -1673,31 +3964,32 @@ def executor(state: AgentState) -> AgentState:
                 except:
                     pass
             except Exception as wait_err:
+                state["locator"].update(hit=False, resolve_ms=(time.perf_counter() - locate_started) * 1000)
                 # Element not found - ask GPT Vision for better regex
-                print(f"⚠️  Element not found: {wait_err}")
-                print("🤔 Asking GPT Vision to analyze screenshot for better pattern...")
+                log(f"⚠️  Element not found: {wait_err}")
+                log("🤔 Asking GPT Vision to analyze screenshot for better pattern...")
                 
                 better_pattern = ask_gpt_for_better_regex(
                     goal=state["goal"],
                     failed_pattern=name_pattern,
-                    img_base64=state["img_base64"],
+                    img_base64=screenshot_b64(state),
                     visible_elements=state.get("visible_elements", [])
                 )
                 
                 # Try with better pattern if GPT suggested one
                 element_found_with_pattern = False
                 if better_pattern and better_pattern != name_pattern:
-                    print(f"🔄 Retrying with new pattern: {better_pattern}")
+                    log(f"🔄 Retrying with new pattern: {better_pattern}")
                     try:
-                        loc = page.get_by_role(role, name=re.compile(better_pattern, re.IGNORECASE)).first
+                        loc = scope.get_by_role(role, name=re.compile(better_pattern, re.IGNORECASE)).first
                         loc.wait_for(state="visible", timeout=3000)
                         element_found_with_pattern = True
                     except:
-                        print(f"⚠️  Still not found with new pattern")
+                        log(f"⚠️  Still not found with new pattern")
                 
                 # If pattern didn't work, try alternative roles
                 if not element_found_with_pattern:
-                    print(f"⚠️  Trying alternative roles...")
+                    log(f"⚠️  Trying alternative roles...")
                     
                     role_alternatives = {
                         "menuitem": ["option", "menuitemradio", "menuitemcheckbox", "combobox", "link", "button"],
@@ -1715,10 +4007,10 @@ def executor(state: AgentState) -> AgentState:
                     
                     for alt_role in alternatives:
                         try:
-                            print(f"🔄 Trying alternative role: {alt_role}")
-                            alt_loc = page.get_by_role(alt_role, name=re.compile(name_pattern, re.IGNORECASE)).first
+                            log(f"🔄 Trying alternative role: {alt_role}")
+                            alt_loc = scope.get_by_role(alt_role, name=re.compile(name_pattern, re.IGNORECASE)).first
                             alt_loc.wait_for(state="visible", timeout=2000)
-                            print(f"✓ Found with role '{alt_role}'!")
+                            log(f"✓ Found with role '{alt_role}'!")
                             loc = alt_loc
                             role = alt_role  # Update role for later use
                             element_found = True
@@ -1728,7 +4020,7 @@ def executor(state: AgentState) -> AgentState:
                     
                     if not element_found:
                         # Final fallback: Try CSS selectors for known patterns
-                        print(f"⚠️  All role alternatives failed - trying CSS selector fallback...")
+                        log(f"⚠️  All role alternatives failed - trying CSS selector fallback...")
                         
                         # For action buttons, try common CSS patterns
                         if "apply" in name_pattern.lower():
@@ -1742,10 +4034,10 @@ def executor(state: AgentState) -> AgentState:
                             
                             for css_sel in css_selectors:
                                 try:
-                                    print(f"  🔍 Trying CSS: {css_sel}")
-                                    css_loc = page.locator(css_sel).first
+                                    log(f"  🔍 Trying CSS: {css_sel}")
+                                    css_loc = scope.locator(css_sel).first
                                     css_loc.wait_for(state="visible", timeout=2000)
-                                    print(f"  ✓ Found with CSS selector!")
+                                    log(f"  ✓ Found with CSS selector!")
                                     loc = css_loc
                                     element_found = True
                                     break
@@ -1753,11 +4045,14 @@ def executor(state: AgentState) -> AgentState:
                                     pass
                         
                         if not element_found:
+                            # Only now is the locator dead: the better regex and every fallback missed too
+                            if state["locator"]["mode"] == "regex":
+                                DEAD_LOCATORS.record_failure(current_url, state.get("nav_node", ""), role, name_pattern)
                             raise wait_err  # Re-raise original error
             
             if action_type == "type":
                 # Type action: fill input field
-                print(f"📝 Typing '{action_text}' into [{role}]...")
+                log(f"📝 Typing '{action_text}' into [{role}]...")
                 
                 # FIRST: Check if there's a blocking modal - but DON'T close it if textbox is inside!
                 try:
@@ -1773,7 +4068,7 @@ def executor(state: AgentState) -> AgentState:
                                     tb_name = tb.get_attribute("aria-label") or tb.get_attribute("placeholder") or ""
                                     if re.search(name_pattern, tb_name, re.IGNORECASE):
                                         textbox_inside_modal = True
-                                        print(f"  ℹ️  Target textbox is INSIDE the modal - keeping it open")
+                                        log(f"  ℹ️  Target textbox is INSIDE the modal - keeping it open")
                                         break
                             except:
                                 pass
@@ -1782,10 +4077,10 @@ def executor(state: AgentState) -> AgentState:
                         
                         # Only close modal if textbox is NOT inside it
                         if not textbox_inside_modal:
-                            print("  ⚠️  Modal detected (not containing target) - closing it...")
+                            log("  ⚠️  Modal detected (not containing target) - closing it...")
                             page.keyboard.press("Escape")
                             page.wait_for_timeout(500)
-                            print("  ✓ Modal closed")
+                            log("  ✓ Modal closed")
                 except:
                     pass
                 
@@ -1816,37 +4111,17 @@ def executor(state: AgentState) -> AgentState:
                             document.body.appendChild(marker);
                         """)
                         page.wait_for_timeout(300)
-                        print(f"⌨️  Type cursor at ({int(center_x)}, {int(center_y)})")
+                        log(f"⌨️  Type cursor at ({int(center_x)}, {int(center_y)})")
                 except:
                     pass
                 
-                # For gridcells or cells, click first to activate
-                if role in ["cell", "gridcell"]:
-                    print("  (table cell - clicking to activate)")
-                    loc.click(timeout=3000)
-                    page.wait_for_timeout(300)
-                    # After clicking cell, type directly
-                    page.keyboard.type(action_text, delay=50)
-                else:
-                    # Check if it's a contenteditable element
-                    is_contenteditable = loc.evaluate("el => el.contentEditable === 'true'")
-                    
-                    if is_contenteditable:
-                        print("  (contenteditable element - using keyboard)")
-                        loc.click(timeout=3000, force=True)  # Force click for complex nested DOMs
-                        page.wait_for_timeout(500)  # Wait for any animations to complete
-                        page.keyboard.press("Meta+A")  # Select all
-                        page.keyboard.press("Backspace")  # Clear
-                        page.wait_for_timeout(200)  # Let DOM process the clear
-                        page.keyboard.type(action_text, delay=50)
-                    else:
-                        # Regular input/textarea
-                        print("  (regular input field)")
-                        loc.click(timeout=3000)
-                        loc.fill(action_text)
+                # Cells type key by key, contenteditable gets insertText, inputs get fill()
+                typing = enter_text(page, loc, action_text, role)
+                state["typing"] = typing
                 
                 page.wait_for_timeout(500)
-                print(f"✓ Typed '{action_text}' successfully")
+                log(f"✓ Typed '{action_text}' successfully via {typing['method']} in {typing['ms']:.0f} ms"
+                    + (f" (~{typing['saved_ms'] / 1000:.1f}s saved)" if typing["saved_ms"] else ""))
                 
                 # Auto-press Enter for search boxes, comboboxes, or if goal mentions "search"/"filter"
                 goal_lower = state.get("goal", "").lower()
@@ -1858,10 +4133,10 @@ def executor(state: AgentState) -> AgentState:
                 )
                 
                 if is_search_context:
-                    print(f"  ⌨️  Auto-pressing Enter to submit search/filter...")
+                    log(f"  ⌨️  Auto-pressing Enter to submit search/filter...")
                     page.keyboard.press("Enter")
                     page.wait_for_timeout(1000)  # Wait for results
-                    print(f"  ✓ Enter pressed - search/filter submitted!")
+                    log(f"  ✓ Enter pressed - search/filter submitted!")
                 
                 # Remove cursor marker
                 try:
@@ -1870,7 +4145,7 @@ def executor(state: AgentState) -> AgentState:
                     pass
                 
                 # Track successful action
-                state.setdefault("actions_performed", []).append(action_key)
+                actions_performed.append(action_record)
                 
                 # OPTIMIZATION 3: Check if typing this text completes the goal
                 text_matches_goal = (
@@ -1880,7 +4155,7 @@ def executor(state: AgentState) -> AgentState:
                 
                 if text_matches_goal:
                     # Use GPT to determine if goal is actually complete
-                    print(f"  🧠 Checking if typing '{action_text}' completes the goal...")
+                    log(f"  🧠 Checking if typing '{action_text}' completes the goal...")
                     
                     # Provide context about what was typed (let GPT determine if complete)
                     goal_text = state.get("goal", "")
@@ -1893,20 +4168,20 @@ def executor(state: AgentState) -> AgentState:
                     )
                     
                     if goal_check_achieved:
-                        print(f"🎯 Goal '{state.get('goal')}' achieved after typing! Marking complete.")
+                        log(f"🎯 Goal '{state.get('goal')}' achieved after typing! Marking complete.")
                         state["goal_text_entered"] = True
                     else:
-                        print(f"  ℹ️  Typed '{action_text}' but goal has additional steps - continuing...")
+                        log(f"  ℹ️  Typed '{action_text}' but goal has additional steps - continuing...")
             
             else:
                 # Click action (default)
-                print(f"🖱️  Clicking [{role}] matching '{name_pattern}'...")
+                log(f"🖱️  Clicking [{role}] matching '{name_pattern}'...")
                 
                 # Special handling for switches/toggles
                 if role == "switch":
                     # Get current state before clicking
                     aria_checked_before = loc.get_attribute("aria-checked")
-                    print(f"  🔘 Toggle state BEFORE: {aria_checked_before}")
+                    log(f"  🔘 Toggle state BEFORE: {aria_checked_before}")
                     
                     element_description = name_pattern if name_pattern else "toggle switch"
                     goal_already_met = False
@@ -1922,30 +4197,30 @@ def executor(state: AgentState) -> AgentState:
                         )
                     else:
                         # STEP 2: aria-checked is None/unclear - use GPT VISION to inspect screenshot
-                        print(f"  👁️  aria-checked is unclear, using GPT Vision to analyze screenshot...")
+                        log(f"  👁️  aria-checked is unclear, using GPT Vision to analyze screenshot...")
                         goal_already_met, visual_state = check_toggle_state_from_screenshot(
                             goal=state.get("goal", ""),
                             element_name=element_description,
-                            img_base64=state.get("img_base64", "")
+                            img_base64=screenshot_b64(state)
                         )
                     
                     # STEP 3: Decide whether to click
                     if goal_already_met:
-                        print(f"✅ Goal already achieved - but CLICKING ANYWAY for demonstration!")
+                        log(f"✅ Goal already achieved - but CLICKING ANYWAY for demonstration!")
                         # For demo purposes, we'll click to show the action
                         # Comment out the next 3 lines if you want to skip clicking when goal is met
                         # state["goal_text_entered"] = True
-                        # state.setdefault("actions_performed", []).append(action_key + ":already_complete")
+                        # actions_performed.append(ActionRecord(action_type, role, name_pattern, action_text, note="already_complete"))
                         # return state
                     
                     # STEP 4: Click the toggle (always for demo, or when goal not met)
-                    print(f"  🖱️  Clicking toggle to {'demonstrate action' if goal_already_met else 'achieve goal'}...")
+                    log(f"  🖱️  Clicking toggle to {'demonstrate action' if goal_already_met else 'achieve goal'}...")
                     loc.click(timeout=5000)
                     page.wait_for_timeout(1200)  # Wait for animation
                     
                     # STEP 5: Verify state after clicking
                     aria_checked_after = loc.get_attribute("aria-checked")
-                    print(f"  🔘 Toggle state AFTER: {aria_checked_after}")
+                    log(f"  🔘 Toggle state AFTER: {aria_checked_after}")
                     
                     # STEP 6: Check if goal is NOW achieved
                     if aria_checked_after and aria_checked_after in ["true", "false"]:
@@ -1957,25 +4232,25 @@ def executor(state: AgentState) -> AgentState:
                         )
                     else:
                         # Use vision again to verify
-                        print(f"  👁️  Verifying final state with GPT Vision...")
+                        log(f"  👁️  Verifying final state with GPT Vision...")
                         goal_now_met, visual_state_after = check_toggle_state_from_screenshot(
                             goal=state.get("goal", ""),
                             element_name=element_description,
-                            img_base64=state.get("img_base64", "")
+                            img_base64=screenshot_b64(state)
                         )
                     
                     if goal_now_met or goal_already_met:
-                        print("🎯 Toggle goal achieved! Marking complete.")
+                        log("🎯 Toggle goal achieved! Marking complete.")
                         state["goal_text_entered"] = True
                     else:
-                        print("⚠️  Clicked toggle but goal may not be achieved - continuing...")
+                        log("⚠️  Clicked toggle but goal may not be achieved - continuing...")
                 
                 elif role in ["option", "menuitem", "menuitemradio", "menuitemcheckbox"]:
                     # Dropdown option or menu item (NOT combobox - those are for typing!)
-                    print(f"  📋 Clicking dropdown/menu option...")
+                    log(f"  📋 Clicking dropdown/menu option...")
                     loc.click(timeout=5000)
                     page.wait_for_timeout(800)
-                    print(f"✓ Option selected!")
+                    log(f"✓ Option selected!")
                     
                     # Use GPT to check if this selection achieves the goal (GENERAL!)
                     element_description = name_pattern if name_pattern else "menu option"
@@ -1988,15 +4263,15 @@ def executor(state: AgentState) -> AgentState:
                     )
                     
                     if goal_achieved:
-                        print("🎯 Menu option achieves goal! Marking complete.")
+                        log("🎯 Menu option achieves goal! Marking complete.")
                         state["goal_text_entered"] = True
                 
                 elif role == "combobox":
                     # Combobox: click to focus (user should TYPE into it on next step)
-                    print(f"  📋 Clicking combobox to focus (ready for typing)...")
+                    log(f"  📋 Clicking combobox to focus (ready for typing)...")
                     loc.click(timeout=5000)
                     page.wait_for_timeout(500)
-                    print(f"✓ Combobox focused and ready for input!")
+                    log(f"✓ Combobox focused and ready for input!")
                 
                 else:
                     # Regular click (button, link, tab, etc.)
@@ -2005,21 +4280,21 @@ def executor(state: AgentState) -> AgentState:
                         loc.click(timeout=5000)
                     except:
                         # Retry with force if normal click fails
-                        print("  ⚠️  Normal click failed - retrying with force=True...")
+                        log("  ⚠️  Normal click failed - retrying with force=True...")
                         loc.click(timeout=5000, force=True)
                     
                     page.wait_for_timeout(1500)  # Wait for navigation/modal
-                    print(f"✓ Click successful! Current URL: {page.url}")
+                    log(f"✓ Click successful! Current URL: {page.url}")
                     
                     # Check if a modal opened
                     modal_visible = page.locator("[role='dialog']:visible, [role='alertdialog']:visible, [class*='modal']:visible").count() > 0
                     if modal_visible:
-                        print("  ℹ️  Modal/dialog detected after click")
+                        log("  ℹ️  Modal/dialog detected after click")
                     
                     # CHECK GOAL COMPLETION for buttons (let GPT decide if it's final)
                     # GPT will understand: "Send invite" = final, "Invite members" = just opens modal
                     if role == "button":
-                        print(f"  🧠 Checking if clicking '{name_pattern}' completes the goal...")
+                        log(f"  🧠 Checking if clicking '{name_pattern}' completes the goal...")
                         
                         goal_achieved = check_goal_achieved_by_state(
                             goal=state.get("goal", ""),
@@ -2028,102 +4303,592 @@ def executor(state: AgentState) -> AgentState:
                         )
                         
                         if goal_achieved:
-                            print(f"🎯 Goal '{state.get('goal')}' achieved after clicking button! Marking complete.")
+                            log(f"🎯 Goal '{state.get('goal')}' achieved after clicking button! Marking complete.")
                             state["goal_text_entered"] = True
                         else:
-                            print(f"  ℹ️  Clicked button but goal has additional steps - continuing...")
+                            log(f"  ℹ️  Clicked button but goal has additional steps - continuing...")
                 
                 # Track successful action
-                state.setdefault("actions_performed", []).append(action_key)
+                actions_performed.append(action_record)
             
     except Exception as e:
         error_msg = str(e)[:300]
-        print(f"❌ Action failed: {error_msg}")
+        log(f"❌ Action failed: {error_msg}")
         
         # Track failed action
-        state.setdefault("failed_actions", []).append(action_key)
-        print(f"⚠️  Added to failed actions: {action_key}")
+        failed_actions.append(action_record)
+        log(f"⚠️  Added to failed actions: {action_key}")
     
     return state
 
+# ===== Plan-ahead =====
+# With AGENT_PLAN_AHEAD the planner may return the next few actions at once ("then"), each
+# with a postcondition ("expect": modal open/closed, a URL fragment, an element that must be
+# visible). The executor loops on itself through the queue without a new screenshot or model
+# call, and hands back to the inspector as soon as a step fails, a postcondition doesn't hold,
+# or the URL / modal state changes when the plan didn't say it would.
+PLAN_AHEAD = os.getenv("AGENT_PLAN_AHEAD", "0") == "1"
+PLAN_MAX_STEPS = int(os.getenv("AGENT_PLAN_MAX_STEPS", "5"))
+PLAN_ACTIONS = {"click", "type", "hover"}  # targeted actions only: an empty role ends the graph
+VISIBLE_MODAL_SELECTOR = "[role='dialog']:visible, [role='alertdialog']:visible, [class*='modal']:visible"
+
+def parse_plan(steps) -> list[dict]:
+    """Follow-up actions from the planner's "then" list; stops at the first malformed one."""
+    plan = []
+    for step in steps if isinstance(steps, list) else []:
+        if not isinstance(step, dict):
+            break
+        action_type = str(step.get("action_type", "")).lower()
+        role, name_pattern = str(step.get("role", "")), str(step.get("name_pattern", ""))
+        if action_type not in PLAN_ACTIONS or not (role and name_pattern):
+            break
+        try:
+            re.compile(name_pattern)
+        except re.error:
+            break
+        expect = step.get("expect")
+        plan.append({"action_type": action_type, "role": role, "name_pattern": name_pattern,
+                     "action_text": str(step.get("action_text", "")),
+                     "expect": expect if isinstance(expect, dict) else {}})
+    return plan[:max(PLAN_MAX_STEPS - 1, 0)]
+
+def check_postcondition(page: Page, expect: dict, context: dict) -> str:
+    """'' if the page is where the plan expects it after a step, else why not."""
+    modal = page.locator(VISIBLE_MODAL_SELECTOR).count() > 0
+    if isinstance(expect.get("modal"), bool):
+        if expect["modal"] != modal:
+            return f"expected the modal {'open' if expect['modal'] else 'closed'}"
+    elif modal != context.get("modal"):
+        return f"modal {'opened' if modal else 'closed'} unexpectedly"
+    url_fragment = str(expect.get("url_contains") or "")
+    if url_fragment:
+        if url_fragment.lower() not in page.url.lower():
+            return f"URL doesn't contain '{url_fragment}'"
+    elif url_pattern(page.url) != context.get("url"):
+        return f"URL changed unexpectedly to {page.url}"
+    if expect.get("role") and expect.get("name_pattern"):
+        try:
+            page.get_by_role(expect["role"], name=re.compile(expect["name_pattern"], re.IGNORECASE)).first \
+                .wait_for(state="visible", timeout=1500)
+        except Exception:
+            return f"[{expect['role']}] /{expect['name_pattern']}/ not visible"
+    return ""
+
+def advance_plan(state: AgentState, page: Page, step_done: bool):
+    """After an executed step: load the next queued action (state["plan_next"]) or drop the plan."""
+    state["plan_next"] = False
+    queue = state.get("plan_queue") or []
+    if not queue:
+        return
+    if not step_done:
+        reason = "step didn't run"
+    elif state.get("goal_text_entered"):
+        reason = "goal complete"
+    else:
+        try:
+            reason = check_postcondition(page, state.get("plan_expect") or {}, state.get("plan_context") or {})
+        except Exception as e:
+            reason = f"postcondition check failed: {e}"
+    if reason:
+        log(f"↩️  Plan interrupted ({reason}) - re-inspecting; dropped {len(queue)} queued step(s)")
+        state["plan_queue"] = []
+        return
+    step = queue[0]
+    state["plan_queue"] = queue[1:]
+    state["plan_expect"] = step["expect"]
+    state["plan_context"] = {"url": url_pattern(page.url), "modal": page.locator(VISIBLE_MODAL_SELECTOR).count() > 0}
+    state.update(action_type=step["action_type"], role=step["role"], name_pattern=step["name_pattern"],
+                 action_text=step["action_text"], element_id="")
+    state["plan_next"] = True
+    log(f"⏭️  Plan step (no re-inspection, {len(queue) - 1} left): {step['action_type']} [{step['role']}] /{step['name_pattern']}/"
+        + (f" '{step['action_text']}'" if step["action_text"] else ""))
+
+def executor(state: AgentState) -> AgentState:
+    """Execute the planned action, then queue up the next plan-ahead step if its preconditions hold."""
+    done_before = len(state["actions_performed"])
+    failed_before = len(state["failed_actions"])
+    state = _execute_action(state)
+    last = state["actions_performed"].last
+    step_done = (len(state["actions_performed"]) > done_before and last.kind == "action"
+                 and len(state["failed_actions"]) == failed_before and bool(state.get("role")))
+    advance_plan(state, get_page(), step_done)
+    return state
+
+def _prompt(message: str) -> str:
+    """Blocking prompt - only reachable in interactive mode."""
+    if not INTERACTIVE:
+        raise RuntimeError(f"Missing input in non-interactive mode: {message.strip()}")
+    return input(message)
+
 def set_goal(state: AgentState) -> AgentState:
-    """Set the goal and website URL"""
-    global screenshots_dir
-    
+    """Set the goal and website URL (from the state, or prompted in interactive mode)"""
     # Get task name for folder organization
-    task_name = input("Enter a name for this task (used for screenshot folder): ").strip()
-    if not task_name:
-        task_name = "untitled_task"
-    
-    # Sanitize folder name (remove special characters)
-    import re
-    safe_name = re.sub(r'[^\w\s-]', '', task_name).strip().replace(' ', '_').lower()
-    
-    # Create task-specific screenshot folder
-    from pathlib import Path
-    screenshots_dir = Path(f"screenshots/{safe_name}")
-    screenshots_dir.mkdir(parents=True, exist_ok=True)
-    print(f"📁 Screenshots will be saved to: {screenshots_dir}/")
+    task_name = (state.get("task_name") or "").strip()
+    if not task_name and INTERACTIVE:
+        task_name = _prompt("Enter a name for this task (used for screenshot folder): ").strip()
+    state["task_name"] = task_name or "untitled_task"
     
     # Get URL and goal
-    url = input("Enter the website URL (e.g., https://example.com): ").strip()
+    url = (state.get("website_url") or "").strip() or _prompt("Enter the website URL (e.g., https://example.com): ").strip()
     
     # Add https:// if missing
     if not url.startswith("http://") and not url.startswith("https://"):
         url = "https://" + url
-        print(f"  → Auto-corrected to: {url}")
+        log(f"  → Auto-corrected to: {url}")
     
     state["website_url"] = url
-    state["goal"] = input("Enter the goal of the agent: ")
+    state["goal"] = (state.get("goal") or "").strip() or _prompt("Enter the goal of the agent: ")
+    _activate_task(state)
     return state
+
+def _task_slug(task_name: str) -> str:
+    """Sanitize a task name for folder names / checkpoint thread ids."""
+    return re.sub(r'[^\w\s-]', '', task_name or "untitled_task").strip().replace(' ', '_').lower()
+
+def _activate_task(state: AgentState):
+    """Point the module-level per-task resources (screenshots, session, budgets, HAR) at this task."""
+    global screenshots_dir, _session_key, _har_path
+    
+    # Create task-specific screenshot folder
+    screenshots_dir = SCREENSHOT_ROOT / _task_slug(state.get("task_name", ""))
+    screenshots_dir.mkdir(parents=True, exist_ok=True)
+    log(f"📁 Screenshots will be saved to: {screenshots_dir}/")
+    try:
+        SCREENSHOTS.prune(keep=screenshots_dir)
+    except OSError as e:
+        log(f"⚠️  Screenshot retention failed: {e}")
+    SCREENSHOTS.stats = dict.fromkeys(SCREENSHOTS.stats, 0)
+    
+    _session_key = session_key(state.get("website_url", ""))
+    _har_path = har_path(state.get("task_name", "")) if HAR_MODE else None
+    
+    # Per-task budgets (state overrides env defaults)
+    USAGE.reset(
+        max_tokens=state.get("token_budget") or int(os.getenv("AGENT_MAX_TOKENS", "0")),
+        max_cost_usd=state.get("cost_budget_usd") or float(os.getenv("AGENT_MAX_COST_USD", "0")),
+    )
+    LOCATOR_STATS.reset()
+    TYPING_STATS.reset()
+    GATEWAY.reset_stats()
+    ROUTE_STATS.reset(route_profile().name)
+
+# ===== Structured step events =====
+# Every node is wrapped so it leaves a structured event in state["last_event"];
+# stream_task() surfaces them incrementally via LangGraph streaming.
+_event_seq = 0
+
+def _report_step(node_fn):
+    """Wrap a node so each call records a structured event (action, element, timing, screenshot)."""
+    node = node_fn.__name__
+
+    def _node(state: AgentState) -> AgentState:
+        global _event_seq
+        started = time.time()
+        planned = {
+            "action": state.get("action_type", ""),
+            "element": {"role": state.get("role", ""), "name_pattern": state.get("name_pattern", "")},
+            "action_text": state.get("action_text", ""),
+        }
+        done_before = len(state.get("actions_performed", []))
+        failed_before = len(state.get("failed_actions", []))
+
+        state = node_fn(state)
+
+        _event_seq += 1
+        event = {
+            "type": "step",
+            "seq": _event_seq,
+            "node": node,
+            "step": i,
+            "url": _page.url if _page is not None else state.get("website_url", ""),
+            "duration_s": round(time.time() - started, 3),
+            "goal_complete": state.get("goal_text_entered", False),
+        }
+        if node == "set_goal":
+            event.update(goal=state.get("goal", ""), website_url=state.get("website_url", ""))
+        elif node == "inspector":
+            event.update(elements=len(state.get("visible_elements", [])),
+                         truncated=(state.get("extraction") or {}).get("truncated", False),
+                         extraction=state.get("extraction", {}),
+                         screenshot=str(screenshots_dir / "step_current.png"),
+                         frame=Path(state.get("screenshot", "")).stem)
+        elif node == "planner":
+            event.update(action=state.get("action_type", ""),
+                         element={"role": state.get("role", ""), "name_pattern": state.get("name_pattern", "")},
+                         action_text=state.get("action_text", ""))
+        elif node == "executor":
+            if len(state.get("failed_actions", [])) > failed_before:
+                outcome = "failed"
+            elif len(state.get("actions_performed", [])) > done_before:
+                outcome = "done"
+            else:
+                outcome = "skipped"
+            locator = state.get("locator") or {}
+            if "hit" in locator:
+                LOCATOR_STATS.record(locator["mode"], locator["hit"], locator["resolve_ms"], event["duration_s"])
+                locator = {**locator, "resolve_ms": round(locator["resolve_ms"], 1)}
+            if state.get("typing"):
+                TYPING_STATS.record(state["typing"])
+                event["typing"] = state["typing"]
+            # Only what this step saved - a step_<i>.png left by an earlier run with the same slug doesn't count
+            step_frame = state.get("step_frame") or {}
+            event.update(planned, outcome=outcome, locator=locator,
+                         screenshot=step_frame.get("path", ""), frame=step_frame.get("sha256", ""))
+        state["last_event"] = event
+        state["usage"] = {name: dict(row) for name, row in USAGE.by_node.items()}
+        return state
+    return _node
+
 def decide_next_action(state: AgentState) -> str:
     """Decide the next action based on the state"""
+    budget_reason = USAGE.exceeded()
+    if budget_reason:
+        log(f"💸 Stopping: {budget_reason}")
+        return "end"
     if state.get("role", "") == "" or state.get("name_pattern", "") == "":
         return "end"
+    elif state.get("plan_next"):
+        return "plan_step"  # queued plan-ahead action, postconditions held - skip re-inspection
     else:
         return "next_action"
 
 
-# Build graph
-graph = StateGraph(AgentState)
-graph.add_node("goal", set_goal)
-graph.add_node("inspector", inspector)
-graph.add_node("planner", planner)
-graph.add_node("executor", executor)
-graph.add_edge(START, "goal")
-graph.add_edge("goal", "inspector")
-graph.add_edge("inspector", "planner")
-graph.add_edge("planner", "executor")
-graph.add_conditional_edges("executor", decide_next_action, {
-    "next_action": "inspector",
-    "end": END
-})
+# Bound by _import_graph_runtime()
+StateGraph = START = END = None
+HumanMessage = SystemMessage = AIMessage = None
+
+def _import_graph_runtime():
+    """Import LangGraph and the message types on first use (AgentState's hints resolve against these globals)."""
+    global StateGraph, START, END, HumanMessage, SystemMessage, AIMessage
+    from langgraph.graph import StateGraph, START, END
+    from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+
+_graph = None
+_app = None
+
+def build_graph():
+    """The (uncompiled) agent graph, built once on first use."""
+    global _graph
+    if _graph is None:
+        _import_graph_runtime()
+        graph = StateGraph(AgentState)
+        graph.add_node("goal", _report_step(set_goal))
+        graph.add_node("inspector", _report_step(inspector))
+        graph.add_node("planner", _report_step(planner))
+        graph.add_node("executor", _report_step(executor))
+        graph.add_edge(START, "goal")
+        graph.add_edge("goal", "inspector")
+        graph.add_edge("inspector", "planner")
+        graph.add_edge("planner", "executor")
+        graph.add_conditional_edges("executor", decide_next_action, {
+            "next_action": "inspector",
+            "plan_step": "executor",
+            "end": END
+        })
+        _graph = graph
+    return _graph
+
+def __getattr__(name: str):
+    # `agent2.graph` / `agent2.app` are built on first access instead of at import
+    if name == "graph":
+        return build_graph()
+    if name == "app":
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# ===== Checkpointing =====
+# With a checkpoint DB, every completed node is saved under the task's thread id,
+# so a crashed run can resume from the last completed node (see stream_task(resume=True)).
+CHECKPOINT_DB = os.getenv("AGENT_CHECKPOINT_DB", "")
+_checkpointed_apps = {}
+
+def make_checkpointer(path: str):
+    """SQLite checkpointer (requires the langgraph-checkpoint-sqlite package)."""
+    import sqlite3
+    try:
+        from langgraph.checkpoint.sqlite import SqliteSaver
+    except ImportError as e:
+        raise RuntimeError("Checkpointing needs: pip install langgraph-checkpoint-sqlite") from e
+    return SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+
+def get_app(checkpoint_db: str = ""):
+    """The compiled graph, with a checkpointer attached when checkpoint_db is set."""
+    global _app
+    if not checkpoint_db:
+        if _app is None:
+            _app = build_graph().compile()
+        return _app
+    if checkpoint_db not in _checkpointed_apps:
+        _checkpointed_apps[checkpoint_db] = build_graph().compile(checkpointer=make_checkpointer(checkpoint_db))
+    return _checkpointed_apps[checkpoint_db]
+
+def _restore_page(state: AgentState):
+    """Re-open the page a checkpointed run was on (the browser restarts blank after a crash)."""
+    resume_url = (state.get("last_event") or {}).get("url") or state.get("last_url") or state.get("website_url")
+    page = get_page()
+    if resume_url and page.url != resume_url:
+        log(f"♻️  Re-navigating to {resume_url}...")
+        page.goto(resume_url, wait_until="load", timeout=60000)
+        page.wait_for_timeout(2000)
+
+def initial_state(goal: str = "", website_url: str = "", task_name: str = "",
+                  token_budget: int = 0, cost_budget_usd: float = 0.0) -> AgentState:
+    """Fresh agent state for one task."""
+    _import_graph_runtime()
+    return {
+        "messages": [HumanMessage(content="Navigate and accomplish the goal")],
+        "screenshot": "",
+        "goal": goal,
+        "website_url": website_url,
+        "role": "",
+        "name_pattern": "",
+        "action_type": "click",
+        "action_text": "",
+        "visible_elements": [],
+        "is_first_visit": True,
+        "actions_performed": ActionHistory(),
+        "failed_actions": ActionHistory(),
+        "state_fingerprints": {},
+        "hover_explored": [],
+        "menu_map": {},
+        "nav_node": "",
+        "nav_pending": {},
+        "nav_routed": "",
+        "nav_skip_route": False,
+        "plan_queue": [],
+        "plan_expect": {},
+        "plan_context": {},
+        "plan_next": False,
+        "goal_text_entered": False,
+        "last_url": "",
+        "token_budget": token_budget,
+        "cost_budget_usd": cost_budget_usd,
+        "stop_reason": "",
+        "task_name": task_name,
+        "last_event": {},
+        "snapshot": {},
+        "last_visible_elements": [],
+        "usage": {},
+        "extraction": {}
+    }
+
+_RELAY_DONE = object()
+
+def stream_task(goal: str, website_url: str, task_name: str = "untitled_task",
+                login_handler: LoginHandler | None = None, interactive: bool = False,
+                token_budget: int = 0, cost_budget_usd: float = 0.0,
+                recursion_limit: int = 50, verbose: bool | None = None,
+                checkpoint_db: str | None = None, resume: bool = False) -> Iterator[dict]:
+    """Run one task and yield a structured event after every node.
 
-app = graph.compile()
+    With checkpoint_db (default AGENT_CHECKPOINT_DB), state is saved after every node
+    under the task name; resume=True continues an unfinished run from its last completed node.
+
+    Step events look like {"type": "step", "node", "step", "action", "element",
+    "duration_s", "screenshot", ...}; the last event is {"type": "done", "final_state": ...}.
+    The browser is kept open between calls; call cleanup_browser() when done.
+    After prewarm_browser(), the graph runs on the browser thread and events are relayed here.
+    """
+    args = (goal, website_url, task_name, login_handler, interactive, token_budget,
+            cost_budget_usd, recursion_limit, verbose, checkpoint_db, resume)
+    if _on_browser_thread():
+        _stop_requested.clear()
+        yield from _stream_task(*args)
+        return
+    events = queue.Queue()
+
+    def pump():
+        try:
+            for event in _stream_task(*args):
+                events.put(event)
+        except BaseException as e:
+            events.put(e)
+        finally:
+            events.put(_RELAY_DONE)
+
+    if _prewarm is not None and not _prewarm.done():
+        log("🚀 Browser still launching in the background...")
+    _stop_requested.clear()
+    _browser_thread.submit(pump)
+    finished = False
+    try:
+        while (item := events.get()) is not _RELAY_DONE:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+        finished = True
+    finally:
+        if not finished:
+            # Ctrl-C or an abandoned generator: let the graph stop at the next node boundary,
+            # so cleanup_browser() queued behind it on the browser thread can run
+            stop_task()
+
+def _stream_task(goal, website_url, task_name, login_handler, interactive, token_budget,
+                 cost_budget_usd, recursion_limit, verbose, checkpoint_db, resume) -> Iterator[dict]:
+    global INTERACTIVE, VERBOSE, _login_handler, _recursion_limit, i
+    INTERACTIVE = interactive
+    _recursion_limit = recursion_limit
+    if verbose is not None:
+        VERBOSE = verbose
+    _login_handler = login_handler
+    i = 0
+    checkpoint_db = CHECKPOINT_DB if checkpoint_db is None else checkpoint_db
+    runner = get_app(checkpoint_db)
+    config = {"recursion_limit": recursion_limit}
+    if checkpoint_db:
+        config["configurable"] = {"thread_id": _task_slug(task_name)}
+    final_state = start = initial_state(goal, website_url, task_name, token_budget, cost_budget_usd)
+    if resume:
+        if not checkpoint_db:
+            raise ValueError("resume=True needs a checkpoint_db")
+        saved = runner.get_state(config)
+        if saved.next:
+            log(f"♻️  Resuming '{task_name}' at {', '.join(saved.next)}")
+            final_state, start = saved.values, None
+            _activate_task(final_state)
+            USAGE.by_node = {name: dict(row) for name, row in final_state.get("usage", {}).items()}
+            i = (final_state.get("last_event") or {}).get("step", 0)
+            _restore_page(final_state)
+        else:
+            log(f"ℹ️  No unfinished checkpoint for '{task_name}' - starting fresh")
+    last_seq = None
+    try:
+        for values in runner.stream(start, config, stream_mode="values"):
+            final_state = values
+            event = values.get("last_event")
+            if event and event.get("seq") != last_seq:
+                last_seq = event.get("seq")
+                yield event
+            if _stop_requested.is_set():
+                log("⏹️  Stop requested - ending the run after this node")
+                final_state = {**final_state, "stop_reason": "interrupted"}
+                break
+    finally:
+        finish_har()
+    yield {
+        "type": "done",
+        "goal_complete": final_state.get("goal_text_entered", False),
+        "stop_reason": final_state.get("stop_reason") or USAGE.exceeded(),
+        "final_state": final_state,
+    }
+
+def run_task(goal: str, website_url: str, task_name: str = "untitled_task",
+             login_handler: LoginHandler | None = None, interactive: bool = False,
+             token_budget: int = 0, cost_budget_usd: float = 0.0,
+             recursion_limit: int = 50, on_step: Callable[[dict], None] | None = None,
+             verbose: bool | None = None, checkpoint_db: str | None = None,
+             resume: bool = False) -> AgentState:
+    """Run one task end-to-end without prompting (unless interactive=True) and return the final state.
+
+    on_step receives every step event from stream_task().
+    """
+    final_state = None
+    for event in stream_task(goal, website_url, task_name, login_handler, interactive,
+                             token_budget, cost_budget_usd, recursion_limit, verbose,
+                             checkpoint_db, resume):
+        if event["type"] == "done":
+            final_state = event["final_state"]
+        elif on_step is not None:
+            try:
+                on_step(event)
+            except Exception as e:
+                log(f"⚠️  Step listener failed: {e}")
+    return final_state
+
+def _parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the UI navigator agent on one task.")
+    parser.add_argument("--task", default="", help="Task name (screenshot folder)")
+    parser.add_argument("--url", default="", help="Starting website URL")
+    parser.add_argument("--goal", default="", help="Goal in plain English")
+    parser.add_argument("--interactive", action="store_true",
+                        help="Prompt for missing fields and pause for manual login")
+    parser.add_argument("--login", choices=["manual", "scripted", "none"], default=None,
+                        help="Login handler (default: manual when interactive, otherwise none)")
+    parser.add_argument("--auth-state", default="", help="Playwright storage_state JSON to restore on login pages")
+    parser.add_argument("--max-tokens", type=int, default=0, help="Per-task token budget")
+    parser.add_argument("--max-cost", type=float, default=0.0, help="Per-task budget in USD")
+    parser.add_argument("--checkpoint-db", default=None,
+                        help="SQLite file for checkpoints (default: AGENT_CHECKPOINT_DB)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume the unfinished checkpointed run named by --task")
+    parser.add_argument("--headless", action="store_true", help="Run Chromium headless (same as AGENT_HEADLESS=1)")
+    parser.add_argument("--route-profile", choices=sorted(ROUTE_PROFILES), default=None,
+                        help="Block heavy requests (default: 'lean' when headless, else 'off')")
+    parser.add_argument("--har", choices=["record", "replay"], default=None,
+                        help="Record this run's traffic to a HAR, or replay the page from one (offline)")
+    parser.add_argument("--har-path", default="", help="HAR file (default: hars/<task>.har)")
+    parser.add_argument("--har-not-found", choices=["abort", "fallback"], default=None,
+                        help="Replay: abort requests missing from the HAR (default) or send them to the network")
+    parser.add_argument("--plan-ahead", action="store_true",
+                        help="Let the planner queue a few follow-up actions with postconditions (fewer model calls)")
+    parser.add_argument("--explore", action="store_true",
+                        help="When the target isn't visible, open candidate menus in parallel pages and harvest them")
+    parser.add_argument("--marks", action="store_true",
+                        help="Set-of-marks mode: number elements on the screenshot, planner answers with a mark")
+    parser.add_argument("--quiet", action="store_true",
+                        help="Turn off progress logging; print one line per step event instead")
+    args = parser.parse_args(argv)
+    if args.resume and not args.task:
+        parser.error("--resume needs the --task name of the run to resume")
+    if not args.interactive and not args.resume and not (args.url and args.goal):
+        parser.error("--url and --goal are required unless --interactive or --resume is given")
+    return args
 
 if __name__ == "__main__":
+    args = _parse_args()
+    if args.marks:
+        SET_OF_MARKS = True
+    if args.explore:
+        EXPLORE_MODE = True
+    if args.plan_ahead:
+        PLAN_AHEAD = True
+    if args.headless:
+        HEADLESS = True
+    if args.route_profile:
+        ROUTE_PROFILE = args.route_profile
+    if args.har:
+        HAR_MODE = args.har
+    if args.har_path:
+        HAR_PATH = args.har_path
+    if args.har_not_found:
+        HAR_NOT_FOUND = args.har_not_found
+    # Flags are applied - Chromium launches on the browser thread while we read the goal and set up the run
+    prewarm_browser()
+    if args.auth_state:
+        login_handler = storage_state_login(args.auth_state)
+    elif args.login == "scripted":
+        login_handler = scripted_login()
+    elif args.login == "manual":
+        login_handler = interactive_login
+    else:
+        login_handler = None
+    if args.interactive and not args.resume:
+        INTERACTIVE = True
+        args.task = args.task or _prompt("Enter a name for this task (used for screenshot folder): ").strip()
+        args.url = args.url or _prompt("Enter the website URL (e.g., https://example.com): ").strip()
+        args.goal = args.goal or _prompt("Enter the goal of the agent: ")
     try:
-        init_state = {
-            "messages": [HumanMessage(content="Navigate and accomplish the goal")],
-            "screenshot": "",
-            "img_base64": "",
-            "goal": "",
-            "website_url": "",
-            "role": "",
-            "name_pattern": "",
-            "action_type": "click",
-            "action_text": "",
-            "visible_elements": [],
-            "is_first_visit": True,
-            "actions_performed": [],
-            "failed_actions": [],
-            "hover_explored": [],
-            "goal_text_entered": False,
-            "last_url": ""
-        }
-        
-        config = {"recursion_limit": 50}
-        final_state = app.invoke(init_state, config)
+        final_state = None
+        for event in stream_task(
+            goal=args.goal,
+            website_url=args.url,
+            task_name=args.task,
+            login_handler=login_handler,
+            interactive=args.interactive,
+            token_budget=args.max_tokens,
+            cost_budget_usd=args.max_cost,
+            verbose=not args.quiet,
+            checkpoint_db=args.checkpoint_db,
+            resume=args.resume,
+        ):
+            if event["type"] == "done":
+                final_state = event["final_state"]
+            elif args.quiet:
+                element = event.get("element") or {}
+                target = f" [{element.get('role')}] /{element.get('name_pattern')}/" if element.get("role") else ""
+                print(f"#{event['step']:>3} {event['node']:<10}{event.get('action', '')}{target}"
+                      f" {event.get('outcome', '')} ({event['duration_s']:.2f}s)")
         
         print("\n" + "="*70)
         print("COMPLETE")
@@ -2132,8 +4897,24 @@ if __name__ == "__main__":
         print(f"Messages exchanged: {len(final_state['messages'])}")
         print(f"📁 Screenshots saved to: {screenshots_dir}/")
         print(f"   Total steps captured: {i}")
+        stop_reason = final_state.get("stop_reason") or USAGE.exceeded()
+        if stop_reason:
+            print(f"⚠️  Stopped early: {stop_reason}")
+        print("\n💸 Model usage:")
+        print(USAGE.summary())
+        print(f"🚥 LLM gateway: {GATEWAY.summary()}")
+        if ROUTE_STATS.profile != "off":
+            print(f"\n🚦 Network: {ROUTE_STATS.summary()}")
+        if LOCATOR_STATS.by_mode:
+            print("\n🎯 Locator resolution:")
+            print(LOCATOR_STATS.summary())
+        if TYPING_STATS.by_method:
+            print("\n⌨️  Text entry:")
+            print(TYPING_STATS.summary())
+        print(f"\n🗂️  Screenshots: {SCREENSHOTS.summary()}")
         
     finally:
         # Clean up Playwright resources
         print("\n🧹 Cleaning up...")
+        stop_task()  # an interrupted run stops at its next node, then the browser closes
         cleanup_browser()
\ No newline at end of file
@@ -0,0 +1,345 @@
+"""FastAPI job service for the UI navigator agent.
+
+Goals are submitted over HTTP into a bounded queue and picked up by a pool of
+worker processes. Each worker owns a warm Chromium instance (Playwright's sync
+API is single-threaded, so one browser per process) and reuses it across jobs.
+Step progress is streamed to clients over Server-Sent Events.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from fastapi import FastAPI, HTTPException
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SCREENSHOTS_DIR = REPO_ROOT / "screenshots"
+
+NUM_WORKERS = int(os.getenv("AGENT_WORKERS", "2"))
+QUEUE_SIZE = int(os.getenv("AGENT_QUEUE_SIZE", "16"))
+RECURSION_LIMIT = int(os.getenv("AGENT_RECURSION_LIMIT", "50"))
+
+
+class TaskRequest(BaseModel):
+    goal: str
+    url: str = "https://www.notion.so"
+    task_name: str = ""
+    max_tokens: int = 0
+    max_cost_usd: float = 0.0
+
+
+# ---------- Worker process ----------
+
+def _worker_main(worker_id: int, jobs: mp.Queue, events: mp.Queue):
+    """Worker loop: keep one browser warm and run jobs until a None sentinel arrives."""
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, str(REPO_ROOT))
+    import agent2
+
+    def send(job_id, kind, **data):
+        events.put({"job_id": job_id, "worker": worker_id, "type": kind, "ts": time.time(), **data})
+
+    try:
+        agent2.ensure_browser()
+    except Exception as e:
+        send(None, "worker_error", error=f"browser launch failed: {e}")
+    send(None, "worker_ready")
+
+    login_handler = agent2.scripted_login() if os.getenv("AGENT_LOGIN_EMAIL") else None
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id = job["job_id"]
+        send(job_id, "started")
+        try:
+            final_state = agent2.run_task(
+                goal=job["goal"],
+                website_url=job["url"],
+                task_name=job["run_key"],
+                login_handler=login_handler,
+                token_budget=job["max_tokens"],
+                cost_budget_usd=job["max_cost_usd"],
+                recursion_limit=RECURSION_LIMIT,
+                on_step=lambda event: send(job_id, "step", **event),
+            )
+            send(job_id, "finished",
+                 goal_complete=bool(final_state.get("goal_text_entered")),
+                 stop_reason=final_state.get("stop_reason") or agent2.USAGE.exceeded(),
+                 usage=agent2.USAGE.by_node,
+                 network=agent2.ROUTE_STATS.summary(),
+                 llm=agent2.GATEWAY.stats)
+        except Exception as e:
+            send(job_id, "failed", error=str(e)[:500])
+            # A crashed run may leave the browser unusable - start clean for the next job
+            try:
+                agent2.cleanup_browser()
+                agent2.ensure_browser()
+            except Exception:
+                pass
+    agent2.cleanup_browser()
+
+
+# ---------- Job bookkeeping (API process) ----------
+
+def _run_key(task_name: str, job_id: str) -> str:
+    """Per-job task name: screenshot folder, checkpoint thread and HAR stay apart across jobs.
+    Already in agent2._task_slug form, so the agent uses it unchanged."""
+    slug = re.sub(r'[^\w\s-]', '', task_name).strip().replace(' ', '_').lower()
+    return f"{slug}-{job_id}" if slug else job_id
+
+class JobService:
+    def __init__(self, num_workers: int, queue_size: int):
+        self.ctx = mp.get_context("spawn")
+        self.jobs_queue = self.ctx.Queue(maxsize=queue_size)
+        self.events_queue = self.ctx.Queue()
+        self.queue_size = queue_size
+        self.workers = [self._spawn(n) for n in range(num_workers)]
+        self.stopping = False
+        self.jobs: dict[str, dict] = {}
+        self.worker_busy_since: dict[int, float | None] = {n: None for n in range(num_workers)}
+        self.worker_busy_total: dict[int, float] = {n: 0.0 for n in range(num_workers)}
+        self.workers_ready: set[int] = set()
+        self.llm = {"calls": 0, "retries": 0, "failures": 0, "queue_s": 0.0, "max_queue_s": 0.0}
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self._pump = threading.Thread(target=self._pump_events, daemon=True)
+
+    def _spawn(self, worker_id: int) -> mp.Process:
+        return self.ctx.Process(target=_worker_main, args=(worker_id, self.jobs_queue, self.events_queue),
+                                daemon=True)
+
+    def start(self):
+        for w in self.workers:
+            w.start()
+        self._pump.start()
+
+    def stop(self):
+        self.stopping = True
+        for _ in self.workers:
+            try:
+                self.jobs_queue.put_nowait(None)
+            except queue.Full:
+                break
+        for w in self.workers:
+            w.join(timeout=10)
+            if w.is_alive():
+                w.terminate()
+        self.events_queue.put(None)
+
+    def submit(self, req: TaskRequest) -> str:
+        job_id = uuid.uuid4().hex[:12]
+        url = req.url.strip()
+        if not url.startswith(("http://", "https://")):
+            url = "https://" + url
+        job = {
+            "job_id": job_id,
+            "goal": req.goal,
+            "url": url,
+            "task_name": req.task_name or job_id,
+            "run_key": _run_key(req.task_name, job_id),
+            "max_tokens": req.max_tokens,
+            "max_cost_usd": req.max_cost_usd,
+        }
+        with self.lock:
+            self.jobs[job_id] = {**job, "status": "queued", "created": time.time(),
+                                 "started": None, "finished": None, "worker": None,
+                                 "events": [], "error": ""}
+        try:
+            self.jobs_queue.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                del self.jobs[job_id]
+            raise
+        return job_id
+
+    def _pump_events(self):
+        """Move worker events into job records (SSE readers poll these lists); reap dead workers."""
+        while True:
+            try:
+                event = self.events_queue.get(timeout=1.0)
+            except queue.Empty:
+                event = False
+            if event is None:
+                return
+            with self.lock:
+                if event:
+                    self._apply(event)
+                self._reap_workers()
+
+    def _reap_workers(self):
+        """Fail the job of any worker that died (OOM, crash) and start a replacement."""
+        if self.stopping:
+            return
+        for worker_id, proc in enumerate(self.workers):
+            if proc.is_alive() or proc.exitcode is None:
+                continue
+            now = time.time()
+            for job in self.jobs.values():
+                if job["status"] == "running" and job["worker"] == worker_id:
+                    self._apply({"job_id": job["job_id"], "worker": worker_id, "type": "failed", "ts": now,
+                                 "error": f"worker {worker_id} exited unexpectedly (exit code {proc.exitcode})"})
+            self.workers_ready.discard(worker_id)
+            self.workers[worker_id] = self._spawn(worker_id)
+            self.workers[worker_id].start()
+
+    def _apply(self, event: dict):
+        worker, kind, ts = event["worker"], event["type"], event["ts"]
+        if kind == "worker_ready":
+            self.workers_ready.add(worker)
+            return
+        job = self.jobs.get(event.get("job_id") or "")
+        if job is None:
+            return
+        job["events"].append(event)
+        if kind == "started":
+            job.update(status="running", started=ts, worker=worker)
+            self.worker_busy_since[worker] = ts
+        elif kind in ("finished", "failed"):
+            job.update(status="completed" if kind == "finished" else "failed",
+                       finished=ts, error=event.get("error", ""))
+            since = self.worker_busy_since.get(worker)
+            if since:
+                self.worker_busy_total[worker] += ts - since
+            self.worker_busy_since[worker] = None
+            llm = event.get("llm") or {}
+            for key in ("calls", "retries", "failures", "queue_s"):
+                self.llm[key] += llm.get(key, 0)
+            self.llm["max_queue_s"] = max(self.llm["max_queue_s"], llm.get("max_queue_s", 0.0))
+
+    def metrics(self) -> dict:
+        now = time.time()
+        with self.lock:
+            statuses = [j["status"] for j in self.jobs.values()]
+            busy = sum(1 for since in self.worker_busy_since.values() if since)
+            busy_seconds = sum(
+                total + ((now - self.worker_busy_since[w]) if self.worker_busy_since[w] else 0)
+                for w, total in self.worker_busy_total.items()
+            )
+            waits = [j["started"] - j["created"] for j in self.jobs.values() if j["started"]]
+            llm = dict(self.llm)
+        uptime = max(now - self.started_at, 1e-9)
+        return {
+            "queue_depth": statuses.count("queued"),
+            "queue_capacity": self.queue_size,
+            "workers": len(self.workers),
+            "workers_ready": len(self.workers_ready),
+            "workers_busy": busy,
+            "worker_utilization": round(busy_seconds / (uptime * max(len(self.workers), 1)), 4),
+            "jobs_running": statuses.count("running"),
+            "jobs_completed": statuses.count("completed"),
+            "jobs_failed": statuses.count("failed"),
+            "avg_queue_wait_s": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "llm_calls": llm["calls"],
+            "llm_retries": llm["retries"],
+            "llm_failures": llm["failures"],
+            "llm_avg_queue_delay_s": round(llm["queue_s"] / llm["calls"], 3) if llm["calls"] else 0.0,
+            "llm_max_queue_delay_s": round(llm["max_queue_s"], 3),
+        }
+
+
+service = JobService(NUM_WORKERS, QUEUE_SIZE)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    service.start()
+    yield
+    service.stop()
+
+
+app = FastAPI(title="UI Navigator Agent", lifespan=lifespan)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:3000"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+def _job_or_404(session_id: str) -> dict:
+    job = service.jobs.get(session_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown session")
+    return job
+
+
+@app.post("/api/task")
+def submit_task(req: TaskRequest):
+    try:
+        job_id = service.submit(req)
+    except queue.Full:
+        raise HTTPException(status_code=503, detail="Job queue is full, retry later",
+                            headers={"Retry-After": "30"})
+    return {"session_id": job_id, "status": "queued"}
+
+
+@app.get("/api/session/{session_id}")
+def get_session(session_id: str):
+    job = _job_or_404(session_id)
+    with service.lock:
+        steps = [e for e in job["events"] if e["type"] == "step"]
+        return {k: v for k, v in job.items() if k != "events"} | {"steps": len(steps)}
+
+
+@app.get("/api/session/{session_id}/events")
+async def stream_events(session_id: str):
+    """Server-Sent Events: every job event, then the stream closes when the job ends."""
+    job = _job_or_404(session_id)
+
+    async def event_source():
+        sent = 0
+        while True:
+            with service.lock:
+                pending = job["events"][sent:]
+                done = job["status"] in ("completed", "failed")
+            for event in pending:
+                yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+            sent += len(pending)
+            if done and not pending:
+                return
+            if not pending:
+                yield ": keep-alive\n\n"
+                await asyncio.sleep(0.5)
+
+    return StreamingResponse(event_source(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/api/snapshots/{session_id}")
+def list_snapshots(session_id: str):
+    folder = SCREENSHOTS_DIR / _job_or_404(session_id)["run_key"]
+    files = sorted(folder.glob("step_*.png"), key=lambda p: (len(p.stem), p.stem)) if folder.exists() else []
+    return {"session_id": session_id,
+            "screenshots": [f"/api/screenshot/{session_id}/{p.name}" for p in files]}
+
+
+@app.get("/api/screenshot/{session_id}/{filename}")
+def get_screenshot(session_id: str, filename: str):
+    path = (SCREENSHOTS_DIR / _job_or_404(session_id)["run_key"] / filename).resolve()
+    if SCREENSHOTS_DIR.resolve() not in path.parents or not path.is_file():
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    return FileResponse(path)
+
+
+@app.get("/api/metrics")
+def get_metrics():
+    return service.metrics()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8000)
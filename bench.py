@@ -0,0 +1,311 @@
+"""Micro-benchmarks for agent2's hot paths (no browser or API key needed unless noted).
+
+Usage:
+    python bench.py elements [--n 5000]
+    python bench.py extractors [--runs 5] [URL ...]   # needs Playwright + Chromium
+    python bench.py routes [--runs 3] [URL ...]       # needs Playwright + Chromium + network
+    python bench.py replay URL [--har hars/bench.har] [--record] [--runs 10]   # offline after one recording
+    python bench.py startup [--runs 5] [--budget-ms 150]   # exits 1 if `import agent2` is over budget
+"""
+import argparse
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import agent2
+
+
+def make_ax_fixture(n: int, seed: int = 7) -> dict:
+    """Accessibility snapshot shaped like a big Notion database: n interactive nodes in rows/cells/treeitems."""
+    rng = random.Random(seed)
+    sidebar = {"role": "navigation", "name": "Sidebar", "children": [
+        {"role": "treeitem", "name": f"Page {k}", "children": [{"role": "text", "name": f"Page {k}"}]}
+        for k in range(n // 10)
+    ]}
+    rows = []
+    made = len(sidebar["children"])
+    r = 0
+    while made < n:
+        cells = [{"role": "gridcell", "name": f"Task {r} {col}"} for col in ("name", "status", "assignee")]
+        rows.append({"role": "row", "name": f"Task {r}", "children": cells})
+        made += 1 + len(cells)
+        r += 1
+    # Realistic duplicates: repeated toolbar buttons and re-rendered rows
+    toolbar = [{"role": "button", "name": name} for name in ("New", "Filter", "Sort", "+ New", "+ New", "+ New")]
+    rows += rng.sample(rows, k=min(len(rows), n // 20))
+    return {"role": "WebArea", "name": "Fixture", "children": [
+        sidebar,
+        {"role": "main", "name": "", "children": toolbar + [{"role": "grid", "name": "Tasks", "children": rows}]},
+    ]}
+
+
+def legacy_extract(tree: dict) -> list[dict]:
+    """The pre-registry extraction: list scan for every dedupe check (O(n^2))."""
+    visible_elements = []
+
+    def extract_elements(node):
+        role, name = node.get("role", ""), node.get("name", "")
+        if role in agent2.INTERACTIVE_ROLES and name and len(name) < 150:
+            if not any(el['name'] == name and el['role'] == role for el in visible_elements):
+                visible_elements.append({"role": role, "name": name, "description": f"{role} '{name}'"})
+        for child in node.get("children", []):
+            extract_elements(child)
+
+    extract_elements(tree)
+    return visible_elements
+
+
+def registry_extract(tree: dict, max_elements: int = 0, time_budget_ms: float = 0) -> list[dict]:
+    registry = agent2.ElementRegistry()
+    agent2.collect_ax_elements(tree, registry, max_elements=max_elements, time_budget_ms=time_budget_ms)
+    return registry.to_list()
+
+
+def _time(fn, *args, repeat: int = 3) -> tuple[float, object]:
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def bench_elements(args):
+    tree = make_ax_fixture(args.n)
+    legacy_s, legacy = _time(legacy_extract, tree)
+    registry_s, current = _time(registry_extract, tree)
+    print(f"fixture: ~{args.n} interactive nodes")
+    print(f"legacy list scan : {legacy_s * 1000:8.1f} ms  ({len(legacy)} elements)")
+    print(f"ElementRegistry  : {registry_s * 1000:8.1f} ms  ({len(current)} elements)")
+    print(f"speedup          : {legacy_s / max(registry_s, 1e-9):8.1f}x")
+
+    registry = agent2.ElementRegistry()
+    started = time.perf_counter()
+    stats = agent2.collect_ax_elements(tree, registry)  # default AX_MAX_ELEMENTS / AX_TIME_BUDGET_MS
+    budget_s = time.perf_counter() - started
+    print(f"budgeted walk    : {budget_s * 1000:8.1f} ms  ({len(registry)} elements; {stats.summary()})")
+
+
+FIXTURE_SITES = ["https://example.com", "https://www.notion.so", "https://linear.app", "https://github.com"]
+
+
+def _extract_snapshot(page) -> tuple[list[dict], agent2.AXWalkStats]:
+    registry = agent2.ElementRegistry()
+    stats = agent2.collect_ax_elements(page.accessibility.snapshot(), registry)
+    return registry.to_list(), stats
+
+
+def _extract_cdp(page) -> tuple[list[dict], agent2.AXWalkStats]:
+    registry = agent2.ElementRegistry()
+    stats = agent2.cdp_collect_elements(page, registry)
+    return registry.to_list(), stats
+
+
+def bench_extractors(args):
+    from playwright.sync_api import sync_playwright
+
+    backends = {"ax_snapshot": _extract_snapshot, "cdp": _extract_cdp}
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=True)
+        page = browser.new_page(viewport={"width": 1280, "height": 800})
+        print(f"{'site':<28} {'backend':<12} {'median ms':>10} {'elements':>9}  notes")
+        for url in args.urls or FIXTURE_SITES:
+            try:
+                page.goto(url, wait_until="load", timeout=30000)
+            except Exception as e:
+                print(f"{url:<28} skipped ({str(e).splitlines()[0][:60]})")
+                continue
+            for name, extract in backends.items():
+                timings, elements, stats = [], [], None
+                for _ in range(args.runs):
+                    started = time.perf_counter()
+                    elements, stats = extract(page)
+                    timings.append((time.perf_counter() - started) * 1000)
+                print(f"{url:<28} {name:<12} {statistics.median(timings):10.1f} {len(elements):9d}  {stats.summary()}")
+        browser.close()
+
+
+def _load_with_profile(browser, url: str, profile) -> dict:
+    """Fresh context, one navigation: load/networkidle times, requests and bytes actually transferred."""
+    context = browser.new_context(viewport={"width": 1280, "height": 800})
+    stats = agent2.RouteStats()
+    agent2.install_route_profile(context, profile, stats)
+    finished = []
+    page = context.new_page()
+    page.on("requestfinished", finished.append)
+    started = time.perf_counter()
+    page.goto(url, wait_until="load", timeout=60000)
+    load_ms = (time.perf_counter() - started) * 1000
+    try:
+        page.wait_for_load_state("networkidle", timeout=30000)
+    except Exception:
+        pass
+    idle_ms = (time.perf_counter() - started) * 1000
+    transferred = 0
+    for request in finished:
+        try:
+            sizes = request.sizes()
+            transferred += sizes["responseBodySize"] + sizes["responseHeadersSize"]
+        except Exception:
+            pass
+    context.close()
+    return {"load_ms": load_ms, "idle_ms": idle_ms, "requests": len(finished) + stats.blocked + stats.stubbed,
+            "skipped": stats.blocked + stats.stubbed, "bytes": transferred}
+
+
+def bench_routes(args):
+    from playwright.sync_api import sync_playwright
+
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=True)
+        print(f"{'site':<28} {'profile':<8} {'load ms':>8} {'idle ms':>8} {'requests':>9} {'skipped':>8} {'MB':>7}")
+        for url in args.urls or FIXTURE_SITES:
+            baseline = None
+            for name in ("off", "lean", "minimal"):
+                runs = []
+                for _ in range(args.runs):
+                    try:
+                        runs.append(_load_with_profile(browser, url, agent2.ROUTE_PROFILES[name]))
+                    except Exception as e:
+                        print(f"{url:<28} {name:<8} failed ({str(e).splitlines()[0][:60]})")
+                        break
+                if not runs:
+                    continue
+                row = {k: statistics.median(r[k] for r in runs) for k in runs[0]}
+                baseline = baseline or row
+                delta = ""
+                if row is not baseline:
+                    delta = (f"  load {row['load_ms'] - baseline['load_ms']:+.0f} ms,"
+                             f" {(baseline['bytes'] - row['bytes']) / 1e6:.2f} MB saved")
+                print(f"{url:<28} {name:<8} {row['load_ms']:8.0f} {row['idle_ms']:8.0f} {row['requests']:9.0f}"
+                      f" {row['skipped']:8.0f} {row['bytes'] / 1e6:7.2f}{delta}")
+        browser.close()
+
+
+def bench_replay(args):
+    """Load + settle + extract the same page repeatedly from a HAR, so timings only move when code does."""
+    from pathlib import Path
+    from playwright.sync_api import sync_playwright
+
+    har = Path(args.har)
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=True)
+        if args.record or not har.exists():
+            har.parent.mkdir(parents=True, exist_ok=True)
+            context = browser.new_context(viewport={"width": 1280, "height": 800},
+                                          record_har_path=str(har), record_har_content="embed")
+            page = context.new_page()
+            page.goto(args.url, wait_until="load", timeout=60000)
+            try:
+                page.wait_for_load_state("networkidle", timeout=30000)
+            except Exception:
+                pass
+            context.close()
+            print(f"recorded {args.url} -> {har} ({har.stat().st_size / 1e6:.1f} MB)")
+
+        rows = []
+        for _ in range(args.runs):
+            context = browser.new_context(viewport={"width": 1280, "height": 800})
+            context.route_from_har(str(har), not_found=args.not_found)
+            page = context.new_page()
+            started = time.perf_counter()
+            page.goto(args.url, wait_until="load", timeout=60000)
+            load_ms = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            try:
+                page.wait_for_load_state("networkidle", timeout=10000)
+            except Exception:
+                pass
+            settle_ms = (time.perf_counter() - started) * 1000
+            elements, stats = _extract_snapshot(page)
+            extract_ms = (time.perf_counter() - started) * 1000 - settle_ms
+            rows.append((load_ms, settle_ms, extract_ms, len(elements)))
+            context.close()
+        browser.close()
+
+    print(f"replayed {args.runs}x from {har} (unmatched requests: {args.not_found})")
+    for label, col in (("load ms", 0), ("settle ms", 1), ("extract ms", 2), ("elements", 3)):
+        values = [r[col] for r in rows]
+        spread = statistics.stdev(values) if len(values) > 1 else 0.0
+        print(f"{label:<11}: median {statistics.median(values):8.1f}  stdev {spread:7.1f}  "
+              f"min {min(values):8.1f}  max {max(values):8.1f}")
+
+
+IMPORT_BUDGET_MS = 150
+HEAVY_MODULES = ("langgraph", "langchain_core", "openai", "playwright")
+
+
+def _importtime(code: str) -> dict[str, tuple[int, int]]:
+    """Run `code` in a fresh interpreter under -X importtime; module -> (cumulative us, nesting depth)."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _self_us, cumulative_us, raw_name = line.removeprefix("import time:").split("|")
+        depth = (len(raw_name) - len(raw_name.lstrip()) - 1) // 2
+        times.setdefault(raw_name.strip(), (int(cumulative_us), depth))
+    return times
+
+
+def bench_startup(args):
+    runs = [_importtime("import agent2") for _ in range(args.runs)]
+    import_ms = statistics.median(r["agent2"][0] / 1000 for r in runs)
+    last = runs[-1]
+    heavy = sorted({name.split(".")[0] for name in last} & set(HEAVY_MODULES))
+    print(f"import agent2      : {import_ms:8.1f} ms (median of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    print(f"heavy deps loaded : {', '.join(heavy) or 'none'}")
+    print("slowest imports under agent2 (cumulative):")
+    direct = [(cum, name) for name, (cum, depth) in last.items() if depth == 1]
+    for cum, name in sorted(direct, reverse=True)[:args.top]:
+        print(f"  {cum / 1000:8.1f} ms  {name}")
+
+    # What the deferral moved: the same imports done eagerly, as the first task triggers them
+    try:
+        eager = _importtime("import agent2; agent2.get_app(); import openai, playwright.sync_api")
+    except subprocess.CalledProcessError:
+        print("eager (old) import: skipped - langgraph/openai/playwright not installed")
+    else:
+        eager_ms = sum(cum for cum, depth in eager.values() if depth == 0) / 1000
+        print(f"eager (old) import: {eager_ms:8.1f} ms incl. langgraph, langchain_core, openai, playwright")
+
+    if import_ms > args.budget_ms:
+        print(f"FAIL: import agent2 took {import_ms:.1f} ms > {args.budget_ms:.0f} ms budget")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("elements", help="Element extraction + dedupe on a synthetic AX tree")
+    p.add_argument("--n", type=int, default=5000)
+    p.set_defaults(func=bench_elements)
+    p = sub.add_parser("extractors", help="Accessibility snapshot vs CDP extraction on live sites")
+    p.add_argument("urls", nargs="*", help=f"Sites to load (default: {', '.join(FIXTURE_SITES)})")
+    p.add_argument("--runs", type=int, default=5)
+    p.set_defaults(func=bench_extractors)
+    p = sub.add_parser("routes", help="Page load with each request-interception profile")
+    p.add_argument("urls", nargs="*", help=f"Sites to load (default: {', '.join(FIXTURE_SITES)})")
+    p.add_argument("--runs", type=int, default=3)
+    p.set_defaults(func=bench_routes)
+    p = sub.add_parser("replay", help="Repeatable offline page load + extraction from a HAR")
+    p.add_argument("url")
+    p.add_argument("--har", default="hars/bench.har")
+    p.add_argument("--record", action="store_true", help="Re-record the HAR before replaying")
+    p.add_argument("--not-found", choices=["abort", "fallback"], default="abort")
+    p.add_argument("--runs", type=int, default=10)
+    p.set_defaults(func=bench_replay)
+    p = sub.add_parser("startup", help="`import agent2` time under -X importtime, against a budget")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    p.add_argument("--top", type=int, default=10)
+    p.set_defaults(func=bench_startup)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
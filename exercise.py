@@ -1,8 +1,10 @@
 from playwright.sync_api import sync_playwright
 import re
+import time
 from openai import OpenAI
 from dotenv import load_dotenv
 import json
+from agent2 import ROUTE_STATS, install_route_profile
 load_dotenv()
 
 user_goal = input("Enter your goal: ")
@@ -54,11 +56,15 @@ print(json.dumps(plan, indent=2))
 with sync_playwright() as p:
     browser = p.chromium.launch(headless=False)
     context = browser.new_context(viewport={"width": 1280, "height": 800})
+    install_route_profile(context)  # AGENT_ROUTE_PROFILE=lean|minimal skips media, fonts and analytics
     page = context.new_page()
 
     print("\n🌐 Navigating to Notion...")
+    started = time.perf_counter()
     page.goto("https://www.notion.com/", wait_until="domcontentloaded", timeout=60000)
     page.wait_for_load_state("networkidle")
+    ROUTE_STATS.load_ms = (time.perf_counter() - started) * 1000
+    print(f"🚦 {ROUTE_STATS.summary()}")
 
     # Execute each step
     for i, step in enumerate(plan.get("steps", []), 1):
@@ -0,0 +1,55 @@
+"""Inspector smoke test against a stub page (no browser needed)."""
+import agent2
+
+
+class _EmptyLocator:
+    first = property(lambda self: self)
+
+    def all(self):
+        return []
+
+    def count(self):
+        return 0
+
+
+class _EmptyPage:
+    """A loaded page whose accessibility tree and DOM have no interactive elements."""
+    url = "https://example.com/app"
+    frames = []
+    main_frame = None
+    viewport_size = {"width": 1280, "height": 800}
+
+    class accessibility:
+        @staticmethod
+        def snapshot():
+            return None
+
+    def wait_for_timeout(self, ms):
+        pass
+
+    def locator(self, selector):
+        return _EmptyLocator()
+
+    def evaluate(self, script, *args):
+        raise RuntimeError("no JS in the stub page")
+
+    def screenshot(self):
+        return agent2._PIXEL_PNG
+
+
+def test_inspector_on_empty_page(tmp_path, monkeypatch):
+    monkeypatch.setattr(agent2, "get_page", lambda: _EmptyPage())
+    monkeypatch.setattr(agent2, "screenshots_dir", tmp_path / "task")
+    monkeypatch.setattr(agent2, "SCREENSHOTS", agent2.ScreenshotStore(tmp_path / ".store"))
+    monkeypatch.setattr(agent2, "NAV_DIR", tmp_path / "navgraphs")
+    monkeypatch.setattr(agent2, "i", 3)
+    (tmp_path / "task").mkdir()
+    state = agent2.initial_state(goal="open settings", website_url="https://example.com/app", task_name="t")
+    state["is_first_visit"] = False
+
+    state = agent2.inspector(state)
+
+    assert state["visible_elements"] == []
+    assert state["extraction"]["truncated"] is False
+    manifest = (tmp_path / "task" / agent2.SCREENSHOT_MANIFEST).read_text().splitlines()
+    assert [agent2.json.loads(line)["step"] for line in manifest] == [3]
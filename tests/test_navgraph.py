@@ -0,0 +1,31 @@
+"""Navigation-graph routing: learned destinations are reused under a different goal wording."""
+import agent2
+
+
+def _graph(tmp_path):
+    nav = agent2.NavGraph("notion", tmp_path / "notion.json")
+    nav.observe("notion.so/workspace", "Home")
+    nav.observe("notion.so/workspace#modal:Settings", "Settings")
+    nav.observe("notion.so/workspace#modal:Settings/members", "Members")
+    nav.add_edge("notion.so/workspace", "notion.so/workspace#modal:Settings",
+                 {"action_type": "click", "role": "button", "name_pattern": "Settings", "action_text": ""})
+    return nav
+
+
+def test_route_reuses_destination_for_other_wording(tmp_path):
+    nav = _graph(tmp_path)
+    nav.mark_goal("notion.so/workspace#modal:Settings", "open Settings")
+
+    target, path = nav.route("notion.so/workspace", "go to settings → members")
+
+    assert target == "notion.so/workspace#modal:Settings"
+    assert [edge["action"]["name_pattern"] for _, edge in path] == ["Settings"]
+
+
+def test_route_ignores_unrelated_goals_and_unlearned_nodes(tmp_path):
+    nav = _graph(tmp_path)
+    assert nav.route("notion.so/workspace", "go to settings") is None  # nothing completed there yet
+    nav.mark_goal("notion.so/workspace#modal:Settings", "open Settings")
+    assert nav.route("notion.so/workspace", "create a new page called Ideas") is None
+    # Already at the destination: no better match to route to
+    assert nav.route("notion.so/workspace#modal:Settings", "settings") is None